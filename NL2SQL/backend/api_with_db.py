@@ -178,13 +178,14 @@ async def query_data(request: Dict[str, Any]):
                 result = agent.query_data(query)
                 
                 if result["success"]:
-                    print(f"[CSV查询] 查询成功: SQL={result.get('sql', '')[:50]}..., 数据行数={len(result.get('data', []))}")
+                    result_set = result["result_set"]
+                    print(f"[CSV查询] 查询成功: SQL={result.get('sql', '')[:50]}..., 数据行数={result_set.row_count}")
                     return {
                         "success": True,
                         "answer": result.get("answer", "查询完成"),
                         "sql": result.get("sql"),
                         "reasoning": result.get("reasoning"),
-                        "data": result.get("data", []),
+                        "data": result_set.to_records(),
                         "total_rows": result.get("returned_rows", 0),
                         "returned_rows": result.get("returned_rows", 0),
                         "columns": result.get("columns", file_info["columns"]),
@@ -246,7 +247,7 @@ async def query_data(request: Dict[str, Any]):
             # 新的 sql_agent 已经提取了 SQL、推理步骤和数据
             sql_query = result.get("sql")
             reasoning_steps = result.get("reasoning", [])
-            data = result.get("data", [])
+            data = result["result_set"].to_records()
             columns = result.get("columns", [])
 
             # 如果没有数据，使用 data_manager 作为后备
@@ -287,12 +288,21 @@ async def query_data(request: Dict[str, Any]):
                     f"执行查询并返回结果"
                 ]
             elif "销售" in query and "额" in query:
-                result["sql"] = f"SELECT SUM(price * sales_volume) as total FROM {table_name}"
-                result["reasoning"] = [
-                    "识别到用户想要计算销售总额",
-                    "需要使用SUM函数对price * sales_volume求和",
-                    "执行聚合查询获取总销售额"
-                ]
+                metric_sql = _metric_sql(query, table_name)
+                if metric_sql:
+                    result["sql"] = metric_sql
+                    result["reasoning"] = [
+                        "识别到用户想要计算销售额",
+                        "按指标目录中销售额的统一口径生成SQL",
+                        "执行聚合查询获取销售额"
+                    ]
+                else:
+                    result["sql"] = f"SELECT SUM(price * sales_volume) as total FROM {table_name}"
+                    result["reasoning"] = [
+                        "识别到用户想要计算销售总额",
+                        "需要使用SUM函数对price * sales_volume求和",
+                        "执行聚合查询获取总销售额"
+                    ]
             elif "统计" in query or "数量" in query:
                 result["sql"] = f"SELECT COUNT(*) FROM {table_name}"
                 result["reasoning"] = [
@@ -336,6 +346,28 @@ async def query_data(request: Dict[str, Any]):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _metric_sql(query: str, table_name: str) -> Optional[str]:
+    """按指标目录（metrics/default.json）中问题提到的指标生成SQL，没有匹配的指标时返回 None"""
+    if not LANGCHAIN_AVAILABLE:
+        return None
+    try:
+        from sqlalchemy import create_engine
+        from app.metrics import metric_catalogs, render_sql
+
+        catalog = metric_catalogs.get(None)
+        metric = catalog.find_metric(query, table_name) if catalog else None
+        if metric is None:
+            return None
+        engine = create_engine(f"sqlite:///{data_manager.db_path}")
+        try:
+            sql, params = metric_catalogs.compile(None, {"metrics": [metric["name"]]}, engine)
+            return render_sql(engine, sql, params)
+        finally:
+            engine.dispose()
+    except Exception as e:
+        print(f"Warning: metric catalog lookup failed: {e}")
+        return None
+
 @app.post("/chat")
 async def chat_with_data(request: Dict[str, Any]):
     """对话功能"""
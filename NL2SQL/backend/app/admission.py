@@ -0,0 +1,219 @@
+"""
+LLM 查询的准入控制
+/query 和 /chat 的每个问题都会串行调用模型多次，突发流量下无限制的并发会触发模型服务限流并连锁超时。
+这里限制全局、每个客户端和每个数据集同时执行的问题数，超出的请求进入有界的等待队列，
+按客户端轮转出队（同一客户端内先到先出），队列满或等待超时时立即返回 429/503 和 Retry-After
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 还没有完成过请求时估算 Retry-After 使用的单个问题耗时（秒）
+DEFAULT_SERVICE_SECONDS = 5.0
+
+
+class AdmissionRejected(HTTPException):
+    """请求未被准入：429 表示该客户端排队过多，503 表示全局队列已满或等待超时"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class _Waiter:
+    __slots__ = ("client", "dataset", "future", "enqueued_at")
+
+    def __init__(self, client: str, dataset: str, future: asyncio.Future):
+        self.client = client
+        self.dataset = dataset
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class AdmissionController:
+    """
+    并发限制与公平排队（只在事件循环线程中使用，不需要加锁）
+
+    每个数据集同时只执行 per_dataset 个问题：数据集的 SQLAgentManager 在首次请求的执行位内创建，
+    默认为 1 时同一数据集的并发请求不会重复创建 Agent（问题状态按调用隔离，不依赖该限制）
+    """
+
+    def __init__(self, max_concurrent: int, per_client: int, max_queue: int,
+                 per_client_queue: int, max_wait_seconds: float, per_dataset: int = 1):
+        self.max_concurrent = max_concurrent
+        self.per_client = per_client
+        self.per_dataset = per_dataset
+        self.max_queue = max_queue
+        self.per_client_queue = per_client_queue
+        self.max_wait_seconds = max_wait_seconds
+
+        self._active = 0
+        self._client_active: Counter = Counter()
+        self._dataset_active: Counter = Counter()
+        # {客户端: 等待队列}，字典顺序即轮转顺序，出队后客户端移到末尾
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+
+        self._counts = Counter()
+        self._peak_queued = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._total_service_s = 0.0
+
+    def _can_run(self, client: str, dataset: str) -> bool:
+        return (self._active < self.max_concurrent
+                and self._client_active[client] < self.per_client
+                and self._dataset_active[dataset] < self.per_dataset)
+
+    def _start(self, client: str, dataset: str, wait_ms: float):
+        self._active += 1
+        self._client_active[client] += 1
+        self._dataset_active[dataset] += 1
+        self._counts["admitted"] += 1
+        self._total_wait_ms += wait_ms
+        self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+
+    def retry_after(self) -> float:
+        """按平均耗时和排队长度估算的等待秒数"""
+        completed = self._counts["completed"]
+        service = self._total_service_s / completed if completed else DEFAULT_SERVICE_SECONDS
+        return service * (self._queued + 1) / self.max_concurrent
+
+    def _reject(self, status_code: int, reason: str, detail: str) -> AdmissionRejected:
+        self._counts[reason] += 1
+        logger.warning(f"Admission rejected ({status_code}): {detail} "
+                       f"[in_flight={self._active}, queued={self._queued}]")
+        return AdmissionRejected(status_code, detail, self.retry_after())
+
+    def _dispatch(self):
+        """按客户端轮转，把空出的执行位分配给可以运行的等待者"""
+        granted = True
+        while granted and self._queued and self._active < self.max_concurrent:
+            granted = False
+            for client in list(self._queues):
+                queue = self._queues[client]
+                waiter = next((w for w in queue if self._can_run(w.client, w.dataset)), None)
+                if waiter is None:
+                    continue
+                queue.remove(waiter)
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(client)
+                else:
+                    del self._queues[client]
+                self._start(waiter.client, waiter.dataset, (time.perf_counter() - waiter.enqueued_at) * 1000)
+                waiter.future.set_result(True)
+                granted = True
+                break
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._queues[waiter.client]
+
+    def _release(self, client: str, dataset: str, service_s: float):
+        self._active -= 1
+        self._client_active[client] -= 1
+        self._dataset_active[dataset] -= 1
+        if not self._client_active[client]:
+            del self._client_active[client]
+        if not self._dataset_active[dataset]:
+            del self._dataset_active[dataset]
+        self._counts["completed"] += 1
+        self._total_service_s += service_s
+        self._dispatch()
+
+    async def _acquire(self, client: str, dataset: str):
+        # 有空闲执行位时直接执行：释放时已经分配过，队列中剩下的等待者此刻都无法运行
+        if self._can_run(client, dataset):
+            self._start(client, dataset, 0.0)
+            return
+
+        queue = self._queues.get(client)
+        if queue is not None and len(queue) >= self.per_client_queue:
+            raise self._reject(429, "rejected_client", f"客户端 {client} 排队的请求过多，请稍后重试")
+        if self._queued >= self.max_queue:
+            raise self._reject(503, "rejected_full", "服务繁忙，等待队列已满，请稍后重试")
+
+        waiter = _Waiter(client, dataset, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(client, deque()).append(waiter)
+        self._queued += 1
+        self._counts["queued"] += 1
+        self._peak_queued = max(self._peak_queued, self._queued)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return
+            self._remove(waiter)
+            raise self._reject(503, "timeouts", f"排队超过 {self.max_wait_seconds:g} 秒，请稍后重试")
+        except asyncio.CancelledError:
+            # 客户端断开：已经分配到执行位时归还，否则移出队列
+            if waiter.future.done():
+                self._release(client, dataset, 0.0)
+            else:
+                self._remove(waiter)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, client: str, dataset: Optional[str]):
+        """
+        获取一个执行位，队列满或等待超时时抛出 AdmissionRejected
+
+        Args:
+            client: 客户端标识（X-Client-ID 请求头或客户端地址）
+            dataset: 数据集标识（file_id 或表名）
+        """
+        if not settings.admission_enabled:
+            yield
+            return
+        dataset = dataset or "-"
+        await self._acquire(client, dataset)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(client, dataset, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        admitted = self._counts["admitted"]
+        return {
+            "enabled": settings.admission_enabled,
+            "in_flight": self._active,
+            "queued": self._queued,
+            "peak_queued": self._peak_queued,
+            "queued_by_client": {client: len(queue) for client, queue in self._queues.items()},
+            "admitted": admitted,
+            "waited": self._counts["queued"],
+            "rejected_client": self._counts["rejected_client"],
+            "rejected_full": self._counts["rejected_full"],
+            "timeouts": self._counts["timeouts"],
+            "avg_wait_ms": round(self._total_wait_ms / admitted, 1) if admitted else None,
+            "max_wait_ms": round(self._max_wait_ms, 1),
+            "avg_service_ms": round(self._total_service_s / self._counts["completed"] * 1000, 1)
+            if self._counts["completed"] else None,
+        }
+
+
+# 创建全局准入控制实例
+admission_controller = AdmissionController(
+    max_concurrent=settings.admission_max_concurrent,
+    per_client=settings.admission_per_client,
+    max_queue=settings.admission_max_queue,
+    per_client_queue=settings.admission_per_client_queue,
+    max_wait_seconds=settings.admission_max_wait_seconds,
+)
@@ -0,0 +1,130 @@
+"""
+Agent 单次请求预算
+模型可能反复调用工具（查表结构、改写 SQL）而迟迟不给出回答。每个问题限制模型调用步数、消耗的 token 数和总耗时，
+预算用完后不再调用模型，由 SQLAgentManager 返回目前为止最好的 SQL 和数据以及简短的模板回答（不生成长篇分析报告）
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langchain.agents.middleware import AgentMiddleware, ModelResponse
+from langchain_core.messages import AIMessage
+
+from app.config import settings
+from app.llm_resilience import DeadlineExceededError
+
+logger = logging.getLogger(__name__)
+
+# 预算用完时代替模型回复的消息内容
+BUDGET_EXHAUSTED_MESSAGE = "[budget exhausted]"
+REASON_LABELS = {"steps": "步数", "tokens": "token", "deadline": "时间"}
+
+
+class AgentBudget:
+    """一个问题的预算与已用量"""
+
+    def __init__(self, max_steps: Optional[int] = None, max_tokens: Optional[int] = None,
+                 deadline_seconds: Optional[float] = None):
+        """
+        Args:
+            max_steps: 最多调用模型的次数，默认 settings.agent_max_steps
+            max_tokens: 最多消耗的 token 数（输入 + 输出），默认 settings.agent_max_tokens
+            deadline_seconds: 最长耗时（秒），默认 settings.agent_deadline_seconds
+        """
+        self.max_steps = max_steps or settings.agent_max_steps
+        self.max_tokens = max_tokens or settings.agent_max_tokens
+        self.deadline_seconds = deadline_seconds or settings.agent_deadline_seconds
+        self.started_at = time.perf_counter()
+        self.steps = 0
+        self.tokens = 0
+        self.exhausted: Optional[str] = None  # 用完的预算类型：steps / tokens / deadline
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def remaining(self) -> float:
+        """距离截止时间的剩余秒数（模型调用的超时、重试不能超过它）"""
+        return max(0.0, self.deadline_seconds - self.elapsed)
+
+    def check(self) -> Optional[str]:
+        """检查是否还能再调用一次模型，预算用完时记录并返回原因"""
+        if self.exhausted is None:
+            if self.steps >= self.max_steps:
+                self.exhausted = "steps"
+            elif self.tokens >= self.max_tokens:
+                self.exhausted = "tokens"
+            elif self.elapsed >= self.deadline_seconds:
+                self.exhausted = "deadline"
+        return self.exhausted
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps,
+            "max_steps": self.max_steps,
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            "deadline_ms": round(self.deadline_seconds * 1000, 1),
+            "exhausted": self.exhausted,
+        }
+
+
+class BudgetStats:
+    """预算用完次数统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._exhausted = {reason: 0 for reason in REASON_LABELS}
+
+    def record(self, budget: AgentBudget):
+        with self._lock:
+            self._requests += 1
+            if budget.exhausted:
+                self._exhausted[budget.exhausted] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self._requests, "exhausted": dict(self._exhausted)}
+
+
+budget_stats = BudgetStats()
+
+
+class BudgetMiddleware(AgentMiddleware):
+    """每次调用模型前检查当前问题的预算，用完时直接结束 Agent 运行；调用后累计步数和 token"""
+
+    def __init__(self, get_budget: Callable[[], Optional[AgentBudget]]):
+        """
+        Args:
+            get_budget: 返回当前问题的预算，None 表示不限制
+        """
+        super().__init__()
+        self._get_budget = get_budget
+
+    def wrap_model_call(self, request, handler):
+        budget = self._get_budget()
+        if budget is None:
+            return handler(request)
+        reason = budget.check()
+        if reason:
+            logger.info(f"Agent budget exhausted ({reason}): {budget.to_dict()}")
+            # 没有工具调用的回复会结束 Agent 运行
+            return ModelResponse(result=[AIMessage(content=BUDGET_EXHAUSTED_MESSAGE)])
+
+        try:
+            response = handler(request)
+        except DeadlineExceededError as e:
+            # 模型调用失败且剩余时间不够重试：按时间预算用完处理，返回目前为止最好的结果
+            budget.exhausted = "deadline"
+            logger.info(f"Agent budget exhausted (deadline) while retrying model call: {e}")
+            return ModelResponse(result=[AIMessage(content=BUDGET_EXHAUSTED_MESSAGE)])
+        budget.steps += 1
+        messages = response.result if isinstance(response, ModelResponse) else [response]
+        for message in messages:
+            usage = getattr(message, "usage_metadata", None) or {}
+            budget.tokens += usage.get("total_tokens", 0)
+        return response
@@ -0,0 +1,240 @@
+"""
+异步数据库管理器
+查询通过 SQLAlchemy 异步引擎执行（aiosqlite / asyncpg / aiomysql，按URL自动选择），
+不阻塞事件循环；没有安装对应异步驱动时回退为在线程池中使用同步引擎执行。
+表结构和行数来自元数据目录缓存，在线程池中读取
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import settings
+from app.database import DatabaseManager, column_types_known
+from app.engine_registry import async_driver_available, engine_registry
+from app.result_set import ResultSet
+
+logger = logging.getLogger(__name__)
+
+
+async def run_query(db_url: str, query: str) -> ResultSet:
+    """
+    在 URL 对应的共享异步引擎上执行查询，返回列式结果集（失败时抛出异常）
+
+    Args:
+        db_url: 同步数据库连接URL（需已确认 async_driver_available）
+        query: SQL查询语句
+    """
+    engine = engine_registry.get_async_engine(db_url)
+    async with engine.connect() as conn:
+        # 异步连接返回的是已缓冲的结果，取行不再访问数据库
+        return ResultSet.from_result(await conn.execute(text(query)))
+
+
+async def stream_query(db_url: str, query: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    在共享异步引擎上以服务端游标流式执行查询，返回值与 database.stream_rows 相同，
+    其中 batches 为异步迭代器；连接在迭代结束（或迭代器被关闭）时释放
+
+    Args:
+        db_url: 同步数据库连接URL（需已确认 async_driver_available）
+        query: SQL查询语句
+        batch_size: 每批行数，默认使用配置中的 export_batch_size
+    """
+    batch_size = batch_size or settings.export_batch_size
+    engine = engine_registry.get_async_engine(db_url)
+
+    async def _iter_batches() -> AsyncIterator[Any]:
+        async with engine.connect() as conn:
+            result = await conn.stream(text(query))
+            # AsyncResult 不直接暴露游标，列类型从其包装的同步结果的 cursor.description 读取
+            cursor = getattr(result._real_result, "cursor", None)
+            yield list(result.keys()), column_types_known(getattr(cursor, "description", None))
+            async for partition in result.partitions(batch_size):
+                yield [tuple(row) for row in partition]
+
+    batches = _iter_batches()
+    try:
+        columns, typed_columns = await batches.__anext__()
+    except Exception as e:
+        logger.error(f"Error streaming query: {str(e)}")
+        await batches.aclose()
+        return {"success": False, "error": str(e)}
+    return {"success": True, "columns": columns, "typed_columns": typed_columns, "batches": batches}
+
+
+class AsyncDatabaseManager:
+    """DatabaseManager 的异步版本，供 async 路由使用"""
+
+    def __init__(self, db_url: Optional[str] = None):
+        """
+        初始化异步数据库管理器
+
+        Args:
+            db_url: 数据库连接URL（同步驱动形式），如果不提供则使用配置中的URL
+        """
+        # 元数据读取复用同步管理器，与 SQL Agent 共享同一份元数据目录缓存
+        self._metadata = DatabaseManager(db_url)
+        self.db_url = self._metadata.db_url
+        self.db_type = self._metadata.db_type
+        self.engine: Optional[AsyncEngine] = None
+        self.connected = False
+
+    async def connect(self) -> bool:
+        """
+        连接到数据库（复用共享的同步引擎，首次创建时验证连接，之后不再额外发送探测查询）
+
+        异步引擎只在执行查询时才创建，只读取元数据的接口不会为同一URL再建立一个连接池
+
+        Returns:
+            是否连接成功
+        """
+        logger.info(f"Connecting to database (async): {self._mask_password(self.db_url)}")
+        self.connected = await asyncio.to_thread(self._metadata.connect)
+        if self.connected:
+            logger.info("✅ Database connected successfully (async)!")
+        return self.connected
+
+    def _mask_password(self, url: str) -> str:
+        """隐藏URL中的密码"""
+        return self._metadata._mask_password(url)
+
+    async def get_tables(self) -> List[str]:
+        """
+        获取数据库中的所有表名
+
+        Returns:
+            表名列表
+        """
+        if not self.connected:
+            logger.error("Database not connected")
+            return []
+        return await asyncio.to_thread(self._metadata.get_tables)
+
+    async def get_table_info(self, table_name: str) -> Dict[str, Any]:
+        """
+        获取表的详细信息
+
+        Args:
+            table_name: 表名
+
+        Returns:
+            表信息字典
+        """
+        if not self.connected:
+            logger.error("Database not connected")
+            return {}
+        return await asyncio.to_thread(self._metadata.get_table_info, table_name)
+
+    async def collect_table_infos(self, table_names: Optional[List[str]] = None,
+                                  timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        获取多张表的详细信息（包括反射表结构），超过截止时间的表返回 {"name": 表名, "pending": True}
+
+        Args:
+            table_names: 表名列表，默认为数据库中的所有表
+            timeout: 整体截止时间（秒），默认使用配置中的 metadata_deadline_seconds
+
+        Returns:
+            与 table_names 顺序一致的表信息列表
+        """
+        if not self.connected:
+            return []
+        return await asyncio.to_thread(self._metadata.collect_table_infos, table_names, timeout)
+
+    async def execute_query(self, query: str) -> Dict[str, Any]:
+        """
+        执行SQL查询
+
+        Args:
+            query: SQL查询语句
+
+        Returns:
+            查询结果
+        """
+        if not self.connected:
+            return {"success": False, "error": "Database not connected"}
+
+        if not async_driver_available(self.db_url):
+            # 没有安装异步驱动（如 MySQL 只装了 pymysql）时在线程池中使用同步引擎
+            return await asyncio.to_thread(self._metadata.execute_query, query)
+
+        try:
+            if self.engine is None:
+                self.engine = engine_registry.get_async_engine(self.db_url)
+            async with self.engine.connect() as conn:
+                result = await conn.execute(text(query))
+
+                # 检查是否是查询语句
+                if result.returns_rows:
+                    # 异步连接返回的是已缓冲的结果，取行不再访问数据库
+                    result_set = ResultSet.from_result(result)
+
+                    return {
+                        "success": True,
+                        "result_set": result_set,
+                        "columns": result_set.columns,
+                        "row_count": result_set.row_count,
+                    }
+                else:
+                    # 非查询语句（INSERT, UPDATE, DELETE等）
+                    await conn.commit()
+                    return {
+                        "success": True,
+                        "message": "Query executed successfully",
+                        "rows_affected": result.rowcount,
+                    }
+
+        except Exception as e:
+            logger.error(f"Error executing query: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def stream_query(self, query: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        以服务端游标流式执行SQL查询（用于大结果集导出）
+
+        Args:
+            query: SQL查询语句
+            batch_size: 每批行数，默认使用配置中的 export_batch_size
+
+        Returns:
+            查询结果，其中 batches 为逐批产出行元组列表的迭代器（使用异步驱动时为异步迭代器）
+        """
+        if not self.connected:
+            return {"success": False, "error": "Database not connected"}
+
+        if not async_driver_available(self.db_url):
+            return await asyncio.to_thread(self._metadata.stream_query, query, batch_size)
+        return await stream_query(self.db_url, query, batch_size)
+
+    async def test_connection(self) -> Dict[str, Any]:
+        """
+        测试数据库连接并返回基本信息
+
+        Returns:
+            连接测试结果
+        """
+        if not await self.connect():
+            return {
+                "success": False,
+                "error": "Failed to connect to database"
+            }
+
+        tables = await self.get_tables()
+
+        return {
+            "success": True,
+            "db_type": self.db_type,
+            "db_url": self._mask_password(self.db_url),
+            "tables": tables,
+            "table_count": len(tables),
+        }
+
+    def close(self):
+        """释放对共享引擎的引用（连接池由 engine_registry 统一管理，不在此处销毁）"""
+        self.engine = None
+        self.connected = False
+        self._metadata.close()
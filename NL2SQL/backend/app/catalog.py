@@ -0,0 +1,574 @@
+"""
+数据库元数据目录
+按数据源缓存表、列、类型、主键和外键，TTL 到期后通过轻量的结构指纹判断是否需要重新反射
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 各数据库的结构指纹查询：结构（表/列/类型、主键外键、表和列注释）变化时结果随之变化，
+# 与批量反射读取的目录保持一致，否则只改约束或注释时目录会一直返回旧的元数据
+FINGERPRINT_QUERIES = {
+    "sqlite": "PRAGMA schema_version",
+    "postgresql": """
+        SELECT md5(
+            COALESCE((
+                SELECT string_agg(
+                    cls.relname || '.' || att.attname || ':' || format_type(att.atttypid, att.atttypmod)
+                    || ':' || att.attnotnull || ':' || COALESCE(col_description(att.attrelid, att.attnum), ''),
+                    ',' ORDER BY cls.relname, att.attnum)
+                FROM pg_attribute att
+                JOIN pg_class cls ON cls.oid = att.attrelid
+                JOIN pg_namespace n ON n.oid = cls.relnamespace
+                WHERE n.nspname = current_schema() AND cls.relkind IN ('r', 'p')
+                  AND att.attnum > 0 AND NOT att.attisdropped
+            ), '') || '|' ||
+            COALESCE((
+                SELECT string_agg(cls.relname || ':' || con.conname || ':' || pg_get_constraintdef(con.oid),
+                                  ',' ORDER BY cls.relname, con.conname)
+                FROM pg_constraint con
+                JOIN pg_class cls ON cls.oid = con.conrelid
+                JOIN pg_namespace n ON n.oid = cls.relnamespace
+                WHERE n.nspname = current_schema() AND con.contype IN ('p', 'f')
+            ), '') || '|' ||
+            COALESCE((
+                SELECT string_agg(cls.relname || ':' || COALESCE(obj_description(cls.oid, 'pg_class'), ''),
+                                  ',' ORDER BY cls.relname)
+                FROM pg_class cls JOIN pg_namespace n ON n.oid = cls.relnamespace
+                WHERE n.nspname = current_schema() AND cls.relkind IN ('r', 'p')
+            ), ''))
+    """,
+    "mysql": """
+        SELECT CONCAT_WS('-',
+            (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':',
+                TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, ORDINAL_POSITION, COLUMN_COMMENT))), 0))
+             FROM information_schema.COLUMNS
+             WHERE TABLE_SCHEMA = DATABASE()),
+            (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':',
+                TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, ORDINAL_POSITION,
+                REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME))), 0))
+             FROM information_schema.KEY_COLUMN_USAGE
+             WHERE TABLE_SCHEMA = DATABASE()),
+            (SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':', TABLE_NAME, TABLE_COMMENT))), 0))
+             FROM information_schema.TABLES
+             WHERE TABLE_SCHEMA = DATABASE()))
+    """,
+}
+
+# 各数据库基于统计信息的行数估算查询（单次查询覆盖所有表）
+ROW_ESTIMATE_QUERIES = {
+    "postgresql": """
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+    """,
+    "mysql": """
+        SELECT TABLE_NAME, TABLE_ROWS
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+    """,
+}
+
+
+# 批量反射查询：每个数据库用两到三条查询取回整个 schema 的列信息、主外键和表注释
+# 列查询返回 (表名, 列名, 类型, 可空, 默认值, 序号, 列注释)
+# 键查询返回 (表名, 'p'|'f', 约束名, 列名, 引用表, 引用列, 序号)
+# 表注释查询返回 (表名, 注释)，不支持注释的数据库为 None
+# SQLite 使用 pragma_table_xinfo，生成列（hidden 为 2/3）也包含在内
+BULK_REFLECTION_QUERIES = {
+    "sqlite": (
+        """
+        SELECT m.name, p.name, p.type, NOT p."notnull", p.dflt_value, p.cid, NULL
+        FROM sqlite_master m JOIN pragma_table_xinfo(m.name) p
+        WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite\\_%' ESCAPE '\\' AND p.hidden IN (0, 2, 3)
+        ORDER BY m.name, p.cid
+        """,
+        """
+        SELECT m.name, 'p', 'pk', p.name, NULL, NULL, p.pk
+        FROM sqlite_master m JOIN pragma_table_info(m.name) p
+        WHERE m.type = 'table' AND p.pk > 0
+        UNION ALL
+        SELECT m.name, 'f', 'fk_' || f.id, f."from", f."table", f."to", f.seq
+        FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f
+        WHERE m.type = 'table'
+        ORDER BY 1, 3, 7
+        """,
+        None,
+    ),
+    "postgresql": (
+        """
+        SELECT cls.relname, att.attname, format_type(att.atttypid, att.atttypmod),
+               NOT att.attnotnull, pg_get_expr(def.adbin, def.adrelid), att.attnum,
+               col_description(att.attrelid, att.attnum)
+        FROM pg_attribute att
+        JOIN pg_class cls ON cls.oid = att.attrelid
+        JOIN pg_namespace n ON n.oid = cls.relnamespace
+        LEFT JOIN pg_attrdef def ON def.adrelid = att.attrelid AND def.adnum = att.attnum
+        WHERE n.nspname = current_schema() AND cls.relkind IN ('r', 'p')
+          AND att.attnum > 0 AND NOT att.attisdropped
+        ORDER BY cls.relname, att.attnum
+        """,
+        """
+        SELECT cls.relname, con.contype, con.conname, a.attname, ref.relname, ra.attname, k.ord
+        FROM pg_constraint con
+        JOIN pg_class cls ON cls.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = cls.relnamespace
+        CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+        LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+        LEFT JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = con.confkey[k.ord]
+        WHERE n.nspname = current_schema() AND con.contype IN ('p', 'f')
+        ORDER BY 1, 3, 7
+        """,
+        """
+        SELECT c.relname, obj_description(c.oid, 'pg_class')
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+        """,
+    ),
+    "mysql": (
+        """
+        SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE = 'YES',
+               c.COLUMN_DEFAULT, c.ORDINAL_POSITION, NULLIF(c.COLUMN_COMMENT, '')
+        FROM information_schema.COLUMNS c
+        JOIN information_schema.TABLES t
+          ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+        ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+        """,
+        """
+        SELECT k.TABLE_NAME,
+               CASE c.CONSTRAINT_TYPE WHEN 'PRIMARY KEY' THEN 'p' ELSE 'f' END,
+               k.CONSTRAINT_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME,
+               k.REFERENCED_COLUMN_NAME, k.ORDINAL_POSITION
+        FROM information_schema.KEY_COLUMN_USAGE k
+        JOIN information_schema.TABLE_CONSTRAINTS c
+          ON c.CONSTRAINT_SCHEMA = k.CONSTRAINT_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME
+         AND c.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+        WHERE k.TABLE_SCHEMA = DATABASE() AND c.CONSTRAINT_TYPE IN ('PRIMARY KEY', 'FOREIGN KEY')
+        ORDER BY 1, 3, 7
+        """,
+        """
+        SELECT TABLE_NAME, NULLIF(TABLE_COMMENT, '')
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'
+        """,
+    ),
+}
+
+
+class SchemaSnapshot:
+    """某个数据源在某一时刻的结构快照"""
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], fingerprint: Optional[str], version: int):
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self.version = version
+        self.loaded_at = time.time()
+        self.checked_at = self.loaded_at
+
+    def table_names(self) -> List[str]:
+        return list(self.tables.keys())
+
+
+class MetadataCatalog:
+    """元数据目录，按引擎URL缓存结构快照"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        """
+        初始化元数据目录
+
+        Args:
+            ttl_seconds: 快照有效期（秒），到期后重新计算结构指纹
+        """
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.catalog_ttl_seconds
+        self._snapshots: Dict[str, SchemaSnapshot] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+        self._listeners: List[Callable[[str, SchemaSnapshot], None]] = []
+        # 行数缓存：估算值 {key: (时间, {表: 行数})}，精确值 {key: {表: (时间, 行数)}}
+        self._estimated_counts: Dict[str, Tuple[float, Dict[str, Optional[int]]]] = {}
+        self._exact_counts: Dict[str, Dict[str, Tuple[float, int]]] = {}
+        self._pending_counts: set = set()
+        self._count_lock = threading.Lock()
+        self._count_executor = ThreadPoolExecutor(
+            max_workers=settings.row_count_workers, thread_name_prefix="row-count"
+        )
+
+    @staticmethod
+    def source_key(engine: Engine) -> str:
+        """数据源标识（引擎URL，不含密码）"""
+        return engine.url.render_as_string(hide_password=True)
+
+    def add_listener(self, listener: Callable[[str, SchemaSnapshot], None]):
+        """注册结构变化回调，参数为 (数据源标识, 新快照)"""
+        self._listeners.append(listener)
+
+    def get_snapshot(self, engine: Engine) -> SchemaSnapshot:
+        """
+        获取数据源的结构快照
+
+        TTL 内直接返回缓存；TTL 到期后比较结构指纹，未变化则续期，变化则重新反射。
+
+        Args:
+            engine: SQLAlchemy 引擎
+
+        Returns:
+            结构快照
+        """
+        key = self.source_key(engine)
+        snapshot = self._snapshots.get(key)
+        if snapshot and time.time() - snapshot.checked_at < self.ttl_seconds:
+            return snapshot
+
+        with self._lock_for(key):
+            snapshot = self._snapshots.get(key)
+            if snapshot and time.time() - snapshot.checked_at < self.ttl_seconds:
+                return snapshot
+
+            with engine.connect() as conn:
+                fingerprint = self._fingerprint(conn)
+                if snapshot and fingerprint is not None and fingerprint == snapshot.fingerprint:
+                    snapshot.checked_at = time.time()
+                    return snapshot
+
+                tables = self._reflect(conn)
+
+            version = snapshot.version + 1 if snapshot else 1
+            snapshot = SchemaSnapshot(tables, fingerprint, version)
+            self._snapshots[key] = snapshot
+            logger.info(f"Catalog loaded {len(tables)} tables for {key} (version {version})")
+
+        for listener in self._listeners:
+            try:
+                listener(key, snapshot)
+            except Exception as e:
+                logger.warning(f"Catalog listener failed: {e}")
+
+        return snapshot
+
+    def get_tables(self, engine: Engine) -> List[str]:
+        """获取所有表名"""
+        return self.get_snapshot(engine).table_names()
+
+    def list_table_names(self, engine: Engine) -> List[str]:
+        """
+        快速获取表名，不触发结构反射：有快照（即使已过期）时直接使用，否则只查询一次表名列表
+
+        Args:
+            engine: SQLAlchemy 引擎
+
+        Returns:
+            表名列表
+        """
+        snapshot = self._snapshots.get(self.source_key(engine))
+        if snapshot is not None:
+            return snapshot.table_names()
+        with engine.connect() as conn:
+            return inspect(conn).get_table_names()
+
+    def get_table(self, engine: Engine, table_name: str) -> Optional[Dict[str, Any]]:
+        """获取单个表的元数据"""
+        return self.get_snapshot(engine).tables.get(table_name)
+
+    def invalidate(self, engine: Optional[Engine] = None):
+        """使缓存失效（不传引擎时清空全部）"""
+        if engine is None:
+            self._snapshots.clear()
+            self._estimated_counts.clear()
+            self._exact_counts.clear()
+        else:
+            key = self.source_key(engine)
+            self._snapshots.pop(key, None)
+            self._estimated_counts.pop(key, None)
+            self._exact_counts.pop(key, None)
+
+    def get_row_count(self, engine: Engine, table_name: str) -> Dict[str, Any]:
+        """
+        获取表行数：有未过期的精确值时直接返回，否则返回统计信息估算值并在后台计算精确值
+
+        Args:
+            engine: SQLAlchemy 引擎
+            table_name: 表名
+
+        Returns:
+            {"count": 行数或None, "exact": 是否为精确值}
+        """
+        key = self.source_key(engine)
+        exact = self._exact_counts.get(key, {}).get(table_name)
+        if exact and time.time() - exact[0] < settings.row_count_exact_ttl_seconds:
+            return {"count": exact[1], "exact": True}
+
+        self._schedule_exact_count(engine, table_name)
+
+        estimate = self._get_estimates(engine).get(table_name)
+        if estimate is None and exact:
+            # 过期的精确值仍比没有数字好
+            return {"count": exact[1], "exact": False}
+        return {"count": estimate, "exact": False}
+
+    def _get_estimates(self, engine: Engine) -> Dict[str, Optional[int]]:
+        """读取（或刷新）数据源所有表的估算行数"""
+        key = self.source_key(engine)
+        cached = self._estimated_counts.get(key)
+        if cached and time.time() - cached[0] < self.ttl_seconds:
+            return cached[1]
+
+        # 同一数据源同时只刷新一次，其他并发请求等待并复用结果
+        with self._lock_for(f"estimates:{key}"):
+            cached = self._estimated_counts.get(key)
+            if cached and time.time() - cached[0] < self.ttl_seconds:
+                return cached[1]
+
+            estimates: Dict[str, Optional[int]] = {}
+            try:
+                table_names = self.get_tables(engine)
+                with engine.connect() as conn:
+                    estimates = self._estimate_row_counts(conn, table_names)
+            except Exception as e:
+                logger.warning(f"Failed to estimate row counts: {e}")
+
+            self._estimated_counts[key] = (time.time(), estimates)
+            return estimates
+
+    def _estimate_row_counts(self, conn: Connection, table_names: List[str]) -> Dict[str, Optional[int]]:
+        """基于数据库统计信息估算行数，无统计信息的表返回 None"""
+        dialect = conn.dialect.name
+
+        if dialect == "sqlite":
+            return self._estimate_sqlite_row_counts(conn, table_names)
+
+        query = ROW_ESTIMATE_QUERIES.get(dialect)
+        if not query:
+            return {}
+
+        estimates = {}
+        for name, rows in conn.execute(text(query)):
+            # PostgreSQL 中从未 ANALYZE 过的表 reltuples 为 -1
+            estimates[name] = int(rows) if rows is not None and rows >= 0 else None
+        return estimates
+
+    def _estimate_sqlite_row_counts(self, conn: Connection, table_names: List[str]) -> Dict[str, Optional[int]]:
+        """SQLite：优先使用 sqlite_stat1（ANALYZE 生成），否则用 MAX(rowid) 近似"""
+        estimates: Dict[str, Optional[int]] = {}
+
+        has_stat = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        )).scalar()
+        if has_stat:
+            for table_name, stat in conn.execute(text("SELECT tbl, stat FROM sqlite_stat1")):
+                try:
+                    estimates[table_name] = int(str(stat).split()[0])
+                except (ValueError, IndexError):
+                    continue
+
+        quote = conn.dialect.identifier_preparer.quote
+        for table_name in table_names:
+            if table_name in estimates:
+                continue
+            try:
+                # rowid 上的 MAX 只需走一次 B 树，不扫描全表
+                value = conn.execute(text(f"SELECT MAX(rowid) FROM {quote(table_name)}")).scalar()
+                estimates[table_name] = int(value or 0)
+            except Exception:
+                # WITHOUT ROWID 表或视图
+                estimates[table_name] = None
+        return estimates
+
+    def _schedule_exact_count(self, engine: Engine, table_name: str):
+        """在后台线程中计算精确行数（同一张表同时只有一个任务）"""
+        key = self.source_key(engine)
+        task = (key, table_name)
+        with self._count_lock:
+            if task in self._pending_counts:
+                return
+            self._pending_counts.add(task)
+
+        def _count():
+            try:
+                quote = engine.dialect.identifier_preparer.quote
+                with engine.connect() as conn:
+                    count = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table_name)}")).scalar()
+                self._exact_counts.setdefault(key, {})[table_name] = (time.time(), int(count or 0))
+            except Exception as e:
+                logger.warning(f"Failed to count rows for {table_name}: {e}")
+            finally:
+                with self._count_lock:
+                    self._pending_counts.discard(task)
+
+        self._count_executor.submit(_count)
+
+    def schema_digest(self, engine: Engine, table_names: Optional[List[str]] = None,
+                      max_tables: int = 50, columns: Optional[Dict[str, List[str]]] = None) -> str:
+        """
+        生成供 Agent 提示词使用的表结构概要
+
+        Args:
+            engine: SQLAlchemy 引擎
+            table_names: 只包含这些表，默认全部
+            max_tables: 最多包含的表数量
+            columns: {表名: 列名}，指定的表只列出这些列（宽表列裁剪）
+
+        Returns:
+            每行一个表的文本概要
+        """
+        snapshot = self.get_snapshot(engine)
+        names = table_names if table_names is not None else snapshot.table_names()
+
+        lines = []
+        for name in names[:max_tables]:
+            table = snapshot.tables.get(name)
+            if not table:
+                continue
+            kept = columns.get(name) if columns else None
+            listed = [col for col in table["columns"] if kept is None or col["name"] in kept]
+            column_text = ", ".join(f"{col['name']} {col['type']}" for col in listed)
+            line = f"- {name}({column_text})"
+            if len(listed) < len(table["columns"]):
+                line += f" ……另有 {len(table['columns']) - len(listed)} 列未列出"
+            if table["primary_key"]:
+                line += f" 主键: {', '.join(table['primary_key'])}"
+            for fk in table["foreign_keys"]:
+                line += (f" 外键: {', '.join(fk['columns'])} -> "
+                         f"{fk['referred_table']}({', '.join(fk['referred_columns'])})")
+            lines.append(line)
+
+        if len(names) > max_tables:
+            lines.append(f"- ……另有 {len(names) - max_tables} 个表未列出")
+        return "\n".join(lines)
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _fingerprint(self, conn: Connection) -> Optional[str]:
+        """计算结构指纹，不支持的数据库返回 None（仅依赖 TTL）"""
+        query = FINGERPRINT_QUERIES.get(conn.dialect.name)
+        if not query:
+            return None
+        try:
+            value = conn.execute(text(query)).scalar()
+            return None if value is None else str(value)
+        except Exception as e:
+            logger.warning(f"Failed to compute schema fingerprint: {e}")
+            return None
+
+    def _reflect(self, conn: Connection) -> Dict[str, Dict[str, Any]]:
+        """反射整个 schema：优先使用批量查询，不支持或失败时回退到逐表 Inspector"""
+        if conn.dialect.name in BULK_REFLECTION_QUERIES:
+            try:
+                start = time.perf_counter()
+                tables = self._reflect_bulk(conn)
+                logger.info(f"Bulk reflected {len(tables)} tables in {(time.perf_counter() - start) * 1000:.1f} ms")
+                return tables
+            except Exception as e:
+                logger.warning(f"Bulk reflection failed, falling back to inspector: {e}")
+                if conn.in_transaction():
+                    conn.rollback()
+
+        return self._reflect_with_inspector(conn)
+
+    def _reflect_bulk(self, conn: Connection) -> Dict[str, Dict[str, Any]]:
+        """用两到三条目录查询取回所有表的列、类型、可空性、主键、外键和注释"""
+        columns_query, keys_query, comments_query = BULK_REFLECTION_QUERIES[conn.dialect.name]
+
+        tables: Dict[str, Dict[str, Any]] = {}
+        for table_name, column_name, type_name, nullable, default, _, comment in conn.execute(text(columns_query)):
+            table = tables.setdefault(table_name, self._empty_table(table_name))
+            table["columns"].append({
+                "name": column_name,
+                "type": str(type_name).upper() if type_name else "NULL",
+                "nullable": bool(nullable),
+                "default": default,
+                "primary_key": False,
+                "comment": comment,
+            })
+
+        foreign_keys: Dict[tuple, Dict[str, Any]] = {}
+        for table_name, kind, constraint, column_name, referred_table, referred_column, _ in \
+                conn.execute(text(keys_query)):
+            table = tables.get(table_name)
+            if table is None:
+                continue
+            if kind == "p":
+                table["primary_key"].append(column_name)
+                for col in table["columns"]:
+                    if col["name"] == column_name:
+                        col["primary_key"] = True
+            else:
+                fk = foreign_keys.get((table_name, constraint))
+                if fk is None:
+                    fk = {"columns": [], "referred_table": referred_table, "referred_columns": []}
+                    foreign_keys[(table_name, constraint)] = fk
+                    table["foreign_keys"].append(fk)
+                fk["columns"].append(column_name)
+                if referred_column is not None:
+                    fk["referred_columns"].append(referred_column)
+
+        if comments_query:
+            for table_name, comment in conn.execute(text(comments_query)):
+                if table_name in tables:
+                    tables[table_name]["comment"] = comment
+
+        return tables
+
+    @staticmethod
+    def _empty_table(table_name: str) -> Dict[str, Any]:
+        return {"name": table_name, "comment": None, "columns": [], "primary_key": [], "foreign_keys": []}
+
+    def _reflect_with_inspector(self, conn: Connection) -> Dict[str, Dict[str, Any]]:
+        """使用 Inspector 逐表反射结构"""
+        inspector = inspect(conn)
+        tables = {}
+        for table_name in inspector.get_table_names():
+            try:
+                columns = inspector.get_columns(table_name)
+                pk = inspector.get_pk_constraint(table_name).get("constrained_columns") or []
+                fks = inspector.get_foreign_keys(table_name)
+            except Exception as e:
+                logger.warning(f"Failed to reflect table {table_name}: {e}")
+                continue
+            try:
+                comment = inspector.get_table_comment(table_name).get("text")
+            except Exception:
+                comment = None
+
+            tables[table_name] = {
+                "name": table_name,
+                "comment": comment,
+                "columns": [
+                    {
+                        "name": col["name"],
+                        "type": str(col["type"]),
+                        "nullable": col.get("nullable", True),
+                        "default": col.get("default"),
+                        "primary_key": col["name"] in pk,
+                        "comment": col.get("comment"),
+                    }
+                    for col in columns
+                ],
+                "primary_key": list(pk),
+                "foreign_keys": [
+                    {
+                        "columns": fk.get("constrained_columns") or [],
+                        "referred_table": fk.get("referred_table"),
+                        "referred_columns": fk.get("referred_columns") or [],
+                    }
+                    for fk in fks
+                ],
+            }
+        return tables
+
+
+# 创建全局元数据目录实例
+metadata_catalog = MetadataCatalog()
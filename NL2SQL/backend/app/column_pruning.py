@@ -0,0 +1,208 @@
+"""
+宽表列裁剪
+上传的表格常有上百列，完整结构会占满提示词；对列数超过阈值的表，
+按问题对列打分（列名词汇匹配、问题中出现的列取值、列概况特征），只把最相关的前 K 列写入提示词，
+模型需要其他列时可调用 sql_db_schema 查看完整列
+"""
+
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.value_index import ColumnValueIndex, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# tiktoken 为可选依赖，不可用时按字符数估算
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # pragma: no cover - 取决于运行环境
+    _ENCODING = None
+
+TIME_WORDS = ("年", "月", "日", "周", "季度", "趋势", "最近", "期间", "时间", "日期",
+              "date", "time", "day", "week", "month", "year")
+AGGREGATE_WORDS = ("总", "合计", "平均", "最高", "最低", "最大", "最小", "多少", "排名", "前", "占比",
+                   "数量", "金额", "sum", "avg", "total", "max", "min", "top", "count")
+GROUP_WORDS = ("按", "每", "各", "分组", "分布", "对比", "by", "per", "each")
+NUMERIC_TYPE_HINTS = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def count_tokens(text: str) -> int:
+    """提示词 token 数（cl100k_base 编码；不可用时中文按 1 字 1 token、其他按 4 字符 1 token 估算）"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    cjk = sum(len(run) for run in _CJK_RUN.findall(text))
+    return cjk + (len(text) - cjk) // 4
+
+
+def _terms(value: str) -> set:
+    """词项：英文/数字单词 + 中文 bigram（单字词保留原字）"""
+    lowered = str(value).lower()
+    terms = set(_WORD.findall(lowered))
+    for run in _CJK_RUN.findall(lowered):
+        if len(run) == 1:
+            terms.add(run)
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def score_columns(question: str, table: Dict[str, Any], profile: Optional[Dict[str, Any]],
+                  indexes: Dict[Tuple[str, str], ColumnValueIndex]) -> Dict[str, float]:
+    """
+    按问题对表的每一列打分
+
+    Args:
+        question: 用户问题
+        table: 元数据目录中的表信息
+        profile: 列概况
+        indexes: 列取值索引 {(表名, 列名): 索引}
+
+    Returns:
+        {列名: 分数}
+    """
+    needle = normalize_text(question)
+    lowered = question.lower()
+    question_terms = _terms(question)
+    has_time = any(word in lowered for word in TIME_WORDS)
+    has_aggregate = any(word in lowered for word in AGGREGATE_WORDS)
+    has_group = any(word in lowered for word in GROUP_WORDS)
+
+    key_columns = set(table["primary_key"])
+    for fk in table["foreign_keys"]:
+        key_columns.update(fk["columns"])
+    columns_stats = profile["columns"] if profile else {}
+
+    scores = {}
+    for col in table["columns"]:
+        name = col["name"]
+        score = 0.0
+
+        # 列名：整体出现在问题中，或按词项重合比例
+        name_norm = normalize_text(name)
+        if len(name_norm) >= 2 and name_norm in needle:
+            score += 4.0
+        else:
+            name_terms = _terms(name.replace("_", " "))
+            if name_terms:
+                score += 3.0 * len(name_terms & question_terms) / len(name_terms)
+
+        # 问题中提到了该列的某个取值（如"华为"之于 brand）
+        index = indexes.get((table["name"], name))
+        if index is not None and index.find_in_text(question, limit=1):
+            score += 4.0
+
+        if name in key_columns or name.lower() == "id" or name.lower().endswith("_id"):
+            score += 1.0
+
+        stats = columns_stats.get(name)
+        if stats:
+            is_numeric = any(hint in stats["type"].upper() for hint in NUMERIC_TYPE_HINTS)
+            if stats["is_date"] and has_time:
+                score += 1.5
+            elif is_numeric and has_aggregate:
+                score += 0.5
+            elif stats["top_values"] and has_group:
+                score += 0.5
+            if stats["null_ratio"] >= 0.95:
+                score -= 1.0
+
+        scores[name] = score
+    return scores
+
+
+def select_columns(question: str, tables: Dict[str, Dict[str, Any]],
+                   profiles: Dict[str, Dict[str, Any]],
+                   indexes: Dict[Tuple[str, str], ColumnValueIndex],
+                   top_k: int, min_columns: int, min_keep: int = 10,
+                   pinned: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+    """
+    为列数超过 min_columns 的表挑选与问题最相关的列（保持原有列顺序）
+
+    只保留有明确关联（列名或取值被提到、日期列对应时间类问题等，得分不低于 1）的列，最多 top_k 列；
+    列概况带来的弱加分只用于排序。相关列不足 min_keep 时按原有顺序补足，
+    让"显示前10条"这类不涉及具体列的问题也能看到表的主要列；pinned 中的列总是保留
+
+    Returns:
+        {表名: 保留的列名}，只包含被裁剪的表
+    """
+    selected = {}
+    for name, table in tables.items():
+        if len(table["columns"]) <= min_columns:
+            continue
+        scores = score_columns(question, table, profiles.get(name), indexes)
+        order = {col["name"]: i for i, col in enumerate(table["columns"])}
+        ranked = [c for c in sorted(scores, key=lambda c: (-scores[c], order[c])) if scores[c] >= 1.0][:top_k]
+        ranked += [c for c in (pinned or {}).get(name, []) if c in order and c not in ranked]
+        for col in table["columns"]:
+            if len(ranked) >= min_keep:
+                break
+            if col["name"] not in ranked:
+                ranked.append(col["name"])
+        selected[name] = sorted(ranked, key=order.__getitem__)
+    return selected
+
+
+class PruningStats:
+    """列裁剪统计（线程安全），记录裁剪前后的提示词 token 数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._prompts = 0
+            self._full_tokens = 0
+            self._pruned_tokens = 0
+
+    def record(self, full_tokens: int, pruned_tokens: int):
+        with self._lock:
+            self._prompts += 1
+            self._full_tokens += full_tokens
+            self._pruned_tokens += pruned_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = 1 - self._pruned_tokens / self._full_tokens if self._full_tokens else None
+            return {
+                "pruned_prompts": self._prompts,
+                "full_tokens": self._full_tokens,
+                "pruned_tokens": self._pruned_tokens,
+                "saved_ratio": round(saved, 4) if saved is not None else None,
+            }
+
+
+pruning_stats = PruningStats()
+
+
+class ColumnPruningMiddleware(AgentMiddleware):
+    """每次调用模型前，用按当前问题生成的系统提示（候选表、裁剪过的列）替换默认系统提示"""
+
+    def __init__(self, build_prompt: Callable[[str], Optional[str]]):
+        """
+        Args:
+            build_prompt: 根据问题生成裁剪后的系统提示，不需要裁剪时返回 None；每次模型调用都会调用，
+                同一问题的多步调用应返回同一个提示（由调用方按问题缓存，中间件本身不保存问题相关的状态，
+                同一个 Agent 上的并发问题互不影响）
+        """
+        super().__init__()
+        self._build_prompt = build_prompt
+
+    def wrap_model_call(self, request, handler):
+        message = next((m for m in reversed(request.messages) if isinstance(m, HumanMessage)), None)
+        if message is None or not message.text:
+            return handler(request)
+
+        prompt = self._build_prompt(message.text)
+        if prompt is None:
+            return handler(request)
+        return handler(request.override(system_message=SystemMessage(content=prompt)))
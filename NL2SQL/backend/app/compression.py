@@ -0,0 +1,303 @@
+"""
+响应压缩中间件
+支持 zstd, brotli, gzip；小响应不压缩，大响应在线程池中压缩，流式响应逐块压缩
+"""
+
+import gzip
+import logging
+import threading
+import zlib
+from typing import Any, Dict, Optional
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+# zstandard / brotli 为可选依赖，不可用时只提供 gzip
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# 值得压缩的内容类型前缀
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/vnd.apache.arrow.stream",
+    "image/svg+xml",
+)
+
+
+class _GzipEncoder:
+    """gzip 编码器"""
+
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self.level = level
+        self._stream = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress_all(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level)
+
+    def compress_chunk(self, data: bytes) -> bytes:
+        # SYNC_FLUSH 保证每个块都能被客户端立即解压，适合流式导出
+        return self._stream.compress(data) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._stream.flush(zlib.Z_FINISH)
+
+
+class _ZstdEncoder:
+    """zstd 编码器"""
+
+    name = "zstd"
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._stream = None
+
+    def compress_all(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def compress_chunk(self, data: bytes) -> bytes:
+        if self._stream is None:
+            self._stream = self._compressor.compressobj()
+        return self._stream.compress(data) + self._stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self._stream is None:
+            self._stream = self._compressor.compressobj()
+        return self._stream.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class _BrotliEncoder:
+    """brotli 编码器"""
+
+    name = "br"
+
+    def __init__(self, quality: int):
+        self.quality = quality
+        self._stream = None
+
+    def compress_all(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def compress_chunk(self, data: bytes) -> bytes:
+        if self._stream is None:
+            self._stream = brotli.Compressor(quality=self.quality)
+        return self._stream.process(data) + self._stream.flush()
+
+    def finish(self) -> bytes:
+        if self._stream is None:
+            self._stream = brotli.Compressor(quality=self.quality)
+        return self._stream.finish()
+
+
+class CompressionStats:
+    """压缩统计（线程安全），按编码记录压缩前后的字节数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._by_encoding: Dict[str, Dict[str, int]] = {}
+            self._skipped = {"too_small": 0, "not_compressible": 0, "already_encoded": 0, "not_accepted": 0}
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int, streamed: bool, offloaded: bool):
+        with self._lock:
+            stats = self._by_encoding.setdefault(encoding, {
+                "responses": 0, "streamed": 0, "offloaded": 0, "bytes_in": 0, "bytes_out": 0
+            })
+            stats["responses"] += 1
+            stats["streamed"] += int(streamed)
+            stats["offloaded"] += int(offloaded)
+            stats["bytes_in"] += bytes_in
+            stats["bytes_out"] += bytes_out
+
+    def skip(self, reason: str):
+        with self._lock:
+            self._skipped[reason] = self._skipped.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回统计快照，包含每种编码的压缩率"""
+        with self._lock:
+            encodings = {}
+            for name, stats in self._by_encoding.items():
+                ratio = stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else None
+                encodings[name] = dict(stats, ratio=round(ratio, 4) if ratio is not None else None)
+            return {"encodings": encodings, "skipped": dict(self._skipped)}
+
+
+compression_stats = CompressionStats()
+
+
+class CompressionMiddleware:
+    """
+    ASGI 响应压缩中间件
+
+    - 按客户端 Accept-Encoding 选择 zstd > br > gzip
+    - 单块响应小于 minimum_size 时不压缩
+    - 单块响应或流式块大于 offload_size 时在线程池中压缩，避免阻塞事件循环
+    - 流式响应（StreamingResponse）逐块压缩并立即下发
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, offload_size: int = 256 * 1024,
+                 gzip_level: int = 6, zstd_level: int = 3, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoder = self._select_encoder(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoder is None:
+            compression_stats.skip("not_accepted")
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoder, send)
+        await self.app(scope, receive, responder.send)
+
+    def _select_encoder(self, accept_encoding: str):
+        """解析 Accept-Encoding，返回服务端可用且客户端接受的首选编码器"""
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            parts = item.strip().split(";")
+            name = parts[0].strip()
+            if any(p.strip() in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in parts[1:]):
+                continue
+            if name:
+                accepted.add(name)
+
+        if "zstd" in accepted and ZSTD_AVAILABLE:
+            return _ZstdEncoder(self.zstd_level)
+        if "br" in accepted and BROTLI_AVAILABLE:
+            return _BrotliEncoder(self.brotli_quality)
+        if "gzip" in accepted or "*" in accepted:
+            return _GzipEncoder(self.gzip_level)
+        return None
+
+
+class _CompressionResponder:
+    """包装单个请求的 send，在第一块响应体到达时决定是否压缩"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoder, send):
+        self.middleware = middleware
+        self.encoder = encoder
+        self.downstream_send = send
+        self.start_message: Optional[Dict[str, Any]] = None
+        self.started = False
+        self.compressing = False
+        self.streamed = False
+        self.offloaded = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # 等到第一块响应体再决定响应头
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body":
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            await self._start(body, more_body)
+            return
+
+        if not self.compressing:
+            await self.downstream_send(message)
+            return
+
+        chunk = await self._run(self.encoder.compress_chunk, body) if body else b""
+        if not more_body:
+            chunk += self.encoder.finish()
+        self.bytes_in += len(body)
+        self.bytes_out += len(chunk)
+        if not more_body:
+            self._record()
+        await self.downstream_send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _start(self, body: bytes, more_body: bool):
+        """处理第一块响应体：决定是否压缩并发送响应头"""
+        headers = list(self.start_message.get("headers", []))
+        header_map = {k.lower(): v for k, v in headers}
+        content_type = header_map.get(b"content-type", b"").decode("latin-1").lower()
+
+        reason = None
+        if b"content-encoding" in header_map:
+            reason = "already_encoded"
+        elif not content_type.startswith(COMPRESSIBLE_TYPES):
+            reason = "not_compressible"
+        elif not more_body and len(body) < self.middleware.minimum_size:
+            reason = "too_small"
+
+        if reason:
+            compression_stats.skip(reason)
+            await self.downstream_send(self.start_message)
+            await self.downstream_send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        self.compressing = True
+        headers = [(k, v) for k, v in headers if k.lower() not in (b"content-length", b"content-encoding")]
+        headers.append((b"content-encoding", self.encoder.name.encode("latin-1")))
+        if b"vary" in header_map:
+            headers = [(k, v + b", Accept-Encoding" if k.lower() == b"vary" else v) for k, v in headers]
+        else:
+            headers.append((b"vary", b"Accept-Encoding"))
+
+        if more_body:
+            # 流式响应：分块传输，逐块压缩
+            self.streamed = True
+            compressed = await self._run(self.encoder.compress_chunk, body) if body else b""
+        else:
+            compressed = await self._run(self.encoder.compress_all, body)
+            headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        if not more_body:
+            self._record()
+
+        await self.downstream_send(dict(self.start_message, headers=headers))
+        await self.downstream_send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+    async def _run(self, func, data: bytes) -> bytes:
+        """大数据块放到线程池中压缩"""
+        if len(data) >= self.middleware.offload_size:
+            self.offloaded = True
+            return await anyio.to_thread.run_sync(func, data)
+        return func(data)
+
+    def _record(self):
+        compression_stats.record(self.encoder.name, self.bytes_in, self.bytes_out,
+                                 self.streamed, self.offloaded)
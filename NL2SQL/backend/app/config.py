@@ -17,6 +17,84 @@ class Settings(BaseSettings):
     # Database Configuration
     database_url: str = "sqlite:///./data/sql_agent.db"
 
+    # Connection Pool Configuration
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30  # 等待可用连接的超时时间（秒）
+    db_pool_recycle: int = 1800  # 连接最大存活时间（秒），避免被服务端超时断开
+    db_pool_pre_ping: bool = True
+    db_pool_warm_connections: int = 2  # 启动时预先建立的连接数
+
+    # Metadata Catalog Configuration
+    catalog_ttl_seconds: int = 300  # 元数据缓存有效期，到期后校验结构指纹
+    row_count_exact_ttl_seconds: int = 600  # 后台精确行数的缓存有效期
+    row_count_workers: int = 2  # 后台计算精确行数的线程数
+    metadata_workers: int = 8  # 并发收集表元数据的线程数
+    metadata_deadline_seconds: float = 2.0  # 数据源列表的整体截止时间，超时的表标记为 pending
+
+    # SQLite Performance Profile
+    sqlite_wal: bool = True  # 读写连接使用 WAL 日志模式
+    sqlite_cache_size_kb: int = 65536  # 每个连接的页缓存大小
+    sqlite_mmap_size: int = 268435456  # 内存映射读取上限（字节），0 表示关闭
+
+    # Index Advisor Configuration
+    index_advisor_enabled: bool = True  # 记录上传文件查询的列使用情况
+    index_advisor_auto_build: bool = True  # 推荐后自动建立索引
+    index_advisor_min_score: float = 3.0  # 列使用分数达到该值后评估是否建索引
+    index_advisor_min_rows: int = 1000  # 小于该行数的表不建索引
+    index_advisor_min_distinct_ratio: float = 0.01  # 过滤列的最低选择性（不同取值数 / 行数）
+    index_advisor_min_speedup: float = 1.2  # 实测加速低于该倍数的索引会被删除
+    index_advisor_max_indexes_per_table: int = 5
+
+    # Materialized Aggregate Configuration
+    materialize_enabled: bool = True  # 为高频聚合查询建立汇总表并改写查询
+    materialize_min_occurrences: int = 3  # 同一聚合形态出现该次数后建立汇总表
+    materialize_min_rows: int = 10000  # 基表小于该行数时不物化
+    materialize_max_ratio: float = 0.2  # 汇总表行数超过基表该比例时放弃
+    materialize_check_seconds: int = 30  # 检查基表是否变化的最小间隔
+
+    # Time Rollup Configuration
+    rollups_enabled: bool = True  # 上传文件入库时为日期列建立 日/周/月 汇总表
+    rollup_min_rows: int = 1000  # 原始表少于该行数时不建立汇总表
+    rollup_max_dimension_cardinality: int = 50  # 维度列的最大不同取值数
+
+    # Column Profile Configuration
+    profile_dir: str = "./data/profiles"  # 列概况持久化目录
+    profile_check_seconds: int = 30  # 检查表数据版本的最小间隔
+    profile_top_k: int = 10  # 每列保存的高频取值数
+    profile_top_values_max_distinct: int = 1000  # 不同值超过该数量的列不统计高频取值
+    profile_prompt_max_tables: int = 5  # 表数量不超过该值时把列概况直接写入提示词
+    profile_prompt_max_values: int = 5  # 提示词中每列列出的高频取值数
+
+    # Column Value Index Configuration
+    value_index_enabled: bool = True  # 为文本列的取值建立前缀/n-gram 索引（实体解析与输入联想）
+    value_index_max_distinct: int = 50000  # 不同值超过该数量的列不建索引
+    value_index_min_similarity: float = 0.3  # 实体解析时模糊匹配的最低相似度
+
+    # Column Pruning Configuration
+    column_pruning_enabled: bool = True  # 按问题裁剪宽表写入提示词的列
+    column_pruning_min_columns: int = 40  # 列数超过该值的表才裁剪
+    column_pruning_top_k: int = 25  # 每张宽表保留的最相关列数
+    column_pruning_min_keep: int = 10  # 相关列不足时按原有顺序补足到该数量
+
+    # Table Retrieval Configuration
+    table_retrieval_enabled: bool = True  # 表较多的数据源按问题检索候选表，只把候选表写入提示词
+    table_retrieval_min_tables: int = 30  # 表数量达到该值时才检索
+    table_retrieval_top_k: int = 8  # 每个问题最多保留的候选表数（不含外键关联表和汇总表）
+    table_retrieval_min_score_ratio: float = 0.2  # 得分低于最高分该比例的表不作为候选
+
+    # Metric Catalog Configuration
+    metrics_dir: str = "./metrics"  # 指标目录文件所在目录（{数据集ID}.json / .yaml）
+    metric_default_limit: int = 1000  # 指标查询默认返回的最大行数
+    metric_max_limit: int = 10000  # 指标查询允许的最大行数
+
+    # Tool Output Compaction Configuration
+    tool_result_preview_rows: int = 20  # sql_db_query 返回给模型的最多示例行数（完整结果直接进入响应）
+    tool_result_max_tokens: int = 1500  # sql_db_query 返回给模型的摘要 token 上限
+    scratchpad_pruning_enabled: bool = True  # Agent 步骤较多时缩短较早的工具输出
+    scratchpad_max_tokens: int = 6000  # 消息总 token 数超过该值时开始缩短
+    scratchpad_keep_recent: int = 2  # 最近的几条工具输出保持原样
+
     # External Database Configuration (Optional)
     external_db_type: Optional[str] = None  # mysql, postgresql, mssql
     external_db_host: Optional[str] = None
@@ -37,10 +115,58 @@ class Settings(BaseSettings):
     # Visualization Configuration
     vis_output_dir: str = "./data/visualizations"
 
+    # Result Export Configuration
+    export_batch_size: int = 5000  # 每批从服务端游标读取的行数
+    max_stored_results: int = 1000  # 可导出的查询结果记录上限
+
+    # Response Compression Configuration
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024  # 小于该字节数的响应不压缩
+    compression_offload_size: int = 262144  # 大于该字节数的数据块在线程池中压缩
+    compression_gzip_level: int = 6
+    compression_zstd_level: int = 3
+    compression_brotli_quality: int = 4
+
     # Model Configuration
     default_model: str = "qwen-plus"
     temperature: float = 0.0
 
+    # Model Routing Configuration
+    model_routing_enabled: bool = True  # 简单问题使用小模型，复杂问题和小模型失败时使用 default_model
+    fast_model: Optional[str] = "qwen-turbo"  # 小模型档位，为空时不路由
+    model_routing_complex_threshold: int = 2  # 复杂度得分达到该值时使用大模型
+    model_routing_long_question_chars: int = 60  # 超过该长度的问题复杂度加 1
+    model_routing_wide_schema_tables: int = 6  # 候选表达到该数量时复杂度加 1
+    model_routing_escalate: bool = True  # 小模型执行 SQL 失败或没有生成 SQL 时用大模型重试
+    default_model_input_price: float = 0.0008  # 每千 token 单价（用于按档位统计费用）
+    default_model_output_price: float = 0.002
+    fast_model_input_price: float = 0.0003
+    fast_model_output_price: float = 0.0006
+
+    # LLM Resilience Configuration
+    llm_request_timeout: float = 60.0  # 单次模型请求超时（秒）
+    llm_max_retries: int = 2  # 超时、连接错误、限流、服务端错误的重试次数（指数退避 + 随机抖动）
+    llm_retry_base_delay: float = 0.5  # 第一次重试的最大等待秒数，之后每次翻倍
+    llm_retry_max_delay: float = 8.0  # 单次重试的最大等待秒数
+    llm_hedge_after_seconds: float = 4.0  # 超过该秒数仍未返回时发出对冲请求，0 表示不对冲
+    llm_hedge_workers: int = 32  # 执行模型请求（含对冲请求）的线程数
+    llm_breaker_failure_threshold: int = 5  # 连续失败该次数后熔断
+    llm_breaker_reset_seconds: float = 30.0  # 熔断后经过该秒数放行试探请求
+    llm_fallback_cache_size: int = 500  # 模型不可用时可回退使用的最近回答数
+
+    # Admission Control Configuration
+    admission_enabled: bool = True  # 限制 /query 和 /chat 同时调用模型的问题数
+    admission_max_concurrent: int = 8  # 全局同时执行的问题数
+    admission_per_client: int = 2  # 每个客户端（X-Client-ID 请求头或客户端地址）同时执行的问题数
+    admission_max_queue: int = 64  # 全局等待队列长度，满时返回 503
+    admission_per_client_queue: int = 8  # 每个客户端的排队上限，超过时返回 429
+    admission_max_wait_seconds: float = 30.0  # 最长排队时间，超时返回 503
+
+    # Agent Budget Configuration
+    agent_max_steps: int = 8  # 每个问题最多调用模型的次数
+    agent_max_tokens: int = 60000  # 每个问题最多消耗的 token 数（输入 + 输出）
+    agent_deadline_seconds: float = 90.0  # 每个问题的最长耗时，超过后不再调用模型
+
     class Config:
         env_file = ".env"
         case_sensitive = False
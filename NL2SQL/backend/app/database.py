@@ -3,14 +3,24 @@
 支持 MySQL, PostgreSQL, SQL Server, SQLite
 """
 
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
 from typing import Dict, List, Any, Optional
 import logging
+import time
 from app.config import get_database_url, settings
+from app.result_set import ResultSet
+from app.engine_registry import engine_registry
+from app.catalog import metadata_catalog
 
 logger = logging.getLogger(__name__)
 
+# 表元数据收集线程池（进程级共享，限制对数据库的并发请求数）
+_metadata_executor = ThreadPoolExecutor(
+    max_workers=settings.metadata_workers, thread_name_prefix="table-metadata"
+)
+
 
 class DatabaseManager:
     """数据库管理器，支持多种数据库类型"""
@@ -50,21 +60,8 @@ class DatabaseManager:
         try:
             logger.info(f"Connecting to database: {self._mask_password(self.db_url)}")
 
-            # 根据数据库类型设置连接参数
-            connect_args = {}
-            if self.db_type == "sqlite":
-                connect_args = {"check_same_thread": False}
-
-            self.engine = create_engine(
-                self.db_url,
-                connect_args=connect_args,
-                pool_pre_ping=True,  # 自动检查连接是否有效
-                echo=settings.debug  # debug模式下显示SQL语句
-            )
-
-            # 测试连接
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            # 使用进程级共享引擎，首次创建时验证连接，之后直接复用连接池
+            self.engine = engine_registry.get_engine(self.db_url, verify=True)
 
             logger.info("✅ Database connected successfully!")
             return True
@@ -100,8 +97,7 @@ class DatabaseManager:
             return []
 
         try:
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
+            tables = metadata_catalog.get_tables(self.engine)
             logger.info(f"Found {len(tables)} tables: {tables}")
             return tables
         except Exception as e:
@@ -123,32 +119,86 @@ class DatabaseManager:
             return {}
 
         try:
-            inspector = inspect(self.engine)
-            columns = inspector.get_columns(table_name)
+            # 列信息来自元数据目录缓存
+            table = metadata_catalog.get_table(self.engine, table_name)
+            if table is None:
+                logger.error(f"Table not found: {table_name}")
+                return {}
+            columns = table["columns"]
 
-            # 获取行数
-            with self.engine.connect() as conn:
-                result = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-                row_count = result.scalar()
+            # 行数：默认使用统计信息估算值，精确值在后台计算并缓存
+            row_count = metadata_catalog.get_row_count(self.engine, table_name)
 
             return {
                 "name": table_name,
-                "columns": [
-                    {
-                        "name": col["name"],
-                        "type": str(col["type"]),
-                        "nullable": col.get("nullable", True),
-                        "default": col.get("default"),
-                    }
-                    for col in columns
-                ],
-                "row_count": row_count,
+                "columns": columns,
+                "primary_key": table["primary_key"],
+                "foreign_keys": table["foreign_keys"],
+                "row_count": row_count["count"],
+                "row_count_exact": row_count["exact"],
                 "column_count": len(columns),
             }
         except Exception as e:
             logger.error(f"Error getting table info for {table_name}: {str(e)}")
             return {}
 
+    def collect_table_infos(self, table_names: Optional[List[str]] = None,
+                            timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        并发获取多张表的详细信息，整体不超过截止时间
+
+        表名先从元数据目录缓存或一次表名查询得到（不反射结构），之后每张表一个后台任务；
+        结构反射和估算行数按数据源缓存，由第一个任务执行，其余任务等待并复用。
+        未在截止时间内完成的表返回 {"name": 表名, "pending": True}；其后台任务会继续执行，
+        结果写入元数据目录缓存，下次请求即可直接返回。
+
+        Args:
+            table_names: 表名列表，默认为数据库中的所有表
+            timeout: 整体截止时间（秒），默认使用配置中的 metadata_deadline_seconds
+
+        Returns:
+            与 table_names 顺序一致的表信息列表（获取失败的表被跳过）
+        """
+        if not self.engine:
+            return []
+
+        timeout = settings.metadata_deadline_seconds if timeout is None else timeout
+        start = time.perf_counter()
+        if table_names is None:
+            # 表名查询同样受截止时间约束，超时时无法列出任何表
+            names_future = _metadata_executor.submit(metadata_catalog.list_table_names, self.engine)
+            try:
+                table_names = names_future.result(timeout=timeout)
+            except FutureTimeoutError:
+                logger.warning(f"Table names not available within {timeout}s deadline")
+                return []
+            except Exception as e:
+                logger.error(f"Error listing tables: {str(e)}")
+                return []
+        if not table_names:
+            return []
+
+        remaining = max(0.0, timeout - (time.perf_counter() - start))
+        futures = {name: _metadata_executor.submit(self.get_table_info, name) for name in table_names}
+        _, not_done = wait(futures.values(), timeout=remaining)
+
+        infos = []
+        for name, future in futures.items():
+            if future in not_done:
+                infos.append({"name": name, "pending": True})
+                continue
+            info = future.result()
+            if info:
+                infos.append(info)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not_done:
+            logger.warning(f"Table metadata deadline reached after {elapsed_ms:.0f} ms, "
+                           f"{len(not_done)}/{len(table_names)} tables pending")
+        else:
+            logger.info(f"Collected metadata for {len(table_names)} tables in {elapsed_ms:.0f} ms")
+        return infos
+
     def execute_query(self, query: str) -> Dict[str, Any]:
         """
         执行SQL查询
@@ -168,15 +218,13 @@ class DatabaseManager:
 
                 # 检查是否是查询语句
                 if result.returns_rows:
-                    rows = result.fetchall()
-                    columns = list(result.keys())
-                    data = [dict(zip(columns, row)) for row in rows]
+                    result_set = ResultSet.from_result(result)
 
                     return {
                         "success": True,
-                        "data": data,
-                        "columns": columns,
-                        "row_count": len(data),
+                        "result_set": result_set,
+                        "columns": result_set.columns,
+                        "row_count": result_set.row_count,
                     }
                 else:
                     # 非查询语句（INSERT, UPDATE, DELETE等）
@@ -191,6 +239,22 @@ class DatabaseManager:
             logger.error(f"Error executing query: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    def stream_query(self, query: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        以服务端游标流式执行SQL查询，按批返回数据行，内存占用与结果集大小无关
+
+        Args:
+            query: SQL查询语句
+            batch_size: 每批行数，默认使用配置中的 export_batch_size
+
+        Returns:
+            查询结果，其中 batches 为逐批产出行元组列表的迭代器
+        """
+        if not self.engine:
+            return {"success": False, "error": "Database not connected"}
+
+        return stream_rows(self.engine, query, batch_size or settings.export_batch_size)
+
     def test_connection(self) -> Dict[str, Any]:
         """
         测试数据库连接并返回基本信息
@@ -215,10 +279,56 @@ class DatabaseManager:
         }
 
     def close(self):
-        """关闭数据库连接"""
+        """释放对共享引擎的引用（连接池由 engine_registry 统一管理，不在此处销毁）"""
         if self.engine:
-            self.engine.dispose()
-            logger.info("Database connection closed")
+            self.engine = None
+            logger.info("Database connection released")
+
+
+def stream_rows(engine: Engine, query: str, batch_size: int) -> Dict[str, Any]:
+    """
+    在给定引擎上以 stream_results/yield_per 执行查询
+
+    查询会先执行一次以便尽早暴露SQL错误并拿到列名，随后数据行在迭代
+    batches 时才从游标中逐批读取；连接在迭代结束（或迭代器被关闭）时释放。
+    执行查询会阻塞，在事件循环中调用时应放到线程池中执行。
+
+    Args:
+        engine: SQLAlchemy 引擎
+        query: SQL查询语句
+        batch_size: 每批行数
+
+    Returns:
+        {"success": True, "columns": [...], "typed_columns": [...], "batches": Iterator[List[tuple]]}，
+        typed_columns 为各列是否由驱动给出了类型（cursor.description 的 type_code，SQLite 没有）
+    """
+    def _iter_batches():
+        with engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True,
+                yield_per=batch_size
+            ).execute(text(query))
+
+            if not result.returns_rows:
+                yield [], []
+                return
+
+            yield list(result.keys()), column_types_known(result.cursor.description)
+            for partition in result.partitions(batch_size):
+                yield [tuple(row) for row in partition]
+
+    try:
+        batches = _iter_batches()
+        columns, typed_columns = next(batches)
+        return {"success": True, "columns": columns, "typed_columns": typed_columns, "batches": batches}
+    except Exception as e:
+        logger.error(f"Error streaming query: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+
+def column_types_known(description) -> List[bool]:
+    """DB-API cursor.description 中各列是否带有驱动给出的类型"""
+    return [column[1] is not None for column in description or []]
 
 
 # 创建全局数据库管理器实例
@@ -0,0 +1,351 @@
+"""
+进程级 SQLAlchemy 引擎注册表
+同一个数据库URL在整个进程内共享一个引擎和连接池，避免每个请求重新建立连接
+"""
+
+import importlib.util
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from app.config import settings
+from app.sqlite_profile import install_sqlite_profile, is_file_sqlite_url, read_only_url
+
+logger = logging.getLogger(__name__)
+
+# 各数据库后端对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+    "mariadb": "aiomysql",
+    "mssql": "aioodbc",
+}
+
+
+def async_driver_available(db_url: str) -> bool:
+    """URL 对应数据库后端的异步驱动是否已安装（未安装时调用方应回退到同步引擎）"""
+    driver = ASYNC_DRIVERS.get(make_url(db_url).get_backend_name())
+    return driver is not None and importlib.util.find_spec(driver) is not None
+
+
+def to_async_url(db_url: str) -> str:
+    """
+    将同步数据库URL转换为对应异步驱动的URL
+
+    例如 sqlite:///a.db -> sqlite+aiosqlite:///a.db，mysql+pymysql://... -> mysql+aiomysql://...
+
+    Raises:
+        ValueError: 数据库后端没有可用的异步驱动
+    """
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f"No async driver configured for database backend: {backend}")
+    return url.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+
+class PoolStats:
+    """单个连接池的借出/等待统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def incr(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def record_wait(self, elapsed_ms: float, timed_out: bool):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total_ms / self.wait_count, 3) if self.wait_count else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录借出等待时间（含新建连接耗时）的 QueuePool"""
+
+    stats: Optional[PoolStats] = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if self.stats is not None:
+                self.stats.record_wait((time.perf_counter() - start) * 1000, timed_out)
+
+    def recreate(self):
+        # engine.dispose() 会重建连接池，统计对象需要延续
+        new_pool = super().recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+
+class EngineRegistry:
+    """按URL缓存引擎，统一连接池参数并暴露连接池统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: Dict[str, Engine] = {}
+        self._async_engines: Dict[str, AsyncEngine] = {}
+        self._stats: Dict[str, PoolStats] = {}
+        self._async_stats: Dict[str, PoolStats] = {}
+
+    def get_engine(self, db_url: str, verify: bool = False) -> Engine:
+        """
+        获取（必要时创建）URL对应的共享引擎
+
+        Args:
+            db_url: 数据库连接URL
+            verify: 首次创建时是否执行 SELECT 1 验证连接，验证失败会抛出异常且不缓存引擎
+
+        Returns:
+            共享的 SQLAlchemy 引擎
+        """
+        engine = self._engines.get(db_url)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            engine = self._engines.get(db_url)
+            if engine is not None:
+                return engine
+
+            engine, stats = self._create_engine(db_url)
+            if verify:
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(text("SELECT 1"))
+                except Exception:
+                    engine.dispose()
+                    raise
+
+            self._engines[db_url] = engine
+            self._stats[db_url] = stats
+            logger.info(f"Registered engine for {engine.url.render_as_string(hide_password=True)}")
+            return engine
+
+    def get_query_engine(self, db_url: str) -> Engine:
+        """
+        获取只用于查询的共享引擎
+
+        文件型 SQLite 以只读URI（mode=ro）打开并开启 query_only；其他数据库与 get_engine 相同。
+
+        Args:
+            db_url: 数据库连接URL
+
+        Returns:
+            共享的 SQLAlchemy 引擎
+        """
+        if is_file_sqlite_url(db_url):
+            return self.get_engine(read_only_url(db_url))
+        return self.get_engine(db_url)
+
+    def is_shared(self, engine: Engine) -> bool:
+        """引擎是否由注册表管理（生命周期与进程相同，可以为其 URL 建立共享的异步引擎）"""
+        return any(shared is engine for shared in list(self._engines.values()))
+
+    def get_async_engine(self, db_url: str) -> AsyncEngine:
+        """
+        获取（必要时创建）同步URL对应的共享异步引擎，驱动按URL的数据库后端选择
+
+        Args:
+            db_url: 同步数据库连接URL（与 get_engine 相同）
+
+        Returns:
+            共享的 SQLAlchemy 异步引擎
+        """
+        engine = self._async_engines.get(db_url)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            engine = self._async_engines.get(db_url)
+            if engine is not None:
+                return engine
+
+            async_url = to_async_url(db_url)
+            stats = PoolStats()
+            engine = create_async_engine(async_url, **self._engine_kwargs(db_url, pool_class=None))
+            self._listen(engine.sync_engine, stats)
+            self._install_profile(engine.sync_engine)
+
+            self._async_engines[db_url] = engine
+            self._async_stats[db_url] = stats
+            logger.info(f"Registered async engine for {engine.url.render_as_string(hide_password=True)}")
+            return engine
+
+    def _engine_kwargs(self, db_url: str, pool_class=InstrumentedQueuePool) -> Dict[str, Any]:
+        """按配置生成引擎参数；pool_class 为 None 时使用方言默认的连接池类"""
+        kwargs: Dict[str, Any] = {
+            "pool_pre_ping": settings.db_pool_pre_ping,  # 自动检查连接是否有效
+            "echo": settings.debug,  # debug模式下显示SQL语句
+        }
+
+        is_sqlite = db_url.startswith("sqlite")
+        in_memory = is_sqlite and (":memory:" in db_url or db_url.rstrip("/") == "sqlite:")
+
+        if is_sqlite:
+            kwargs["connect_args"] = {"check_same_thread": False}
+
+        if not in_memory:
+            kwargs.update({
+                "pool_size": settings.db_pool_size,
+                "max_overflow": settings.db_max_overflow,
+                "pool_timeout": settings.db_pool_timeout,
+                "pool_recycle": settings.db_pool_recycle,
+            })
+            if pool_class is not None:
+                kwargs["poolclass"] = pool_class
+
+        return kwargs
+
+    @staticmethod
+    def _listen(engine: Engine, stats: PoolStats):
+        """注册连接池事件计数"""
+        event.listen(engine, "connect", lambda *args: stats.incr("connects"))
+        event.listen(engine, "checkout", lambda *args: stats.incr("checkouts"))
+        event.listen(engine, "checkin", lambda *args: stats.incr("checkins"))
+        event.listen(engine, "invalidate", lambda *args: stats.incr("invalidations"))
+
+    def _create_engine(self, db_url: str):
+        """按配置创建带连接池的引擎"""
+        stats = PoolStats()
+        engine = create_engine(db_url, **self._engine_kwargs(db_url))
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.stats = stats
+
+        self._listen(engine, stats)
+        self._install_profile(engine)
+        return engine, stats
+
+    @staticmethod
+    def _install_profile(engine: Engine):
+        """SQLite 引擎应用连接级 PRAGMA 配置"""
+        install_sqlite_profile(
+            engine,
+            cache_size_kb=settings.sqlite_cache_size_kb,
+            mmap_size=settings.sqlite_mmap_size,
+            wal=settings.sqlite_wal,
+        )
+
+    def warm(self, db_url: str) -> bool:
+        """
+        预热引擎：创建引擎并建立 pool_size 个以内的初始连接
+
+        Returns:
+            是否预热成功
+        """
+        try:
+            engine = self.get_engine(db_url, verify=True)
+            pool = engine.pool
+            target = min(settings.db_pool_warm_connections, settings.db_pool_size)
+            connections = []
+            try:
+                for _ in range(target):
+                    connections.append(engine.connect())
+            finally:
+                for conn in connections:
+                    conn.close()
+            logger.info(f"✅ Engine warmed: {pool.status() if hasattr(pool, 'status') else ''}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to warm engine: {str(e)}")
+            return False
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """所有引擎的连接池状态与借出/等待统计"""
+        result = {}
+        engines = [(engine, self._stats.get(db_url)) for db_url, engine in list(self._engines.items())]
+        engines += [(engine.sync_engine, self._async_stats.get(db_url))
+                    for db_url, engine in list(self._async_engines.items())]
+        for engine, stats in engines:
+            if stats is None:
+                continue
+            pool = engine.pool
+            entry = stats.snapshot()
+            if isinstance(pool, QueuePool):
+                entry.update({
+                    "pool_size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "checked_in": pool.checkedin(),
+                    "overflow": pool.overflow(),
+                })
+            result[engine.url.render_as_string(hide_password=True)] = entry
+        return result
+
+    def dispose(self, db_url: str):
+        """释放指定URL的引擎"""
+        with self._lock:
+            engine = self._engines.pop(db_url, None)
+            self._stats.pop(db_url, None)
+        if engine is not None:
+            engine.dispose()
+
+    def dispose_all(self):
+        """释放所有引擎（应用关闭时调用）"""
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            self._stats.clear()
+        for engine in engines:
+            engine.dispose()
+        logger.info(f"Disposed {len(engines)} pooled engines")
+
+    async def dispose_async_engine(self, db_url: str):
+        """释放指定URL的异步引擎（需在创建它的事件循环中调用）"""
+        with self._lock:
+            engine = self._async_engines.pop(db_url, None)
+            self._async_stats.pop(db_url, None)
+        if engine is not None:
+            await engine.dispose()
+
+    async def dispose_async_engines(self):
+        """释放所有异步引擎（需在创建它们的事件循环中调用）"""
+        with self._lock:
+            engines = list(self._async_engines.values())
+            self._async_engines.clear()
+            self._async_stats.clear()
+        for engine in engines:
+            await engine.dispose()
+        if engines:
+            logger.info(f"Disposed {len(engines)} async engines")
+
+
+# 创建全局引擎注册表实例
+engine_registry = EngineRegistry()
@@ -0,0 +1,263 @@
+"""
+查询结果流式导出
+支持 CSV, NDJSON, Arrow IPC Stream 三种格式，逐批编码，内存占用与结果集大小无关
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# pyarrow 为可选依赖，仅 Arrow 格式导出需要
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    ARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pc = None
+    ARROW_AVAILABLE = False
+
+# float64 能精确表示的最大整数，超过时整数列不能与小数合并为 float64
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+class ResultExporter:
+    """将逐批读取的查询结果编码为可流式传输的字节块"""
+
+    MEDIA_TYPES = {
+        "csv": "text/csv; charset=utf-8",
+        "ndjson": "application/x-ndjson",
+        "arrow": "application/vnd.apache.arrow.stream",
+    }
+
+    FILE_EXTENSIONS = {
+        "csv": "csv",
+        "ndjson": "ndjson",
+        "arrow": "arrows",
+    }
+
+    @staticmethod
+    def supported_formats() -> List[str]:
+        """返回当前环境可用的导出格式"""
+        formats = ["csv", "ndjson"]
+        if ARROW_AVAILABLE:
+            formats.append("arrow")
+        return formats
+
+    @staticmethod
+    def iter_encoded(export_format: str, columns: List[str], batches: Iterable[List[tuple]],
+                     typed_columns: Optional[Sequence[bool]] = None) -> Iterator[bytes]:
+        """
+        按指定格式编码数据
+
+        Args:
+            export_format: 导出格式 ('csv', 'ndjson' 或 'arrow')
+            columns: 列名列表
+            batches: 逐批产出行元组列表的迭代器
+            typed_columns: 各列是否由数据库驱动给出了固定类型（stream_rows 返回的 typed_columns），
+                仅 Arrow 格式使用，None 表示都未知
+
+        Returns:
+            字节块迭代器
+        """
+        encoder = ResultExporter.encoder(export_format, columns, typed_columns)
+        for batch in batches:
+            chunk = encoder.encode(batch)
+            if chunk:
+                yield chunk
+        chunk = encoder.finish()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    async def aiter_encoded(export_format: str, columns: List[str], batches: AsyncIterable[List[tuple]],
+                            typed_columns: Optional[Sequence[bool]] = None) -> AsyncIterator[bytes]:
+        """
+        与 iter_encoded 相同，batches 为异步迭代器（异步引擎的流式结果）；
+        每批的编码在线程池中执行，不阻塞事件循环
+        """
+        encoder = ResultExporter.encoder(export_format, columns, typed_columns)
+        async for batch in batches:
+            chunk = await asyncio.to_thread(encoder.encode, batch)
+            if chunk:
+                yield chunk
+        chunk = encoder.finish()
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def encoder(export_format: str, columns: List[str],
+                typed_columns: Optional[Sequence[bool]] = None) -> "BatchEncoder":
+        """创建指定格式的逐批编码器"""
+        if export_format == "csv":
+            return CsvEncoder(columns)
+        if export_format == "ndjson":
+            return NdjsonEncoder(columns)
+        if export_format == "arrow":
+            return ArrowEncoder(columns, typed_columns)
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    @staticmethod
+    def iter_csv(columns: List[str], batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+        """编码为CSV（带 UTF-8 BOM，便于 Excel 正确识别中文）"""
+        return ResultExporter.iter_encoded("csv", columns, batches)
+
+    @staticmethod
+    def iter_ndjson(columns: List[str], batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+        """编码为NDJSON（每行一个JSON对象）"""
+        return ResultExporter.iter_encoded("ndjson", columns, batches)
+
+    @staticmethod
+    def iter_arrow(columns: List[str], batches: Iterable[List[tuple]],
+                   typed_columns: Optional[Sequence[bool]] = None) -> Iterator[bytes]:
+        """编码为 Arrow IPC Stream（schema 的确定规则见 ArrowEncoder）"""
+        return ResultExporter.iter_encoded("arrow", columns, batches, typed_columns)
+
+    @staticmethod
+    def content_disposition(result_id: str, export_format: str) -> Dict[str, Any]:
+        """生成下载文件名响应头"""
+        extension = ResultExporter.FILE_EXTENSIONS[export_format]
+        return {"Content-Disposition": f'attachment; filename="result_{result_id}.{extension}"'}
+
+
+class BatchEncoder:
+    """逐批编码器：encode 返回该批对应的字节（可以为空），finish 返回结尾的字节"""
+
+    def encode(self, batch: List[tuple]) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CsvEncoder(BatchEncoder):
+    """CSV 编码（带 UTF-8 BOM，便于 Excel 正确识别中文），表头随第一批一起输出"""
+
+    def __init__(self, columns: List[str]):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(columns)
+        self._header = ("\ufeff" + self._buffer.getvalue()).encode("utf-8")
+
+    def _take_header(self) -> bytes:
+        header, self._header = self._header, b""
+        return header
+
+    def encode(self, batch: List[tuple]) -> bytes:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerows(batch)
+        return self._take_header() + self._buffer.getvalue().encode("utf-8")
+
+    def finish(self) -> bytes:
+        # 没有数据行时仍输出表头
+        return self._take_header()
+
+
+class NdjsonEncoder(BatchEncoder):
+    """NDJSON 编码（每行一个JSON对象）"""
+
+    def __init__(self, columns: List[str]):
+        self._columns = columns
+
+    def encode(self, batch: List[tuple]) -> bytes:
+        lines = [
+            json.dumps(dict(zip(self._columns, row)), ensure_ascii=False, default=str)
+            for row in batch
+        ]
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+class ArrowEncoder(BatchEncoder):
+    """
+    Arrow IPC Stream 编码
+
+    IPC 流的 schema 写出后不能再修改，查询只执行一次，schema 由第一批非空数据确定：
+    驱动给出了列类型的列（PostgreSQL、MySQL 等）各批类型一致，直接使用推断出的类型；
+    没有类型信息的列（SQLite 按值存储类型，同一列可能同时有整数和小数）放宽为能容纳后续取值的类型，
+    数值列为 float64，第一批中超出 float64 精度的整数和其他类型为字符串。
+    第一批全为空值的列按字符串导出。写出时只做无损转换，后续批次仍无法无损转换时抛出异常而不是截断
+    """
+
+    def __init__(self, columns: List[str], typed_columns: Optional[Sequence[bool]] = None):
+        if not ARROW_AVAILABLE:
+            raise RuntimeError("pyarrow is not installed")
+        self._columns = columns
+        self._typed_columns = typed_columns
+        self._sink = io.BytesIO()
+        self._writer = None
+        self._schema = None
+
+    def encode(self, batch: List[tuple]) -> bytes:
+        if not batch:
+            return b""
+        if self._schema is None:
+            self._schema = ArrowEncoder._arrow_schema(self._columns, batch, self._typed_columns)
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        self._writer.write_batch(ArrowEncoder._to_record_batch(self._schema, batch))
+        return self._drain()
+
+    def finish(self) -> bytes:
+        if self._writer is None:
+            # 没有数据行时仍写出只含 schema 的流
+            self._schema = pa.schema([pa.field(name, pa.large_string()) for name in self._columns])
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        self._writer.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        """取出缓冲区中已写入的字节并清空缓冲区"""
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    @staticmethod
+    def _arrow_schema(columns: List[str], batch: List[tuple], typed_columns: Optional[Sequence[bool]]):
+        """由第一批数据确定导出 schema（规则见类说明）"""
+        typed_columns = typed_columns or [False] * len(columns)
+        fields = []
+        for name, values, typed in zip(columns, zip(*batch), typed_columns):
+            array = ArrowEncoder._to_arrow_array(values)
+            arrow_type = array.type
+            if pa.types.is_null(arrow_type) or pa.types.is_string(arrow_type):
+                arrow_type = pa.large_string()
+            elif pa.types.is_binary(arrow_type):
+                arrow_type = pa.large_binary()
+            elif pa.types.is_decimal(arrow_type):
+                # 未声明精度的 NUMERIC 各行小数位数不同，按最大精度保留第一批的小数位数
+                arrow_type = pa.decimal128(38, arrow_type.scale) if typed else pa.large_string()
+            elif not typed and (pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type)):
+                too_big = pa.types.is_integer(arrow_type) and len(array) > array.null_count and \
+                    pc.max(pc.abs(array)).as_py() > MAX_EXACT_FLOAT_INT
+                arrow_type = pa.large_string() if too_big else pa.float64()
+            fields.append(pa.field(name, arrow_type))
+        return pa.schema(fields)
+
+    @staticmethod
+    def _to_record_batch(schema, batch: List[tuple]):
+        """按导出 schema 无损转换一批数据，无法无损转换时抛出 ValueError"""
+        arrays = []
+        for field, values in zip(schema, zip(*batch)):
+            if pa.types.is_large_string(field.type):
+                arrays.append(pa.array([None if v is None else str(v) for v in values], type=field.type))
+                continue
+            try:
+                # cast 默认是安全转换，会损失精度时抛出 ArrowInvalid
+                arrays.append(ArrowEncoder._to_arrow_array(values).cast(field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+                raise ValueError(f"Column {field.name} cannot be exported as {field.type} without loss: {e}") from e
+        return pa.record_batch(arrays, schema=schema)
+
+    @staticmethod
+    def _to_arrow_array(values: Sequence[Any]):
+        """由一批取值推断 Arrow 数组，同一批内类型混杂时按字符串处理"""
+        try:
+            return pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.array([None if v is None else str(v) for v in values], type=pa.large_string())
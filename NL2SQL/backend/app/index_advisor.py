@@ -0,0 +1,330 @@
+"""
+索引顾问
+记录 Agent 执行的 SQL 中 WHERE / JOIN ON / GROUP BY / ORDER BY 引用的列，
+按使用频率和列基数推荐索引，在后台线程中建立索引并 ANALYZE，
+用触发推荐的 SQL 测量建索引前后的耗时，没有收益的索引会被删除
+"""
+
+import logging
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.catalog import metadata_catalog
+
+logger = logging.getLogger(__name__)
+
+# 不同子句中出现一次的权重：过滤和连接条件最能从索引中获益
+CLAUSE_WEIGHTS = {"where": 1.0, "join": 1.0, "order_by": 0.7, "group_by": 0.5}
+
+_CLAUSE_END = r"(?=\bWHERE\b|\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bUNION\b|" \
+              r"\b(?:LEFT|RIGHT|INNER|OUTER|CROSS|FULL)?\s*JOIN\b|;|$)"
+CLAUSE_PATTERNS = {
+    "where": re.compile(r"\bWHERE\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL),
+    "join": re.compile(r"\bON\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL),
+    "group_by": re.compile(r"\bGROUP\s+BY\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL),
+    "order_by": re.compile(r"\bORDER\s+BY\b(.*?)" + _CLAUSE_END, re.IGNORECASE | re.DOTALL),
+}
+TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+IDENTIFIER_PATTERN = re.compile(r"(?:(\w+)\s*\.\s*)?(\w+)")
+RESERVED_ALIASES = {
+    "where", "join", "on", "group", "order", "limit", "left", "right", "inner", "outer",
+    "cross", "full", "union", "having", "as", "using", "natural",
+}
+
+
+def _normalize_sql(sql: str) -> str:
+    """去掉注释、字符串字面量和标识符引号，便于用正则提取列名"""
+    sql = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    return re.sub(r"[\"`\[\]]", "", sql)
+
+
+def extract_column_usage(sql: str, table_columns: Dict[str, List[str]]) -> List[Tuple[str, str, str]]:
+    """
+    提取 SQL 中各子句引用的表列
+
+    Args:
+        sql: SQL 语句
+        table_columns: 数据源中的 {表名: [列名...]}
+
+    Returns:
+        去重后的 [(表名, 列名, 子句类型)] 列表，子句类型为 where/join/group_by/order_by
+    """
+    sql = _normalize_sql(sql)
+    lower_tables = {name.lower(): name for name in table_columns}
+
+    aliases: Dict[str, str] = {}
+    referenced: List[str] = []
+    for table, alias in TABLE_PATTERN.findall(sql):
+        table_name = lower_tables.get(table.lower())
+        if table_name is None:
+            continue
+        referenced.append(table_name)
+        aliases[table.lower()] = table_name
+        if alias and alias.lower() not in RESERVED_ALIASES:
+            aliases[alias.lower()] = table_name
+
+    if not referenced:
+        return []
+
+    lower_columns = {
+        table: {col.lower(): col for col in table_columns[table]} for table in set(referenced)
+    }
+
+    usage = []
+    seen = set()
+    for kind, pattern in CLAUSE_PATTERNS.items():
+        for clause in pattern.findall(sql):
+            for qualifier, name in IDENTIFIER_PATTERN.findall(clause):
+                if qualifier:
+                    candidates = [aliases.get(qualifier.lower())]
+                else:
+                    candidates = referenced
+                for table in candidates:
+                    column = lower_columns.get(table, {}).get(name.lower()) if table else None
+                    if column and (table, column, kind) not in seen:
+                        seen.add((table, column, kind))
+                        usage.append((table, column, kind))
+                        break
+    return usage
+
+
+class _ColumnStats:
+    """单列的使用统计与索引状态"""
+
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self.uses: Dict[str, int] = {}
+        self.sample_sql: Optional[str] = None
+        self.status: Optional[str] = None  # evaluating/recommended/building/applied/rejected/skipped/failed
+        self.reason = ""
+        self.rows: Optional[int] = None
+        self.distinct: Optional[int] = None
+        self.before_ms: Optional[float] = None
+        self.after_ms: Optional[float] = None
+        self.built_at: Optional[float] = None
+
+    @property
+    def score(self) -> float:
+        return sum(CLAUSE_WEIGHTS[kind] * count for kind, count in self.uses.items())
+
+    @property
+    def index_name(self) -> str:
+        return f"idx_auto_{self.table}_{self.column}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        speedup = None
+        if self.before_ms and self.after_ms:
+            speedup = round(self.before_ms / self.after_ms, 2)
+        return {
+            "table": self.table,
+            "column": self.column,
+            "index": self.index_name,
+            "status": self.status,
+            "reason": self.reason,
+            "uses": dict(self.uses),
+            "score": round(self.score, 2),
+            "rows": self.rows,
+            "distinct": self.distinct,
+            "before_ms": self.before_ms,
+            "after_ms": self.after_ms,
+            "speedup": speedup,
+            "built_at": self.built_at,
+        }
+
+
+class _Source:
+    """一个可建索引的数据源（上传文件生成的 SQLite 库）"""
+
+    def __init__(self, write_url: str, query_engine: Engine):
+        self.write_url = write_url
+        self.query_engine = query_engine
+        self.columns: Dict[Tuple[str, str], _ColumnStats] = {}
+
+
+class IndexAdvisor:
+    """按数据源记录列使用情况，自动推荐并建立单列索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources: Dict[str, _Source] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-advisor")
+
+    def register_source(self, source_key: str, write_url: str, query_engine: Engine):
+        """
+        注册可建索引的数据源
+
+        Args:
+            source_key: 数据源标识（元数据目录的 source_key）
+            write_url: 可写连接URL，用于建立索引
+            query_engine: 查询引擎，用于读取基数和测量耗时
+        """
+        with self._lock:
+            self._sources[source_key] = _Source(write_url, query_engine)
+
+    def forget_source(self, source_key: str):
+        """数据源被删除时移除其统计"""
+        with self._lock:
+            self._sources.pop(source_key, None)
+
+    def record(self, source_key: str, sql_queries: Iterable[str]):
+        """
+        记录已执行的 SQL，列的使用分数达到阈值时在后台评估并建立索引
+
+        Args:
+            source_key: 数据源标识
+            sql_queries: SQL 语句列表
+        """
+        if not settings.index_advisor_enabled:
+            return
+        source = self._sources.get(source_key)
+        if source is None:
+            return
+
+        try:
+            snapshot = metadata_catalog.get_snapshot(source.query_engine)
+        except Exception as e:
+            logger.warning(f"Index advisor could not load schema: {e}")
+            return
+        table_columns = {
+            name: [col["name"] for col in table["columns"]] for name, table in snapshot.tables.items()
+        }
+
+        to_evaluate = []
+        with self._lock:
+            for sql in sql_queries:
+                for table, column, kind in extract_column_usage(sql, table_columns):
+                    stats = source.columns.get((table, column))
+                    if stats is None:
+                        stats = source.columns[(table, column)] = _ColumnStats(table, column)
+                    stats.uses[kind] = stats.uses.get(kind, 0) + 1
+                    stats.sample_sql = sql
+                    if stats.status is None and stats.score >= settings.index_advisor_min_score:
+                        stats.status = "evaluating"
+                        to_evaluate.append(stats)
+
+        for stats in to_evaluate:
+            self._executor.submit(self._evaluate, source, stats)
+
+    def _evaluate(self, source: _Source, stats: _ColumnStats):
+        """读取表行数和列基数，决定是否推荐，并在开启自动建立时立即建立"""
+        try:
+            quote = source.query_engine.dialect.identifier_preparer.quote
+            with source.query_engine.connect() as conn:
+                rows, distinct = conn.execute(text(
+                    f"SELECT COUNT(*), COUNT(DISTINCT {quote(stats.column)}) FROM {quote(stats.table)}"
+                )).one()
+            stats.rows, stats.distinct = int(rows), int(distinct)
+        except Exception as e:
+            stats.status, stats.reason = "failed", f"读取基数失败: {e}"
+            return
+
+        filter_uses = stats.uses.get("where", 0) + stats.uses.get("join", 0)
+        ratio = stats.distinct / stats.rows if stats.rows else 0.0
+        if stats.rows < settings.index_advisor_min_rows:
+            stats.status, stats.reason = "skipped", f"表只有 {stats.rows} 行，全表扫描已足够快"
+            return
+        if stats.distinct < 2:
+            stats.status, stats.reason = "skipped", "列只有一个取值"
+            return
+        if filter_uses and not stats.uses.get("order_by") and ratio < settings.index_advisor_min_distinct_ratio:
+            stats.status = "skipped"
+            stats.reason = f"过滤选择性低（{stats.distinct} 个取值 / {stats.rows} 行）"
+            return
+
+        applied = sum(1 for s in source.columns.values()
+                      if s.table == stats.table and s.status in ("building", "applied"))
+        clauses = "、".join(f"{kind.upper().replace('_', ' ')}×{count}" for kind, count in stats.uses.items())
+        stats.reason = f"{clauses}；{stats.distinct} 个取值 / {stats.rows} 行"
+        stats.status = "recommended"
+
+        if settings.index_advisor_auto_build and applied < settings.index_advisor_max_indexes_per_table:
+            self._build(source, stats)
+
+    def _build(self, source: _Source, stats: _ColumnStats):
+        """建立索引并 ANALYZE，测量前后耗时，收益不足时删除索引"""
+        stats.status = "building"
+        write_engine = create_engine(source.write_url)
+        quote = write_engine.dialect.identifier_preparer.quote
+        try:
+            stats.before_ms = self._time_query(source.query_engine, stats.sample_sql)
+
+            with write_engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS {quote(stats.index_name)} "
+                    f"ON {quote(stats.table)} ({quote(stats.column)})"
+                )
+                conn.exec_driver_sql(f"ANALYZE {quote(stats.table)}")
+
+            stats.after_ms = self._time_query(source.query_engine, stats.sample_sql)
+            stats.built_at = time.time()
+
+            if stats.before_ms is not None and stats.after_ms is not None and \
+                    stats.before_ms < stats.after_ms * settings.index_advisor_min_speedup:
+                with write_engine.begin() as conn:
+                    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {quote(stats.index_name)}")
+                stats.status = "rejected"
+                stats.reason += f"；实测加速不足 {settings.index_advisor_min_speedup}x，已删除"
+            else:
+                stats.status = "applied"
+            logger.info(f"Index {stats.index_name} {stats.status}: "
+                        f"{stats.before_ms} ms -> {stats.after_ms} ms")
+        except Exception as e:
+            stats.status, stats.reason = "failed", f"建立索引失败: {e}"
+            logger.warning(f"Failed to build index {stats.index_name}: {e}")
+        finally:
+            write_engine.dispose()
+
+    @staticmethod
+    def _time_query(engine: Engine, sql: Optional[str], repeat: int = 3) -> Optional[float]:
+        """执行 SQL 若干次，返回中位耗时（毫秒）"""
+        if not sql:
+            return None
+        timings = []
+        with engine.connect() as conn:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(text(sql)).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+        return round(statistics.median(timings), 3)
+
+    def report(self, source_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        各数据源的索引推荐与建立情况
+
+        Args:
+            source_key: 只返回指定数据源，不传则返回全部
+
+        Returns:
+            [{"source", "recommended", "applied", "rejected", "skipped", "usage"}]
+        """
+        with self._lock:
+            sources = {key: list(source.columns.values()) for key, source in self._sources.items()
+                       if source_key is None or key == source_key}
+
+        report = []
+        for key, columns in sources.items():
+            entries = [stats.to_dict() for stats in sorted(columns, key=lambda s: -s.score)]
+            report.append({
+                "source": key,
+                "recommended": [e for e in entries if e["status"] in ("recommended", "evaluating", "building")],
+                "applied": [e for e in entries if e["status"] == "applied"],
+                "rejected": [e for e in entries if e["status"] in ("rejected", "failed")],
+                "skipped": [e for e in entries if e["status"] == "skipped"],
+                "usage": [e for e in entries if e["status"] is None],
+            })
+        return report
+
+
+# 创建全局索引顾问实例
+index_advisor = IndexAdvisor()
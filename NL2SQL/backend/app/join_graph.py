@@ -0,0 +1,250 @@
+"""
+表关联图
+根据声明的外键和列名/类型推断（customer_id 对应 customers 的主键，customer_name 对应 customers.name），
+为每个数据源建立表之间的关联图并按结构版本缓存；提示词中直接给出相关表之间的最短关联路径，
+多表问题不必逐个查看表结构来判断 JOIN 条件
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+
+from app.catalog import SchemaSnapshot, metadata_catalog
+from app.rollups import ROLLUP_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 最短路径最多经过的关联数
+MAX_PATH_HOPS = 3
+
+NUMERIC_TYPE_HINTS = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+TEXT_TYPE_HINTS = ("CHAR", "TEXT", "CLOB", "STRING")
+SOURCE_LABELS = {"fk": "外键", "key": "同名主键", "id": "按列名推断", "name": "按名称推断"}
+
+
+def _type_family(type_name: str) -> str:
+    upper = type_name.upper()
+    if any(hint in upper for hint in NUMERIC_TYPE_HINTS):
+        return "numeric"
+    if any(hint in upper for hint in TEXT_TYPE_HINTS):
+        return "text"
+    return "other" if upper != "NULL" else "any"
+
+
+def _compatible(left: Dict[str, Any], right: Dict[str, Any]) -> bool:
+    families = {_type_family(left["type"]), _type_family(right["type"])}
+    return len(families) == 1 or "any" in families
+
+
+def _matches_entity(table_name: str, entity: str) -> bool:
+    """表名是否表示该实体：customers、erp_customers、customer 都对应 customer"""
+    lower = table_name.lower()
+    forms = {entity, f"{entity}s", f"{entity}es"}
+    if entity.endswith("y"):
+        forms.add(f"{entity[:-1]}ies")
+    return any(lower == form or lower.endswith(f"_{form}") for form in forms)
+
+
+class JoinGraph:
+    """无向关联图：每条边记录两端的表和列以及关联来源"""
+
+    def __init__(self, edges: List[Dict[str, Any]], version: Any = None):
+        self.version = version
+        self.edges = edges
+        self._adjacent: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for edge in edges:
+            self._adjacent.setdefault(edge["left_table"], []).append((edge["right_table"], edge))
+            self._adjacent.setdefault(edge["right_table"], []).append((edge["left_table"], edge))
+
+    def neighbors(self, table: str) -> List[str]:
+        return [other for other, _ in self._adjacent.get(table, [])]
+
+    def referenced(self, table: str) -> List[str]:
+        """该表的列所引用的表（外键或推断关联的被引用一侧）"""
+        return [edge["right_table"] for _, edge in self._adjacent.get(table, []) if edge["left_table"] == table]
+
+    def shortest_path(self, start: str, end: str, max_hops: int = MAX_PATH_HOPS) -> Optional[List[Dict[str, Any]]]:
+        """
+        两张表之间经过关联最少的路径（广度优先）
+
+        Returns:
+            路径上的边列表；不连通或超过 max_hops 时返回 None
+        """
+        if start == end:
+            return []
+        previous: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        visited = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            table, hops = queue.popleft()
+            if hops >= max_hops:
+                continue
+            for other, edge in self._adjacent.get(table, []):
+                if other in visited:
+                    continue
+                visited.add(other)
+                previous[other] = (table, edge)
+                if other == end:
+                    path = []
+                    while other != start:
+                        other, edge = previous[other]
+                        path.append(edge)
+                    return path[::-1]
+                queue.append((other, hops + 1))
+        return None
+
+    def describe_paths(self, tables: List[str], max_lines: int = 20) -> str:
+        """
+        生成给定表之间的关联说明：直接关联的 JOIN 条件，以及需要经过中间表的最短路径
+
+        Args:
+            tables: 问题涉及（或提示词中列出）的表
+            max_lines: 最多输出的行数
+
+        Returns:
+            说明文本；表之间没有关联时返回空字符串
+        """
+        direct, multi_hop = [], []
+        seen_edges = set()
+        for i, start in enumerate(tables):
+            for end in tables[i + 1:]:
+                path = self.shortest_path(start, end)
+                if not path:
+                    continue
+                if len(path) == 1:
+                    if id(path[0]) not in seen_edges:
+                        seen_edges.add(id(path[0]))
+                        direct.append(self._describe_edge(path[0]))
+                    continue
+                route, current = [start], start
+                for edge in path:
+                    current = edge["right_table"] if edge["left_table"] == current else edge["left_table"]
+                    route.append(current)
+                conditions = " AND ".join(self._condition(edge) for edge in path)
+                multi_hop.append(f"- {' → '.join(route)}：{conditions}")
+        return "\n".join((direct + multi_hop)[:max_lines])
+
+    @staticmethod
+    def _condition(edge: Dict[str, Any]) -> str:
+        return " AND ".join(
+            f"{edge['left_table']}.{left} = {edge['right_table']}.{right}"
+            for left, right in zip(edge["left_columns"], edge["right_columns"])
+        )
+
+    def _describe_edge(self, edge: Dict[str, Any]) -> str:
+        return f"- {self._condition(edge)}（{SOURCE_LABELS[edge['source']]}）"
+
+
+def build_join_graph(tables: Dict[str, Dict[str, Any]], version: Any = None) -> JoinGraph:
+    """
+    从表结构推导关联图：声明的外键，加上以下推断（两端类型需兼容，汇总表不参与）
+
+    - 列名与另一张表的单列主键同名（如 erp_orders.product_id 与 erp_products.product_id）
+    - X_id 列对应表名为 X 的表的 id 列或同名列（如 orders.customer_id 与 customers.id，
+      erp_orders.product_id 与没有声明主键的 erp_products.product_id）
+    - X_name 列对应表名为 X 的表的 name 列（如 erp_orders.customer_name 与 erp_customers.name）
+
+    Args:
+        tables: {表名: 元数据目录中的表信息}
+        version: 结构版本
+
+    Returns:
+        关联图
+    """
+    names = [name for name in tables if not name.startswith(ROLLUP_PREFIX)]
+    edges: List[Dict[str, Any]] = []
+    linked = set()
+
+    def add(left: str, left_columns: List[str], right: str, right_columns: List[str], source: str):
+        key = (left, tuple(left_columns), right, tuple(right_columns))
+        if left == right or key in linked:
+            return
+        linked.add(key)
+        edges.append({"left_table": left, "left_columns": list(left_columns),
+                      "right_table": right, "right_columns": list(right_columns), "source": source})
+
+    for name in names:
+        for fk in tables[name]["foreign_keys"]:
+            if fk["referred_table"] in tables and fk["referred_columns"]:
+                add(name, fk["columns"], fk["referred_table"], fk["referred_columns"], "fk")
+
+    # 单列主键：{列名(小写): [(表名, 列信息)]}
+    single_keys: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for name in names:
+        pk = tables[name]["primary_key"]
+        if len(pk) == 1:
+            col = next((c for c in tables[name]["columns"] if c["name"] == pk[0]), None)
+            if col:
+                single_keys.setdefault(col["name"].lower(), []).append((name, col))
+
+    for name in names:
+        table = tables[name]
+        own_key = table["primary_key"][0] if len(table["primary_key"]) == 1 else None
+        declared = {c for fk in table["foreign_keys"] for c in fk["columns"]}
+        for col in table["columns"]:
+            column = col["name"]
+            lower = column.lower()
+            if column == own_key or column in declared:
+                continue
+
+            if lower != "id":
+                for other, key_col in single_keys.get(lower, []):
+                    if other != name and _compatible(col, key_col):
+                        add(name, [column], other, [key_col["name"]], "key")
+
+            # 上传文件生成的表没有声明主键，X_id 也可以对应表 X 中的同名列
+            for suffix, targets, source in (("_id", ("id", lower), "id"), ("_name", ("name",), "name")):
+                if not lower.endswith(suffix) or len(lower) <= len(suffix):
+                    continue
+                entity = lower[:-len(suffix)]
+                for other in names:
+                    if other == name or not _matches_entity(other, entity):
+                        continue
+                    target = next((c for target_column in targets for c in tables[other]["columns"]
+                                   if c["name"].lower() == target_column), None)
+                    if target and _compatible(col, target):
+                        add(name, [column], other, [target["name"]], source)
+
+    return JoinGraph(edges, version)
+
+
+class JoinGraphCache:
+    """按数据源缓存关联图，结构版本变化后重建"""
+
+    def __init__(self):
+        # {数据源标识: 关联图}
+        self._graphs: Dict[str, JoinGraph] = {}
+        self._lock = threading.Lock()
+
+    def on_schema_change(self, key: str, snapshot: SchemaSnapshot):
+        """元数据目录回调：丢弃旧版本的关联图，下次使用时重建"""
+        graph = self._graphs.get(key)
+        if graph is not None and graph.version != snapshot.version:
+            self._graphs.pop(key, None)
+
+    def get_graph(self, engine: Engine) -> JoinGraph:
+        """获取数据源的关联图"""
+        snapshot = metadata_catalog.get_snapshot(engine)
+        key = metadata_catalog.source_key(engine)
+        graph = self._graphs.get(key)
+        if graph is not None and graph.version == snapshot.version:
+            return graph
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is None or graph.version != snapshot.version:
+                graph = build_join_graph(snapshot.tables, snapshot.version)
+                self._graphs[key] = graph
+                logger.info(f"Built join graph for {key}: {len(graph.edges)} edges (version {snapshot.version})")
+            return graph
+
+    def forget(self, engine: Engine):
+        """删除数据源的关联图"""
+        self._graphs.pop(metadata_catalog.source_key(engine), None)
+
+
+# 创建全局关联图缓存实例
+join_graphs = JoinGraphCache()
+metadata_catalog.add_listener(join_graphs.on_schema_change)
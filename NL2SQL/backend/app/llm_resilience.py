@@ -0,0 +1,324 @@
+"""
+LLM 调用的尾延迟与故障处理
+一个问题要串行调用模型 4 次以上，模型服务偶发的数秒停顿会被放大到整体延迟上。这里在 Agent 的每次模型调用外层：
+- 对冲：超过阈值仍未返回时再发一个相同的请求，取先返回的结果
+- 重试：超时、连接错误、限流和服务端错误按指数退避加随机抖动重试
+- 熔断：连续失败达到阈值后一段时间内直接拒绝调用，由 SQLAgentManager 回退到缓存的回答或按指标目录生成的结果
+"""
+
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import openai
+from langchain.agents.middleware import AgentMiddleware
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 可以重试的错误：超时（APITimeoutError 是 APIConnectionError 的子类）、连接错误、限流、服务端错误
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+                    TimeoutError, ConnectionError)
+TIMEOUT_ERRORS = (openai.APITimeoutError, TimeoutError)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# 剩余时间低于退避等待加该值时不再重试（再发一次请求也来不及返回）
+MIN_ATTEMPT_SECONDS = 1.0
+
+
+class ProviderUnavailableError(RuntimeError):
+    """模型服务不可用（熔断中或重试后仍然失败）"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(ProviderUnavailableError):
+    """当前问题的时间预算不足以再次调用（或重试）模型"""
+
+
+class CircuitBreaker:
+    """单个模型的熔断器：连续失败达到阈值后打开，冷却时间过后放行一个试探请求"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.opened_count = 0
+
+    def acquire(self) -> Optional[str]:
+        """申请一次调用：拒绝时返回 None，正常放行返回 CLOSED，作为试探请求放行返回 HALF_OPEN
+
+        拿到试探请求的调用方必须在结束时调用 record_success / record_failure / release_trial 之一，
+        否则熔断器会一直停在 HALF_OPEN 且不再放行任何请求
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return CLOSED
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return HALF_OPEN
+            return None
+
+    def allow(self) -> bool:
+        """是否放行本次调用"""
+        return self.acquire() is not None
+
+    def release_trial(self):
+        """试探请求结束但结果不说明服务是否健康（请求本身的错误、时间预算不足等）：
+        保持 HALF_OPEN，允许下一个请求继续试探"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        """距离允许试探请求的剩余秒数"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened_count += 1
+                    logger.warning(f"Circuit breaker for {self.name} opened after {self._failures} failures")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures, "opened": self.opened_count}
+
+
+class ResilienceStats:
+    """模型调用的对冲、重试、熔断和回退统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = {
+                "calls": 0, "failures": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                "rejected": 0, "fallback_cached": 0, "fallback_rule": 0, "fallback_none": 0,
+            }
+            self._total_ms = 0.0
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        """获取模型对应的熔断器"""
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, settings.llm_breaker_failure_threshold,
+                                         settings.llm_breaker_reset_seconds)
+                self._breakers[name] = breaker
+            return breaker
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self._counts[key] += amount
+
+    def record_call(self, elapsed_ms: float, success: bool):
+        with self._lock:
+            self._counts["calls"] += 1
+            self._counts["failures"] += 0 if success else 1
+            self._total_ms += elapsed_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            calls = counts["calls"]
+            avg_ms = round(self._total_ms / calls, 1) if calls else None
+            breakers = {name: breaker.snapshot() for name, breaker in self._breakers.items()}
+        return {
+            **counts,
+            "avg_call_ms": avg_ms,
+            "hedge_rate": round(counts["hedges"] / calls, 4) if calls else None,
+            "hedge_win_rate": round(counts["hedge_wins"] / counts["hedges"], 4) if counts["hedges"] else None,
+            "breakers": breakers,
+        }
+
+
+resilience_stats = ResilienceStats()
+
+# 对冲请求使用的线程池（主请求也在其中执行，以便超过阈值时发出第二个请求）
+_hedge_executor = ThreadPoolExecutor(max_workers=settings.llm_hedge_workers, thread_name_prefix="llm-hedge")
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间：指数退避 + 全抖动（0 到上限之间均匀随机）"""
+    cap = min(settings.llm_retry_max_delay, settings.llm_retry_base_delay * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+class ResilientModelMiddleware(AgentMiddleware):
+    """为 Agent 的每次模型调用加上对冲、带抖动的重试和熔断（应放在中间件列表最后，最靠近模型调用）"""
+
+    def __init__(self, model_name: str, get_remaining: Optional[Callable[[], Optional[float]]] = None):
+        """
+        Args:
+            model_name: 模型名称，同一模型共用一个熔断器
+            get_remaining: 返回当前问题剩余的时间预算（秒），None 表示不限制；单次请求的超时、
+                对冲请求和重试前的等待都不会超过剩余时间，时间不够再试一次时抛出 DeadlineExceededError
+        """
+        super().__init__()
+        self.model_name = model_name
+        self._get_remaining = get_remaining or (lambda: None)
+
+    def wrap_model_call(self, request, handler):
+        breaker = resilience_stats.breaker(self.model_name)
+        permit = breaker.acquire()
+        if permit is None:
+            resilience_stats.incr("rejected")
+            raise ProviderUnavailableError(f"模型 {self.model_name} 暂时不可用（熔断中）", breaker.retry_after())
+
+        recorded = False
+        try:
+            remaining = self._get_remaining()
+            deadline = None if remaining is None else time.perf_counter() + remaining
+            attempt = 0
+            while True:
+                start = time.perf_counter()
+                timeout = settings.llm_request_timeout
+                if deadline is not None:
+                    timeout = min(timeout, deadline - start)
+                try:
+                    response = self._hedged_call(request, handler, deadline)
+                except Exception as e:
+                    resilience_stats.record_call((time.perf_counter() - start) * 1000, False)
+                    # 请求本身的错误（参数、鉴权等）不说明服务不健康，不计入熔断
+                    if not isinstance(e, RETRYABLE_ERRORS):
+                        raise
+                    # 因时间预算缩短了超时而超时的请求同样不计入熔断
+                    if not (isinstance(e, TIMEOUT_ERRORS) and timeout < settings.llm_request_timeout):
+                        breaker.record_failure()
+                        recorded = True
+                    delay = backoff_delay(attempt)
+                    if deadline is not None and deadline - time.perf_counter() <= delay + MIN_ATTEMPT_SECONDS:
+                        raise DeadlineExceededError(
+                            f"模型 {self.model_name} 调用失败且剩余时间不足以重试（已重试 {attempt} 次）: {e}") from e
+                    if attempt >= settings.llm_max_retries:
+                        raise ProviderUnavailableError(
+                            f"模型 {self.model_name} 调用失败（重试 {attempt} 次）: {e}", breaker.retry_after()) from e
+                    # 计入熔断的失败之后要重新经过熔断器才能重试；未计入的失败继续使用本次的放行
+                    if recorded:
+                        permit = breaker.acquire()
+                        if permit is None:
+                            raise ProviderUnavailableError(
+                                f"模型 {self.model_name} 调用失败（重试 {attempt} 次）: {e}",
+                                breaker.retry_after()) from e
+                        recorded = False
+                    attempt += 1
+                    resilience_stats.incr("retries")
+                    logger.warning(f"LLM call to {self.model_name} failed ({type(e).__name__}: {e}), "
+                                   f"retry {attempt} in {delay:.2f}s")
+                    time.sleep(delay)
+                    continue
+                resilience_stats.record_call((time.perf_counter() - start) * 1000, True)
+                breaker.record_success()
+                recorded = True
+                return response
+        finally:
+            # 未记录成功或失败就结束（不计入熔断的错误、时间预算不足、中断等）时归还试探机会
+            if not recorded and permit == HALF_OPEN:
+                breaker.release_trial()
+
+    @staticmethod
+    def _with_timeout(request, deadline: Optional[float]):
+        """单次请求的超时不超过剩余时间（通过 model_settings 传给模型客户端）"""
+        if deadline is None:
+            return request
+        timeout = min(settings.llm_request_timeout, max(deadline - time.perf_counter(), 0.001))
+        if timeout >= settings.llm_request_timeout:
+            return request
+        return request.override(model_settings={**request.model_settings, "timeout": timeout})
+
+    def _hedged_call(self, request, handler, deadline: Optional[float] = None):
+        """超过对冲阈值仍未返回时再发一个相同的请求，返回先成功的结果；两个都失败时抛出后失败的异常"""
+        delay = settings.llm_hedge_after_seconds
+        if delay <= 0 or (deadline is not None and deadline - time.perf_counter() <= delay):
+            return handler(self._with_timeout(request, deadline))
+
+        # 每个请求在各自的上下文副本中执行，保留 LangChain 回调等上下文变量
+        primary = _hedge_executor.submit(contextvars.copy_context().run, handler,
+                                         self._with_timeout(request, deadline))
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = _hedge_executor.submit(contextvars.copy_context().run, handler,
+                                       self._with_timeout(request, deadline))
+        resilience_stats.incr("hedges")
+        logger.info(f"LLM call to {self.model_name} exceeded {delay}s, sent hedged request")
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        resilience_stats.incr("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+class AnswerCache:
+    """最近成功回答的问题（按数据源和问题文本），模型服务不可用时回退使用"""
+
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(source: str, question: str) -> tuple:
+        return source, " ".join(question.split()).lower()
+
+    def put(self, source: str, question: str, entry: Dict[str, Any]):
+        key = self._key(source, question)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, source: str, question: str) -> Optional[Dict[str, Any]]:
+        key = self._key(source, question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+
+# 创建全局回答缓存实例
+answer_cache = AnswerCache(settings.llm_fallback_cache_size)
@@ -1,23 +1,45 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from contextlib import asynccontextmanager
+import asyncio
+import math
 import logging
 import os
 import uuid
 import json
+import time
 from typing import Dict, Any, Optional
 
 from app.config import settings, get_database_url
 from app.models import (
     FileUploadResponse, QueryRequest, QueryResponse,
     VisualizationRequest, VisualizationResponse,
-    ChatRequest, ChatResponse, ChatMessage
+    ChatRequest, ChatResponse, ChatMessage, ExportFormat, ResponseFormat,
+    MetricQueryRequest
 )
 from app.sql_agent import SQLAgentManager
 from app.visualization import DataVisualizer
 from utils.file_processor import FileProcessor
-from app.database import DatabaseManager
+from app.async_database import AsyncDatabaseManager
+from app.engine_registry import engine_registry
+from app.catalog import metadata_catalog
+from app.rollups import ROLLUP_PREFIX
+from app.value_index import INDEX_BUILDING, INDEX_UNAVAILABLE, value_index
+from app.column_pruning import pruning_stats
+from app.table_retrieval import table_retriever
+from app.metrics import DEFAULT_DATASET, MetricQueryError, metric_catalogs
+from app.tool_compaction import compaction_stats
+from app.model_router import model_router
+from app.llm_resilience import resilience_stats
+from app.admission import admission_controller
+from app.agent_budget import budget_stats
+from app.index_advisor import index_advisor
+from app.materialization import materialization_manager
+from app.export import ResultExporter
+from app.serialization import FastJSONResponse, build_columnar_payload
+from app.result_set import ResultSet
+from app.compression import CompressionMiddleware, compression_stats
 
 # 配置日志
 logging.basicConfig(
@@ -43,6 +65,7 @@ except Exception as e:
 file_store: Dict[str, Dict] = {}
 chat_sessions: Dict[str, Dict] = {}
 sql_agents: Dict[str, SQLAgentManager] = {}
+query_results: Dict[str, Dict] = {}
 
 
 @asynccontextmanager
@@ -51,11 +74,15 @@ async def lifespan(app: FastAPI):
     # 创建必要的目录
     os.makedirs("data/uploads", exist_ok=True)
     os.makedirs("data/visualizations", exist_ok=True)
+    # 预热数据库连接池，避免首个请求承担建连开销
+    await asyncio.to_thread(engine_registry.warm, get_database_url())
     logger.info("Application startup complete")
     yield
     # 清理资源
     for agent in sql_agents.values():
         agent.cleanup()
+    await engine_registry.dispose_async_engines()
+    engine_registry.dispose_all()
     logger.info("Application shutdown complete")
 
 
@@ -76,6 +103,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 配置响应压缩（大结果集和图表HTML）
+if settings.compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        offload_size=settings.compression_offload_size,
+        gzip_level=settings.compression_gzip_level,
+        zstd_level=settings.compression_zstd_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+
 
 # 路由定义
 @app.get("/", response_class=HTMLResponse)
@@ -136,22 +174,24 @@ async def get_data_sources():
 
     # 获取外部数据库表
     try:
-        db_manager_instance = DatabaseManager()
-        if db_manager_instance.connect():
-            tables = db_manager_instance.get_tables()
-            logger.info(f"✅ 从外部数据库获取到 {len(tables)} 个表")
-
-            for table_name in tables:
-                info = db_manager_instance.get_table_info(table_name)
-                if info:
-                    sources.append({
-                        "name": table_name,
-                        "table": table_name,
-                        "rows": info.get("row_count", 0),
-                        "columns": [col["name"] for col in info.get("columns", [])],
-                        "description": f"数据库表 ({db_manager_instance.db_type})",
-                        "source": "database"  # 标记为真实数据库来源
-                    })
+        db_manager_instance = AsyncDatabaseManager()
+        if await db_manager_instance.connect():
+            # 表结构反射和行数估算在截止时间内完成，超时的表标记为 pending，不阻塞整个列表
+            infos = await db_manager_instance.collect_table_infos()
+            logger.info(f"✅ 从外部数据库获取到 {len(infos)} 个表")
+            for info in infos:
+                source = {
+                    "name": info["name"],
+                    "table": info["name"],
+                    "rows": info.get("row_count", 0),
+                    "rows_exact": info.get("row_count_exact", False),
+                    "columns": [col["name"] for col in info.get("columns", [])],
+                    "description": f"数据库表 ({db_manager_instance.db_type})",
+                    "source": "database"  # 标记为真实数据库来源
+                }
+                if info.get("pending"):
+                    source["pending"] = True
+                sources.append(source)
 
             db_manager_instance.close()
         else:
@@ -244,159 +284,113 @@ async def upload_file(file: UploadFile = File(...)):
 
 
 @app.post("/query", response_model=QueryResponse)
-async def query_data(request: QueryRequest):
+async def query_data(request: QueryRequest, http_request: Request):
     """
     使用自然语言查询数据（支持文件上传和数据库表）
     """
     try:
-        agent_key = None
-        
-        # 优先使用 file_id（CSV上传文件）
+        # 优先使用 file_id（CSV上传文件），其次使用 table_name（从数据库）
         if request.file_id and request.file_id in file_store:
             agent_key = f"file_{request.file_id}"
             file_info = file_store[request.file_id]
-            
+
             logger.info(f"[CSV查询] 处理上传文件: {file_info.get('filename', 'unknown')}")
             logger.info(f"[CSV查询] 用户问题: {request.query}")
-
-            # 获取或创建SQL Agent
-            if agent_key not in sql_agents:
-                logger.info(f"[CSV查询] 创建新的SQL Agent for {agent_key}")
-                agent = SQLAgentManager(
-                    openai_api_key=settings.openai_api_key,
-                    openai_base_url=settings.openai_base_url,
-                    model=settings.default_model
-                )
-
-                # 创建数据库（使用更有意义的表名）
-                table_name = f"file_{request.file_id}"
-                db_result = agent.create_database_from_file(
-                    file_info["content"],
-                    file_info["file_type"],
-                    table_name=table_name
-                )
-
-                if not db_result["success"]:
-                    raise HTTPException(status_code=500, detail=db_result["error"])
-
-                # 创建SQL Agent
-                agent_result = agent.create_sql_agent()
-
-                if not agent_result["success"]:
-                    raise HTTPException(status_code=500, detail=agent_result["error"])
-
-                sql_agents[agent_key] = agent
-            else:
-                logger.info(f"[CSV查询] 重用已有的SQL Agent for {agent_key}")
-
-        # 使用 table_name（从数据库）
         elif request.table_name:
             agent_key = f"table_{request.table_name}"
-
-            # 获取或创建SQL Agent
-            if agent_key not in sql_agents:
-                agent = SQLAgentManager(
-                    openai_api_key=settings.openai_api_key,
-                    openai_base_url=settings.openai_base_url,
-                    model=settings.default_model
-                )
-
-                # 优先使用外部数据库配置
-                db_url = get_database_url()
-                logger.info(f"Connecting to database: {db_url.split('@')[-1] if '@' in db_url else db_url}")
-
-                # 如果是 SQLite，检查文件是否存在
-                if db_url.startswith("sqlite"):
-                    db_path = db_url.replace("sqlite:///", "")
-                    if not os.path.exists(db_path):
-                        # 尝试使用 data_manager
-                        if DATA_MANAGER_AVAILABLE and data_manager:
-                            logger.info(f"Using data_manager for table: {request.table_name}")
-                            db_path = data_manager.db_path if hasattr(data_manager, 'db_path') else None
-                            if db_path and os.path.exists(db_path):
-                                db_url = f"sqlite:///{db_path}"
-                            else:
-                                raise HTTPException(status_code=404, detail="Database file not found. Please initialize the database first.")
-                        else:
-                            raise HTTPException(status_code=404, detail="Database file not found")
-
-                # 连接到数据库
-                from langchain_community.utilities import SQLDatabase
-                try:
-                    agent.db = SQLDatabase.from_uri(db_url)
-                    logger.info(f"✅ Successfully connected to database")
-                except Exception as e:
-                    logger.error(f"❌ Failed to connect to database: {str(e)}")
-                    raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
-
-                # 创建SQL Agent
-                agent_result = agent.create_sql_agent()
-                if not agent_result["success"]:
-                    raise HTTPException(status_code=500, detail=agent_result["error"])
-
-                sql_agents[agent_key] = agent
-                logger.info(f"Created SQL Agent for table: {request.table_name}")
-        
         else:
             raise HTTPException(status_code=400, detail="Either file_id or table_name must be provided")
 
-        agent = sql_agents[agent_key]
-
-        # 执行查询
         is_csv_query = agent_key.startswith("file_")
-        if is_csv_query:
-            logger.info(f"[CSV查询] 开始执行查询...")
-        logger.info(f"Executing query: {request.query} on {agent_key}")
-        
-        result = agent.query_data(request.query)
+
+        # 准入控制：限制同时调用模型的问题数。首次使用数据集时创建 Agent（入库、建立汇总表和索引）
+        # 同样在执行位内、在线程中进行，以免阻塞事件循环，同一数据集的并发请求也不会重复创建
+        async with admission_controller.slot(_client_id(http_request), agent_key):
+            if agent_key not in sql_agents:
+                if is_csv_query:
+                    logger.info(f"[CSV查询] 创建新的SQL Agent for {agent_key}")
+                    sql_agents[agent_key] = await asyncio.to_thread(
+                        _create_file_agent, request.file_id, file_info, agent_key)
+                else:
+                    sql_agents[agent_key] = await asyncio.to_thread(_create_table_agent, request.table_name)
+                    logger.info(f"Created SQL Agent for table: {request.table_name}")
+            elif is_csv_query:
+                logger.info(f"[CSV查询] 重用已有的SQL Agent for {agent_key}")
+
+            agent = sql_agents[agent_key]
+
+            # 执行查询
+            if is_csv_query:
+                logger.info(f"[CSV查询] 开始执行查询...")
+            logger.info(f"Executing query: {request.query} on {agent_key}")
+            result = await asyncio.to_thread(agent.query_data, request.query)
 
         if not result["success"]:
-            raise HTTPException(status_code=500, detail=result["error"])
+            _raise_query_error(result)
 
-        # 获取查询结果
-        data = result.get("data", [])
-        columns = result.get("columns", [])
+        # 获取查询结果（列式结果集，仅在返回 records 格式时才转换为字典行）
+        result_set = result.get("result_set") or ResultSet.empty()
+        columns = result_set.columns
         sql = result.get("sql")
         answer = result.get("answer", "")
         reasoning = result.get("reasoning", [])
         
         if is_csv_query:
-            logger.info(f"[CSV查询] 查询完成: SQL={sql[:50] if sql else None}..., 数据行数={len(data)}, 答案长度={len(answer) if answer else 0}")
+            logger.info(f"[CSV查询] 查询完成: SQL={sql[:50] if sql else None}..., 数据行数={result_set.row_count}, 答案长度={len(answer) if answer else 0}")
         
-        logger.info(f"Query result: data rows={len(data)}, columns={len(columns)}, has_sql={bool(sql)}, has_answer={bool(answer)}")
+        logger.info(f"Query result: data rows={result_set.row_count}, columns={len(columns)}, has_sql={bool(sql)}, has_answer={bool(answer)}")
         if answer:
             logger.info(f"Answer preview: {answer[:200]}...")
         
         # 如果有 SQL 但没有数据，尝试执行 SQL 获取数据
-        if sql and not data:
+        if sql and not result_set.row_count:
             try:
                 logger.info(f"Executing SQL to get data: {sql[:100]}...")
-                sql_result = agent.execute_custom_sql(sql)
+                sql_result = await agent.execute_custom_sql_async(sql)
                 if sql_result["success"]:
-                    data = sql_result["data"]
-                    columns = sql_result["columns"]
-                    logger.info(f"SQL execution successful: {len(data)} rows retrieved")
+                    result_set = sql_result["result_set"]
+                    columns = result_set.columns
+                    logger.info(f"SQL execution successful: {result_set.row_count} rows retrieved")
             except Exception as e:
                 logger.warning(f"Could not execute SQL to get data: {e}")
                 import traceback
                 traceback.print_exc()
 
-        # 确保数据格式正确
-        if data and not columns:
-            columns = list(data[0].keys()) if data else []
-        
         # 不要在后端再次截断数据，使用 SQL 中的 LIMIT
-        final_data = data
+
+        # 记录查询结果，供 /results/{result_id}/export 流式导出
+        result_id = _store_query_result(agent_key, sql) if sql else None
+
+        if request.format == ResponseFormat.COLUMNAR:
+            # 列式格式：列名只出现一次，不做逐单元格的 pydantic 校验
+            return FastJSONResponse(build_columnar_payload(
+                columns,
+                result_set.column_values(),
+                success=True,
+                answer=answer,
+                sql=sql,
+                reasoning=reasoning,
+                result_id=result_id,
+                prompt_tokens=result.get("prompt_tokens"),
+                model_tier=result.get("model_tier"),
+                degraded=result.get("degraded"),
+                budget=result.get("budget")
+            ))
         
         return QueryResponse(
             success=True,
             answer=answer,
             sql=sql,
             reasoning=reasoning,
-            data=final_data,
-            returned_rows=len(final_data),
+            data=result_set.to_records(),
+            returned_rows=result_set.row_count,
             columns=columns,
-            total_rows=len(final_data)
+            total_rows=result_set.row_count,
+            result_id=result_id,
+            prompt_tokens=result.get("prompt_tokens"),
+            model_tier=result.get("model_tier"),
+            degraded=result.get("degraded"),
+            budget=result.get("budget")
         )
 
     except HTTPException:
@@ -408,6 +402,152 @@ async def query_data(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _client_id(http_request: Request) -> str:
+    """准入控制使用的客户端标识：X-Client-ID 请求头，没有时使用客户端地址"""
+    client_id = http_request.headers.get("x-client-id")
+    if client_id:
+        return client_id
+    return http_request.client.host if http_request.client else "unknown"
+
+
+def _create_file_agent(file_id: str, file_info: Dict[str, Any], table_name: str = "data_table") -> SQLAgentManager:
+    """
+    为上传文件创建 SQL Agent：入库、建立汇总表和索引后创建 Agent（耗时较长，应在线程中调用）
+
+    Raises:
+        HTTPException: 入库或创建 Agent 失败
+    """
+    agent = SQLAgentManager(
+        openai_api_key=settings.openai_api_key,
+        openai_base_url=settings.openai_base_url,
+        model=settings.default_model,
+        dataset_id=file_id
+    )
+
+    # 创建数据库（/query 使用更有意义的表名）
+    db_result = agent.create_database_from_file(file_info["content"], file_info["file_type"], table_name=table_name)
+    if not db_result["success"]:
+        raise HTTPException(status_code=500, detail=db_result["error"])
+
+    # 创建SQL Agent
+    agent_result = agent.create_sql_agent()
+    if not agent_result["success"]:
+        raise HTTPException(status_code=500, detail=agent_result["error"])
+    return agent
+
+
+def _create_table_agent(table_name: str) -> SQLAgentManager:
+    """
+    为数据库表创建 SQL Agent（连接数据库、反射表结构，应在线程中调用）
+
+    Raises:
+        HTTPException: 数据库文件不存在、连接失败或创建 Agent 失败
+    """
+    agent = SQLAgentManager(
+        openai_api_key=settings.openai_api_key,
+        openai_base_url=settings.openai_base_url,
+        model=settings.default_model
+    )
+
+    # 优先使用外部数据库配置
+    db_url = get_database_url()
+    logger.info(f"Connecting to database: {db_url.split('@')[-1] if '@' in db_url else db_url}")
+
+    # 如果是 SQLite，检查文件是否存在
+    if db_url.startswith("sqlite"):
+        db_path = db_url.replace("sqlite:///", "")
+        if not os.path.exists(db_path):
+            # 尝试使用 data_manager
+            if DATA_MANAGER_AVAILABLE and data_manager:
+                logger.info(f"Using data_manager for table: {table_name}")
+                db_path = data_manager.db_path if hasattr(data_manager, 'db_path') else None
+                if db_path and os.path.exists(db_path):
+                    db_url = f"sqlite:///{db_path}"
+                else:
+                    raise HTTPException(status_code=404, detail="Database file not found. Please initialize the database first.")
+            else:
+                raise HTTPException(status_code=404, detail="Database file not found")
+
+    # 连接到数据库
+    from langchain_community.utilities import SQLDatabase
+    try:
+        agent.db = SQLDatabase(engine_registry.get_query_engine(db_url))
+        logger.info(f"✅ Successfully connected to database")
+    except Exception as e:
+        logger.error(f"❌ Failed to connect to database: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+
+    # 创建SQL Agent
+    agent_result = agent.create_sql_agent()
+    if not agent_result["success"]:
+        raise HTTPException(status_code=500, detail=agent_result["error"])
+    return agent
+
+
+def _raise_query_error(result: Dict[str, Any]):
+    """查询失败：模型服务不可用时返回 503 和建议的重试等待秒数，其他错误返回 500"""
+    if result.get("retry_after") is not None:
+        raise HTTPException(status_code=503, detail=result["error"],
+                            headers={"Retry-After": str(max(1, math.ceil(result["retry_after"])))})
+    raise HTTPException(status_code=500, detail=result["error"])
+
+
+def _store_query_result(agent_key: str, sql: str) -> str:
+    """保存查询对应的SQL和数据源，超过上限时淘汰最早的记录"""
+    result_id = str(uuid.uuid4())
+    query_results[result_id] = {
+        "agent_key": agent_key,
+        "sql": sql,
+        "db_url": None if agent_key.startswith("file_") else get_database_url()
+    }
+
+    while len(query_results) > settings.max_stored_results:
+        del query_results[next(iter(query_results))]
+
+    return result_id
+
+
+@app.get("/results/{result_id}/export")
+async def export_result(result_id: str, format: ExportFormat = ExportFormat.CSV):
+    """
+    以服务端游标流式导出查询结果（分块传输编码，内存占用恒定）
+    """
+    if result_id not in query_results:
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    export_format = format.value
+    if export_format not in ResultExporter.supported_formats():
+        raise HTTPException(status_code=400, detail=f"Export format '{export_format}' is not available")
+
+    entry = query_results[result_id]
+    agent = sql_agents.get(entry["agent_key"])
+
+    # 有异步驱动时在异步引擎上执行并逐批读取，否则在线程池中执行查询并读取第一批（拿到列名）
+    if agent:
+        stream_result = await agent.stream_custom_sql_async(entry["sql"])
+    elif entry["db_url"]:
+        # Agent 已被清理时，数据库表的结果仍可直接从数据库导出
+        db_manager = AsyncDatabaseManager(entry["db_url"])
+        if not await db_manager.connect():
+            raise HTTPException(status_code=500, detail="Failed to connect to database")
+        stream_result = await db_manager.stream_query(entry["sql"])
+    else:
+        raise HTTPException(status_code=410, detail="Data source for this result is no longer available")
+
+    if not stream_result["success"]:
+        raise HTTPException(status_code=500, detail=stream_result["error"])
+
+    logger.info(f"Exporting result {result_id} as {export_format}")
+
+    batches = stream_result["batches"]
+    encode = ResultExporter.aiter_encoded if hasattr(batches, "__aiter__") else ResultExporter.iter_encoded
+    return StreamingResponse(
+        encode(export_format, stream_result["columns"], batches, stream_result["typed_columns"]),
+        media_type=ResultExporter.MEDIA_TYPES[export_format],
+        headers=ResultExporter.content_disposition(result_id, export_format)
+    )
+
+
 @app.post("/visualize", response_model=VisualizationResponse)
 async def create_visualization(request: VisualizationRequest):
     """
@@ -433,7 +573,7 @@ async def create_visualization(request: VisualizationRequest):
 
         # 创建可视化
         viz_result = DataVisualizer.create_chart(
-            data_result["data"],
+            data_result["result_set"],
             request.chart_type,
             request.x_column,
             request.y_column,
@@ -457,7 +597,7 @@ async def create_visualization(request: VisualizationRequest):
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_data(request: ChatRequest):
+async def chat_with_data(request: ChatRequest, http_request: Request):
     """
     与数据进行对话分析
     """
@@ -485,38 +625,15 @@ async def chat_with_data(request: ChatRequest):
 
         file_info = file_store[file_id]
 
-        # 获取或创建SQL Agent
-        if file_id not in sql_agents:
-            agent = SQLAgentManager(
-                openai_api_key=settings.openai_api_key,
-                openai_base_url=settings.openai_base_url,
-                model=settings.default_model
-            )
-
-            # 创建数据库
-            db_result = agent.create_database_from_file(
-                file_info["content"],
-                file_info["file_type"]
-            )
-
-            if not db_result["success"]:
-                raise HTTPException(status_code=500, detail=db_result["error"])
-
-            # 创建SQL Agent
-            agent_result = agent.create_sql_agent()
-
-            if not agent_result["success"]:
-                raise HTTPException(status_code=500, detail=agent_result["error"])
-
-            sql_agents[file_id] = agent
-
-        agent = sql_agents[file_id]
-
-        # 执行查询
-        result = agent.query_data(request.message)
+        # 获取或创建SQL Agent 并执行查询（创建同样在执行位内、在线程中进行）
+        async with admission_controller.slot(_client_id(http_request), file_id):
+            if file_id not in sql_agents:
+                sql_agents[file_id] = await asyncio.to_thread(_create_file_agent, file_id, file_info)
+            agent = sql_agents[file_id]
+            result = await asyncio.to_thread(agent.query_data, request.message)
 
         if not result["success"]:
-            raise HTTPException(status_code=500, detail=result["error"])
+            _raise_query_error(result)
 
         # 添加助手回复
         assistant_message = ChatMessage(role="assistant", content=result["answer"])
@@ -526,7 +643,7 @@ async def chat_with_data(request: ChatRequest):
             success=True,
             message=result["answer"],
             session_id=session_id,
-            data=result.get("data")
+            data=result["result_set"].to_records() if result.get("result_set") is not None else None
         )
 
     except HTTPException:
@@ -579,27 +696,231 @@ async def health_check():
     }
 
 
+def _resolve_upload_source(file_id: Optional[str]) -> Optional[str]:
+    """file_id 对应的上传文件数据源标识，未指定时返回 None（表示全部）"""
+    if file_id is None:
+        return None
+    agent = sql_agents.get(f"file_{file_id}") or sql_agents.get(file_id)
+    if agent is None or not agent.source_key:
+        raise HTTPException(status_code=404, detail="No query history for this file")
+    return agent.source_key
+
+
+def _with_agent_keys(sources: list) -> list:
+    """为每个数据源补充对应的 SQL Agent 键"""
+    agent_keys = {agent.source_key: key for key, agent in sql_agents.items() if agent.source_key}
+    for source in sources:
+        source["agent_key"] = agent_keys.get(source["source"])
+    return sources
+
+
+@app.get("/indexes")
+async def get_indexes(file_id: Optional[str] = None):
+    """
+    上传文件数据源的索引推荐与已建立索引（含实测加速比）
+
+    Args:
+        file_id: 只返回指定文件的数据源
+    """
+    sources = index_advisor.report(_resolve_upload_source(file_id))
+    return {"success": True, "sources": _with_agent_keys(sources)}
+
+
+@app.get("/materializations")
+async def get_materializations(file_id: Optional[str] = None):
+    """
+    上传文件数据源的汇总表与候选聚合形态
+
+    Args:
+        file_id: 只返回指定文件的数据源
+    """
+    sources = materialization_manager.report(_resolve_upload_source(file_id))
+    return {"success": True, "sources": _with_agent_keys(sources)}
+
+
+@app.get("/datasets/{dataset_id}/columns/{column}/suggest")
+async def suggest_column_values(dataset_id: str, column: str, q: str = "",
+                                table: Optional[str] = None, limit: int = 10):
+    """
+    列取值输入联想，只查询内存中的取值索引
+
+    Args:
+        dataset_id: 上传文件ID，或数据库表名
+        column: 列名
+        q: 已输入的内容，为空时返回最常见的取值
+        table: 数据集中有多张表时指定表名
+        limit: 最多返回数量
+    """
+    agent = sql_agents.get(f"file_{dataset_id}") or sql_agents.get(dataset_id) \
+        or sql_agents.get(f"table_{dataset_id}")
+    if agent is None or not hasattr(agent, "db"):
+        raise HTTPException(status_code=404, detail="Dataset not loaded, run a query first")
+
+    engine = agent.db._engine
+
+    def find_table() -> Optional[str]:
+        # 结构快照未缓存时需要反射数据库，在线程池中执行
+        snapshot = metadata_catalog.get_snapshot(engine)
+        candidates = [table] if table else [
+            name for name in agent.db.get_usable_table_names() if not name.startswith(ROLLUP_PREFIX)
+        ]
+        return next((name for name in candidates if any(
+            col["name"] == column for col in snapshot.tables.get(name, {}).get("columns", [])
+        )), None)
+
+    table_name = await asyncio.to_thread(find_table)
+    if table_name is None:
+        raise HTTPException(status_code=404, detail=f"Column '{column}' not found")
+
+    start = time.perf_counter()
+    status, suggestions = value_index.suggest(engine, table_name, column, q, max(1, min(limit, 100)))
+    if status == INDEX_UNAVAILABLE:
+        raise HTTPException(status_code=400, detail=f"Column '{column}' is not indexed for suggestions")
+
+    return {
+        "success": True,
+        "table": table_name,
+        "column": column,
+        "query": q,
+        "suggestions": suggestions,
+        # 索引正在后台建立，本次返回空列表，稍后重试即可
+        "indexing": status == INDEX_BUILDING,
+        "elapsed_us": round((time.perf_counter() - start) * 1_000_000, 1)
+    }
+
+
+def _resolve_dataset_engine(dataset_id: Optional[str]):
+    """指标查询使用的数据源引擎：上传文件使用已加载的 Agent 数据库，否则使用配置的数据库"""
+    if not dataset_id or dataset_id == DEFAULT_DATASET:
+        return engine_registry.get_query_engine(get_database_url())
+    agent = sql_agents.get(f"file_{dataset_id}") or sql_agents.get(dataset_id)
+    if agent is None or not hasattr(agent, "db"):
+        raise HTTPException(status_code=404, detail="Dataset not loaded, run a query first")
+    return agent.db._engine
+
+
+@app.get("/metrics")
+async def list_metrics(dataset_id: Optional[str] = None):
+    """
+    数据集指标目录中定义的指标和维度
+
+    Args:
+        dataset_id: 上传文件ID，不传表示配置的数据库
+    """
+    catalog = metric_catalogs.get(dataset_id)
+    if catalog is None:
+        raise HTTPException(status_code=404, detail="No metric catalog for this dataset")
+    return {"success": True, **catalog.to_dict()}
+
+
+@app.post("/metrics/query")
+async def query_metrics(request: MetricQueryRequest):
+    """
+    按指标目录把"指标 × 维度 + 筛选"编译为 SQL 并执行，不经过 LLM
+    """
+    engine = _resolve_dataset_engine(request.dataset_id)
+    payload = request.model_dump(exclude={"dataset_id", "format"})
+    try:
+        result = await asyncio.to_thread(metric_catalogs.query, request.dataset_id, payload, engine)
+    except MetricQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Metric query failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    result_set = ResultSet.from_rows(result["columns"], result["rows"])
+    if request.format == ResponseFormat.COLUMNAR:
+        return FastJSONResponse(build_columnar_payload(
+            result_set.columns,
+            result_set.column_values(),
+            success=True,
+            sql=result["sql"],
+            compile_us=result["compile_us"],
+            elapsed_ms=result["elapsed_ms"]
+        ))
+    return {
+        "success": True,
+        "sql": result["sql"],
+        "columns": result_set.columns,
+        "data": result_set.to_records(),
+        "returned_rows": result_set.row_count,
+        "compile_us": result["compile_us"],
+        "elapsed_ms": result["elapsed_ms"]
+    }
+
+
+@app.post("/metrics/materialize")
+async def materialize_metrics(dataset_id: Optional[str] = None):
+    """
+    为指标目录中声明了 materialize 的维度建立表达式索引、为指标建立生成列
+
+    Args:
+        dataset_id: 上传文件ID，不传表示配置的数据库
+    """
+    if not dataset_id or dataset_id == DEFAULT_DATASET:
+        engine = engine_registry.get_engine(get_database_url())
+        owned = False
+    else:
+        agent = sql_agents.get(f"file_{dataset_id}") or sql_agents.get(dataset_id)
+        if agent is None or not agent.temp_db_path:
+            raise HTTPException(status_code=404, detail="Dataset not loaded, run a query first")
+        # Agent 的查询引擎是只读的，建索引和生成列需要单独的可写连接
+        from sqlalchemy import create_engine
+        engine = create_engine(f"sqlite:///{agent.temp_db_path}")
+        owned = True
+    try:
+        actions = await asyncio.to_thread(metric_catalogs.materialize, dataset_id, engine)
+    except MetricQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Metric materialization failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if owned:
+            engine.dispose()
+    return {"success": True, "actions": actions}
+
+
+@app.get("/stats")
+async def get_stats():
+    """运行时性能指标"""
+    return {
+        "compression": compression_stats.snapshot(),
+        "pools": engine_registry.pool_stats(),
+        "column_pruning": pruning_stats.snapshot(),
+        "table_retrieval": table_retriever.snapshot(),
+        "metrics": metric_catalogs.snapshot(),
+        "tool_compaction": compaction_stats.snapshot(),
+        "model_routing": model_router.snapshot(),
+        "llm_resilience": resilience_stats.snapshot(),
+        "admission": admission_controller.snapshot(),
+        "agent_budget": budget_stats.snapshot()
+    }
+
+
 @app.get("/database/info")
 async def get_database_info():
     """获取数据库连接信息和表列表"""
     try:
-        db_manager = DatabaseManager()
-        if not db_manager.connect():
+        db_manager = AsyncDatabaseManager()
+        if not await db_manager.connect():
             raise HTTPException(status_code=500, detail="Failed to connect to database")
 
-        tables = db_manager.get_tables()
         table_details = []
 
-        # 获取每个表的详细信息
-        for table_name in tables:
-            info = db_manager.get_table_info(table_name)
-            if info:
-                table_details.append({
-                    "name": table_name,
-                    "rows": info.get("row_count", 0),
-                    "columns": [col["name"] for col in info.get("columns", [])],
-                    "column_count": info.get("column_count", 0)
-                })
+        # 与 /datasources 相同，整体受截止时间约束，超时的表标记为 pending
+        infos = await db_manager.collect_table_infos()
+        for info in infos:
+            detail = {
+                "name": info["name"],
+                "rows": info.get("row_count", 0),
+                "rows_exact": info.get("row_count_exact", False),
+                "columns": [col["name"] for col in info.get("columns", [])],
+                "column_count": info.get("column_count", 0)
+            }
+            if info.get("pending"):
+                detail["pending"] = True
+            table_details.append(detail)
 
         db_manager.close()
 
@@ -608,7 +929,7 @@ async def get_database_info():
             "db_type": db_manager.db_type,
             "db_url": db_manager._mask_password(db_manager.db_url),
             "tables": table_details,
-            "table_count": len(tables)
+            "table_count": len(table_details)
         }
 
     except Exception as e:
@@ -620,8 +941,8 @@ async def get_database_info():
 async def test_database_connection():
     """测试数据库连接"""
     try:
-        db_manager = DatabaseManager()
-        result = db_manager.test_connection()
+        db_manager = AsyncDatabaseManager()
+        result = await db_manager.test_connection()
         db_manager.close()
 
         if result["success"]:
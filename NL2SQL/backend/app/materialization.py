@@ -0,0 +1,486 @@
+"""
+物化聚合管理
+从查询记录中识别反复出现的单表 GROUP BY 聚合形态，为其建立汇总表，
+之后匹配的 SQL 改写为读取汇总表（可在汇总表上继续上卷），基表变化时汇总表在后台刷新
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.catalog import metadata_catalog
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "_mv_"
+ROW_COUNT_COLUMN = "__rows"
+
+AGG_PATTERN = re.compile(r"\b(SUM|COUNT|AVG|MIN|MAX)\s*\(\s*(\*|\w+)\s*\)", re.IGNORECASE)
+SHAPE_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>\w+)"
+    r"(?:\s+(?:AS\s+)?(?!WHERE\b|GROUP\b)(?P<alias>\w+))?"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"\s+GROUP\s+BY\s+(?P<group>.+?)"
+    r"(?:\s+HAVING\s+(?P<having>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+(?:\s*(?:,|OFFSET)\s*\d+)?))?"
+    r"\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+UNSUPPORTED_PATTERN = re.compile(r"\b(JOIN|UNION|WITH|DISTINCT|OVER|SELECT\b.*\bSELECT)\b", re.IGNORECASE | re.DOTALL)
+ITEM_ALIAS_PATTERN = re.compile(r"^(?P<expr>.+?)\s+(?:AS\s+)?(?P<alias>\w+)$", re.IGNORECASE | re.DOTALL)
+IDENTIFIER_PATTERN = re.compile(r"\b([A-Za-z_\u4e00-\u9fff]\w*)\b(?!\s*\()")
+NON_ALIAS_WORDS = {"END", "NULL", "ASC", "DESC"}
+
+
+def _protect_literals(sql: str) -> Tuple[str, List[str]]:
+    """把字符串字面量替换为占位符，避免改写时误改其中的内容"""
+    literals: List[str] = []
+
+    def _replace(match):
+        literals.append(match.group(0))
+        return f"'\x00{len(literals) - 1}\x00'"
+
+    sql = re.sub(r"'(?:[^']|'')*'", _replace, sql)
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    return re.sub(r"[\"`\[\]]", "", sql), literals
+
+
+def _restore_literals(sql: str, literals: List[str]) -> str:
+    return re.sub(r"'\x00(\d+)\x00'", lambda m: literals[int(m.group(1))], sql)
+
+
+def _split_top_level(expr: str) -> List[str]:
+    """按顶层逗号拆分（忽略括号内的逗号）"""
+    parts, depth, current = [], 0, []
+    for char in expr:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current).strip())
+    return parts
+
+
+class AggregateShape:
+    """一条单表聚合 SQL 的结构：分组列、过滤列、所需的聚合度量"""
+
+    def __init__(self, sql: str, table: str, alias: Optional[str], select_items: List[Tuple[str, Optional[str]]],
+                 dims: List[str], filter_columns: Set[str], measures: Set[Tuple[str, str]],
+                 parts: Dict[str, Optional[str]], literals: List[str]):
+        self.sql = sql
+        self.table = table
+        self.alias = alias
+        self.select_items = select_items
+        self.dims = dims
+        self.filter_columns = filter_columns
+        self.measures = measures  # {(函数, 列或 *)}
+        self.parts = parts
+        self.literals = literals
+
+    @property
+    def grain(self) -> FrozenSet[str]:
+        """汇总表需要保留的列：分组列 + 过滤列"""
+        return frozenset(self.dims) | frozenset(self.filter_columns)
+
+    @property
+    def measure_columns(self) -> Set[str]:
+        return {column for _, column in self.measures if column != "*"}
+
+
+def parse_aggregate(sql: str, table_columns: Dict[str, List[str]]) -> Optional[AggregateShape]:
+    """
+    解析单表 GROUP BY 聚合 SQL，不支持的形态返回 None
+
+    支持 SUM/COUNT/AVG/MIN/MAX（不含 DISTINCT），分组项为列名或序号，
+    WHERE/HAVING/ORDER BY/LIMIT 可选；不支持 JOIN、子查询、窗口函数和表达式分组
+    """
+    normalized, literals = _protect_literals(sql)
+    if UNSUPPORTED_PATTERN.search(normalized):
+        return None
+    match = SHAPE_PATTERN.match(normalized)
+    if not match:
+        return None
+
+    lower_tables = {name.lower(): name for name in table_columns}
+    table = lower_tables.get(match.group("table").lower())
+    if table is None:
+        return None
+    columns = {col.lower(): col for col in table_columns[table]}
+    alias = match.group("alias")
+
+    def _strip_qualifiers(expr: Optional[str]) -> Optional[str]:
+        if expr is None:
+            return None
+        for qualifier in filter(None, [alias, match.group("table")]):
+            expr = re.sub(rf"\b{re.escape(qualifier)}\s*\.\s*", "", expr, flags=re.IGNORECASE)
+        return expr
+
+    parts = {key: _strip_qualifiers(match.group(key)) for key in ("select", "where", "group", "having", "order")}
+    parts["limit"] = match.group("limit")
+
+    def _collect_measures(expr: str) -> bool:
+        """记录表达式中的聚合度量，聚合函数之外引用了列时返回 False"""
+        for func, arg in AGG_PATTERN.findall(expr):
+            if arg != "*" and arg.lower() not in columns:
+                return False
+            measures.add((func.upper(), "*" if arg == "*" else columns[arg.lower()]))
+        return not any(name.lower() in columns for name in IDENTIFIER_PATTERN.findall(AGG_PATTERN.sub(" ", expr)))
+
+    # SELECT 列表：每项要么是分组列，要么只在聚合函数内引用列
+    select_items: List[Tuple[str, Optional[str]]] = []
+    measures: Set[Tuple[str, str]] = set()
+    for item in _split_top_level(parts["select"]):
+        alias_match = ITEM_ALIAS_PATTERN.match(item)
+        expr, item_alias = item, None
+        if alias_match and alias_match.group("alias").upper() not in NON_ALIAS_WORDS:
+            expr, item_alias = alias_match.group("expr").strip(), alias_match.group("alias")
+        select_items.append((expr, item_alias))
+        if AGG_PATTERN.search(expr) and not _collect_measures(expr):
+            return None
+
+    # GROUP BY：列名、SELECT 序号或 SELECT 别名
+    aliases = {a.lower(): e for e, a in select_items if a}
+    dims: List[str] = []
+    for item in _split_top_level(parts["group"]):
+        if item.isdigit() and 0 < int(item) <= len(select_items):
+            item = select_items[int(item) - 1][0]
+        item = aliases.get(item.lower(), item)
+        if item.lower() not in columns:
+            return None
+        dims.append(columns[item.lower()])
+
+    # 分组列之外的裸列不能出现在 SELECT 中
+    dim_set = {d.lower() for d in dims}
+    for expr, _ in select_items:
+        if not AGG_PATTERN.search(expr) and expr.lower() not in dim_set:
+            return None
+
+    # WHERE 中引用的列需要保留在汇总表中
+    filter_columns: Set[str] = set()
+    if parts["where"]:
+        if AGG_PATTERN.search(parts["where"]):
+            return None
+        for name in IDENTIFIER_PATTERN.findall(parts["where"]):
+            if name.lower() in columns:
+                filter_columns.add(columns[name.lower()])
+
+    # HAVING / ORDER BY 中聚合之外只能引用分组列
+    for clause in ("having", "order"):
+        expr = parts[clause] or ""
+        for func, arg in AGG_PATTERN.findall(expr):
+            if arg != "*" and arg.lower() not in columns:
+                return None
+            measures.add((func.upper(), "*" if arg == "*" else columns[arg.lower()]))
+        for name in IDENTIFIER_PATTERN.findall(AGG_PATTERN.sub(" ", expr)):
+            if name.lower() in columns and name.lower() not in dim_set:
+                return None
+
+    return AggregateShape(sql, table, alias, select_items, dims, filter_columns, measures, parts, literals)
+
+
+class SummaryTable:
+    """一张汇总表：基表、保留的列和度量，以及建立时的基表签名"""
+
+    def __init__(self, table: str, grain: FrozenSet[str], measure_columns: Set[str]):
+        self.table = table
+        self.grain = grain
+        self.measure_columns = set(measure_columns)
+        digest = hashlib.md5(f"{table}|{sorted(grain)}".encode("utf-8")).hexdigest()[:10]
+        self.name = f"{SUMMARY_PREFIX}{table}_{digest}"
+        self.status = "building"  # building/ready/stale/rejected/failed
+        self.reason = ""
+        self.rows: Optional[int] = None
+        self.base_rows: Optional[int] = None
+        self.signature: Optional[Tuple] = None
+        self.built_at: Optional[float] = None
+        self.checked_at: float = 0.0
+        self.hits = 0
+
+    def covers(self, shape: AggregateShape) -> bool:
+        return shape.table == self.table and shape.grain <= self.grain \
+            and shape.measure_columns <= self.measure_columns
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "table": self.table,
+            "columns": sorted(self.grain),
+            "measures": sorted(self.measure_columns),
+            "status": self.status,
+            "reason": self.reason,
+            "rows": self.rows,
+            "base_rows": self.base_rows,
+            "hits": self.hits,
+            "built_at": self.built_at,
+        }
+
+
+class _Source:
+    """一个可物化的数据源"""
+
+    def __init__(self, write_url: str, query_engine: Engine):
+        self.write_url = write_url
+        self.query_engine = query_engine
+        self.shape_counts: Dict[Tuple[str, FrozenSet[str]], int] = {}
+        self.shape_measures: Dict[Tuple[str, FrozenSet[str]], Set[str]] = {}
+        self.summaries: Dict[Tuple[str, FrozenSet[str]], SummaryTable] = {}
+
+
+class MaterializationManager:
+    """识别高频聚合、维护汇总表并改写匹配的 SQL"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources: Dict[str, _Source] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="materialize")
+
+    def register_source(self, source_key: str, write_url: str, query_engine: Engine):
+        """
+        注册可物化的数据源
+
+        Args:
+            source_key: 数据源标识（元数据目录的 source_key）
+            write_url: 可写连接URL，用于建立汇总表
+            query_engine: 查询引擎
+        """
+        with self._lock:
+            self._sources[source_key] = _Source(write_url, query_engine)
+
+    def forget_source(self, source_key: str):
+        """数据源被删除时移除其汇总信息"""
+        with self._lock:
+            self._sources.pop(source_key, None)
+
+    def _table_columns(self, source: _Source) -> Dict[str, List[str]]:
+        snapshot = metadata_catalog.get_snapshot(source.query_engine)
+        return {
+            name: [col["name"] for col in table["columns"]]
+            for name, table in snapshot.tables.items() if not name.startswith(SUMMARY_PREFIX)
+        }
+
+    def record(self, source_key: str, sql_queries: Iterable[str]):
+        """
+        记录已执行的 SQL，同一聚合形态出现次数达到阈值时在后台建立汇总表
+
+        Args:
+            source_key: 数据源标识
+            sql_queries: SQL 语句列表
+        """
+        if not settings.materialize_enabled:
+            return
+        source = self._sources.get(source_key)
+        if source is None:
+            return
+
+        try:
+            table_columns = self._table_columns(source)
+        except Exception as e:
+            logger.warning(f"Materialization could not load schema: {e}")
+            return
+
+        to_build = []
+        with self._lock:
+            for sql in sql_queries:
+                shape = parse_aggregate(sql, table_columns)
+                if shape is None:
+                    continue
+                if any(s.covers(shape) and s.status in ("ready", "building", "stale")
+                       for s in source.summaries.values()):
+                    continue
+
+                key = (shape.table, shape.grain)
+                source.shape_counts[key] = source.shape_counts.get(key, 0) + 1
+                source.shape_measures.setdefault(key, set()).update(shape.measure_columns)
+                existing = source.summaries.get(key)
+                if source.shape_counts[key] >= settings.materialize_min_occurrences and \
+                        (existing is None or existing.status not in ("building", "rejected")):
+                    measures = source.shape_measures[key] | (existing.measure_columns if existing else set())
+                    summary = SummaryTable(shape.table, shape.grain, measures)
+                    source.summaries[key] = summary
+                    source.shape_counts[key] = 0
+                    to_build.append(summary)
+
+        for summary in to_build:
+            self._executor.submit(self._build, source, summary)
+
+    def rewrite(self, source_key: Optional[str], sql: str) -> str:
+        """
+        若 SQL 可由已就绪的汇总表回答，返回改写后的 SQL，否则原样返回
+
+        Args:
+            source_key: 数据源标识
+            sql: 原始 SQL
+
+        Returns:
+            可执行的 SQL
+        """
+        if not settings.materialize_enabled or source_key is None:
+            return sql
+        source = self._sources.get(source_key)
+        if source is None or not source.summaries:
+            return sql
+
+        try:
+            shape = parse_aggregate(sql, self._table_columns(source))
+        except Exception as e:
+            logger.warning(f"Failed to parse SQL for materialization: {e}")
+            return sql
+        if shape is None:
+            return sql
+
+        candidates = [s for s in source.summaries.values() if s.status == "ready" and s.covers(shape)]
+        for summary in sorted(candidates, key=lambda s: s.rows or 0):
+            if not self._is_fresh(source, summary):
+                continue
+            summary.hits += 1
+            rewritten = self._rewrite_sql(shape, summary)
+            logger.info(f"Rewrote aggregate query to summary table {summary.name}")
+            return rewritten
+        return sql
+
+    def _is_fresh(self, source: _Source, summary: SummaryTable) -> bool:
+        """按间隔检查基表签名，变化时标记为过期并在后台刷新"""
+        now = time.time()
+        if now - summary.checked_at < settings.materialize_check_seconds:
+            return True
+        summary.checked_at = now
+        try:
+            with source.query_engine.connect() as conn:
+                signature = self._signature(conn, source.query_engine, summary.table)
+        except Exception as e:
+            logger.warning(f"Failed to check base table {summary.table}: {e}")
+            return False
+        if signature == summary.signature:
+            return True
+
+        summary.status = "stale"
+        self._executor.submit(self._build, source, summary)
+        return False
+
+    @staticmethod
+    def _signature(conn, engine: Engine, table: str) -> Tuple:
+        """基表签名：行数和最大 rowid，插入、删除都会改变它"""
+        quote = engine.dialect.identifier_preparer.quote
+        if engine.dialect.name == "sqlite":
+            row = conn.execute(text(f"SELECT COUNT(*), MAX(rowid) FROM {quote(table)}")).one()
+        else:
+            row = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table)}")).one()
+        return tuple(row)
+
+    def _build(self, source: _Source, summary: SummaryTable):
+        """（重新）建立汇总表，压缩比不足时删除"""
+        write_engine = create_engine(source.write_url)
+        quote = write_engine.dialect.identifier_preparer.quote
+        dims = sorted(summary.grain)
+        select = [quote(d) for d in dims] + [f"COUNT(*) AS {quote(ROW_COUNT_COLUMN)}"]
+        for column in sorted(summary.measure_columns):
+            for func in ("SUM", "COUNT", "MIN", "MAX"):
+                select.append(f"{func}({quote(column)}) AS {quote(f'{func.lower()}__{column}')}")
+        group_by = f" GROUP BY {', '.join(quote(d) for d in dims)}" if dims else ""
+
+        try:
+            summary.status = "building"
+            with write_engine.begin() as conn:
+                summary.signature = self._signature(conn, write_engine, summary.table)
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(summary.name)}")
+                conn.exec_driver_sql(
+                    f"CREATE TABLE {quote(summary.name)} AS SELECT {', '.join(select)} "
+                    f"FROM {quote(summary.table)}{group_by}"
+                )
+                summary.rows = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {quote(summary.name)}").scalar()
+                summary.base_rows = summary.signature[0]
+
+            if summary.base_rows < settings.materialize_min_rows or \
+                    summary.rows > summary.base_rows * settings.materialize_max_ratio:
+                with write_engine.begin() as conn:
+                    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(summary.name)}")
+                summary.status = "rejected"
+                summary.reason = f"汇总后 {summary.rows} 行 / 基表 {summary.base_rows} 行，收益不足"
+            else:
+                summary.status = "ready"
+                summary.reason = f"汇总后 {summary.rows} 行 / 基表 {summary.base_rows} 行"
+            summary.built_at = summary.checked_at = time.time()
+            logger.info(f"Summary table {summary.name} {summary.status}: {summary.reason}")
+        except Exception as e:
+            summary.status, summary.reason = "failed", f"建立汇总表失败: {e}"
+            logger.warning(f"Failed to build summary table {summary.name}: {e}")
+        finally:
+            write_engine.dispose()
+
+    @staticmethod
+    def _rewrite_sql(shape: AggregateShape, summary: SummaryTable) -> str:
+        """把聚合函数替换为汇总表上的上卷表达式"""
+
+        def _rollup(match) -> str:
+            func, arg = match.group(1).upper(), match.group(2)
+            if arg == "*":
+                return f'SUM("{ROW_COUNT_COLUMN}")'
+            column = next(c for c in summary.measure_columns if c.lower() == arg.lower())
+            if func == "SUM":
+                return f'SUM("sum__{column}")'
+            if func == "COUNT":
+                return f'SUM("count__{column}")'
+            if func == "MIN":
+                return f'MIN("min__{column}")'
+            if func == "MAX":
+                return f'MAX("max__{column}")'
+            return f'(CAST(SUM("sum__{column}") AS REAL) / NULLIF(SUM("count__{column}"), 0))'
+
+        items = []
+        for expr, alias in shape.select_items:
+            if AGG_PATTERN.search(expr):
+                # 保留原来的输出列名
+                label = alias or re.sub(r"\s+", " ", expr).replace('"', "")
+                items.append(f'{AGG_PATTERN.sub(_rollup, expr)} AS "{label}"')
+            else:
+                items.append(f"{expr} AS {alias}" if alias else expr)
+
+        parts = shape.parts
+        sql = f'SELECT {", ".join(items)} FROM "{summary.name}"'
+        if parts["where"]:
+            sql += f" WHERE {parts['where']}"
+        sql += f" GROUP BY {parts['group']}"
+        if parts["having"]:
+            sql += f" HAVING {AGG_PATTERN.sub(_rollup, parts['having'])}"
+        if parts["order"]:
+            sql += f" ORDER BY {AGG_PATTERN.sub(_rollup, parts['order'])}"
+        if parts["limit"]:
+            sql += f" LIMIT {parts['limit']}"
+        return _restore_literals(sql, shape.literals)
+
+    def report(self, source_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """各数据源的汇总表及候选聚合形态"""
+        with self._lock:
+            sources = {key: source for key, source in self._sources.items()
+                       if source_key is None or key == source_key}
+            report = []
+            for key, source in sources.items():
+                report.append({
+                    "source": key,
+                    "summaries": [s.to_dict() for s in source.summaries.values()],
+                    "candidates": [
+                        {"table": table, "columns": sorted(grain), "occurrences": count}
+                        for (table, grain), count in source.shape_counts.items() if count
+                    ],
+                })
+        return report
+
+
+# 创建全局物化管理器实例
+materialization_manager = MaterializationManager()
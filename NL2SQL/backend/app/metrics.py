@@ -0,0 +1,636 @@
+"""
+指标与维度目录（语义层）
+每个数据集在 metrics_dir 下放一个 {数据集ID}.json / .yaml 文件，声明业务指标（销售额、订单数……）
+和分析维度（类别、客户城市、下单日期……）的统一口径；编译器把"指标 × 维度 + 筛选"的结构化请求
+直接编译为 SQL（跨表维度按关联图自动 JOIN），不经过 LLM。/metrics/query 和 Agent 的 metric_query
+工具共用同一个编译器；热门指标可声明 materialize，为维度建立表达式索引、为指标建立生成列
+
+数据集ID：上传文件为 file_id，配置的数据库为 "default"
+
+目录文件格式：
+    {
+      "table": "erp_orders",                      # 指标/维度的默认表（可选）
+      "metrics": {
+        "sales_amount": {"label": "销售额", "aggregation": "sum", "expression": "total_amount",
+                         "synonyms": ["营收"], "filter": "status <> '已取消'"},
+        "avg_order_amount": {"label": "客单价", "expression": "{sales_amount} / NULLIF({order_count}, 0)"}
+      },
+      "dimensions": {
+        "order_date": {"label": "下单日期", "expression": "order_date", "type": "time"},
+        "customer_city": {"label": "客户城市", "table": "erp_customers", "expression": "city"}
+      }
+    }
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.catalog import metadata_catalog
+from app.config import settings
+from app.join_graph import join_graphs
+from app.rollups import BUCKET_EXPRESSIONS
+
+# PyYAML 为可选依赖，不可用时只支持 JSON 目录文件
+try:
+    import yaml
+except ImportError:  # pragma: no cover - 取决于运行环境
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET = "default"
+CATALOG_EXTENSIONS = (".json", ".yaml", ".yml")
+
+AGGREGATIONS = {
+    "sum": "SUM({})",
+    "avg": "AVG({})",
+    "count": "COUNT({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+}
+FILTER_OPERATORS = {"=", "!=", ">", ">=", "<", "<=", "in", "not_in", "between", "like"}
+
+# 时间维度的分桶表达式（周以周一为起点）
+TIME_GRAINS = {
+    "sqlite": BUCKET_EXPRESSIONS,
+    "postgresql": {
+        "day": "CAST(date_trunc('day', {column}) AS DATE)",
+        "week": "CAST(date_trunc('week', {column}) AS DATE)",
+        "month": "to_char({column}, 'YYYY-MM')",
+    },
+    "mysql": {
+        "day": "DATE({column})",
+        "week": "DATE(DATE_SUB({column}, INTERVAL WEEKDAY({column}) DAY))",
+        "month": "DATE_FORMAT({column}, '%Y-%m')",
+    },
+}
+
+# 指标生成列的列名前缀：表中存在 gen_{指标名} 时编译器直接使用该列
+GENERATED_PREFIX = "gen_"
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_METRIC_REFERENCE = re.compile(r"\{(\w+)\}")
+_DATASET_ID = re.compile(r"^[\w-]+$")
+
+
+class MetricQueryError(ValueError):
+    """指标目录配置或指标查询请求无效"""
+
+
+class MetricCatalog:
+    """一个数据集的指标和维度定义"""
+
+    def __init__(self, dataset_id: str, data: Dict[str, Any]):
+        self.dataset_id = dataset_id
+        self.description = data.get("description", "")
+        default_table = data.get("table")
+
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        for name, spec in (data.get("metrics") or {}).items():
+            self.metrics[name] = self._parse_metric(name, spec, default_table)
+        self.dimensions: Dict[str, Dict[str, Any]] = {}
+        for name, spec in (data.get("dimensions") or {}).items():
+            self.dimensions[name] = self._parse_dimension(name, spec, default_table)
+
+        for metric in self.metrics.values():
+            for component in metric["components"]:
+                if component not in self.metrics:
+                    raise MetricQueryError(f"指标 {metric['name']} 引用了未定义的指标 {component}")
+            self.metric_tables(metric)  # 检查循环引用
+
+    @staticmethod
+    def _parse_metric(name: str, spec: Dict[str, Any], default_table: Optional[str]) -> Dict[str, Any]:
+        expression = str(spec.get("expression", "*")).strip()
+        components = _METRIC_REFERENCE.findall(expression)
+        aggregation = spec.get("aggregation")
+        if components:
+            aggregation = None
+        elif aggregation not in AGGREGATIONS:
+            raise MetricQueryError(f"指标 {name} 的 aggregation 必须是 {', '.join(AGGREGATIONS)} 之一")
+        table = spec.get("table", default_table)
+        if not components and not table:
+            raise MetricQueryError(f"指标 {name} 没有指定表")
+        materialize = spec.get("materialize")
+        if materialize not in (None, "column") or (materialize and (components or expression == "*")):
+            raise MetricQueryError(f"指标 {name} 只能对行级表达式声明 materialize: column")
+        return {
+            "name": name,
+            "label": spec.get("label", name),
+            "description": spec.get("description", ""),
+            "synonyms": list(spec.get("synonyms") or []),
+            "table": table,
+            "aggregation": aggregation,
+            "expression": expression,
+            "filter": spec.get("filter"),
+            "components": components,
+            "materialize": materialize,
+        }
+
+    @staticmethod
+    def _parse_dimension(name: str, spec: Dict[str, Any], default_table: Optional[str]) -> Dict[str, Any]:
+        table = spec.get("table", default_table)
+        if not table:
+            raise MetricQueryError(f"维度 {name} 没有指定表")
+        materialize = spec.get("materialize")
+        if materialize not in (None, "index"):
+            raise MetricQueryError(f"维度 {name} 只能声明 materialize: index")
+        return {
+            "name": name,
+            "label": spec.get("label", name),
+            "description": spec.get("description", ""),
+            "synonyms": list(spec.get("synonyms") or []),
+            "table": table,
+            "expression": str(spec.get("expression", name)).strip(),
+            "type": spec.get("type", "category"),
+            "materialize": materialize,
+        }
+
+    def resolve_metric(self, name: str) -> Dict[str, Any]:
+        """按名称、中文名或同义词查找指标"""
+        return self._resolve(self.metrics, name, "指标")
+
+    def resolve_dimension(self, name: str) -> Dict[str, Any]:
+        """按名称、中文名或同义词查找维度"""
+        return self._resolve(self.dimensions, name, "维度")
+
+    @staticmethod
+    def _resolve(entries: Dict[str, Dict[str, Any]], name: str, kind: str) -> Dict[str, Any]:
+        key = str(name).strip()
+        if key in entries:
+            return entries[key]
+        for entry in entries.values():
+            if key == entry["label"] or key in entry["synonyms"]:
+                return entry
+        raise MetricQueryError(f"未定义的{kind}: {name}（可用: {', '.join(entries) or '无'}）")
+
+    def metric_tables(self, metric: Dict[str, Any], _seen: Optional[Set[str]] = None) -> Set[str]:
+        """指标涉及的表（复合指标为各组成指标的表）"""
+        if not metric["components"]:
+            return {metric["table"]}
+        seen = _seen or set()
+        if metric["name"] in seen:
+            raise MetricQueryError(f"指标 {metric['name']} 存在循环引用")
+        tables = set()
+        for component in metric["components"]:
+            tables |= self.metric_tables(self.metrics[component], seen | {metric["name"]})
+        return tables
+
+    def find_metric(self, text_value: str, table: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """找出在文本中被提到（中文名或同义词）的指标，优先匹配较长的说法"""
+        matches = []
+        for metric in self.metrics.values():
+            if table and self.metric_tables(metric) != {table}:
+                continue
+            for term in [metric["label"]] + metric["synonyms"]:
+                if term and term in text_value:
+                    matches.append((len(term), metric["name"]))
+        return self.metrics[max(matches)[1]] if matches else None
+
+    def find_dimensions(self, text_value: str) -> List[Dict[str, Any]]:
+        """找出在文本中被提到（中文名或同义词）的维度"""
+        return [dimension for dimension in self.dimensions.values()
+                if any(term and term in text_value for term in [dimension["label"]] + dimension["synonyms"])]
+
+    def available(self, table_names: List[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """表都存在于数据源中的指标和维度"""
+        usable = set(table_names)
+        metrics = [m for m in self.metrics.values() if self.metric_tables(m) <= usable]
+        dimensions = [d for d in self.dimensions.values() if d["table"] in usable]
+        return metrics, dimensions
+
+    def describe(self, table_names: List[str]) -> str:
+        """
+        供 Agent 提示词使用的指标和维度说明
+
+        Args:
+            table_names: 数据源中可用的表
+
+        Returns:
+            说明文本；没有可用指标时返回空字符串
+        """
+        metrics, dimensions = self.available(table_names)
+        if not metrics:
+            return ""
+        lines = ["指标："]
+        for metric in metrics:
+            names = "、".join([metric["label"]] + metric["synonyms"])
+            line = f"- {metric['name']}（{names}，表 {', '.join(sorted(self.metric_tables(metric)))}）"
+            if metric["description"]:
+                line += f"：{metric['description']}"
+            lines.append(line)
+        if dimensions:
+            lines.append("维度：")
+            for dimension in dimensions:
+                line = f"- {dimension['name']}（{dimension['label']}，表 {dimension['table']}）"
+                if dimension["type"] == "time":
+                    line += "：时间维度，可写作 名称:day / 名称:week / 名称:month 按日/周/月分组"
+                lines.append(line)
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"dataset_id": self.dataset_id, "description": self.description,
+                "metrics": list(self.metrics.values()), "dimensions": list(self.dimensions.values())}
+
+
+def compile_metric_query(catalog: MetricCatalog, request: Dict[str, Any],
+                         engine: Engine) -> Tuple[str, Dict[str, Any]]:
+    """
+    把结构化指标请求编译为 SQL
+
+    Args:
+        catalog: 指标目录
+        request: {"metrics": [...], "dimensions": [...], "filters": [{"dimension", "op", "value"}],
+                  "order_by", "descending", "limit"}；时间维度可写作 "order_date:month"
+        engine: 数据源引擎（决定 SQL 方言、表结构和关联路径）
+
+    Returns:
+        (SQL, 绑定参数)
+
+    Raises:
+        MetricQueryError: 指标/维度未定义、指标来自不同的表、维度所在的表无法关联等
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    snapshot = metadata_catalog.get_snapshot(engine)
+
+    metric_names = request.get("metrics") or []
+    if isinstance(metric_names, str):
+        metric_names = [metric_names]
+    if not metric_names:
+        raise MetricQueryError("至少需要一个指标")
+    metrics = [catalog.resolve_metric(name) for name in metric_names]
+
+    base_tables = set()
+    for metric in metrics:
+        base_tables |= catalog.metric_tables(metric)
+    if len(base_tables) != 1:
+        raise MetricQueryError(f"指标来自不同的表（{', '.join(sorted(base_tables))}），请分别查询")
+    base = base_tables.pop()
+    if base not in snapshot.tables:
+        raise MetricQueryError(f"表 {base} 不存在于数据集 {catalog.dataset_id} 中")
+    base_columns = {col["name"] for col in snapshot.tables[base]["columns"]}
+
+    joins: List[str] = []
+    joined = {base}
+
+    def require_table(table: str):
+        """把维度所在的表按关联图中的最短路径 LEFT JOIN 进来（不影响基表指标的行数）"""
+        if table in joined:
+            return
+        if table not in snapshot.tables:
+            raise MetricQueryError(f"表 {table} 不存在于数据集 {catalog.dataset_id} 中")
+        path = join_graphs.get_graph(engine).shortest_path(base, table)
+        if path is None:
+            raise MetricQueryError(f"无法确定 {base} 与 {table} 的关联方式")
+        current = base
+        for edge in path:
+            other = edge["right_table"] if edge["left_table"] == current else edge["left_table"]
+            if other not in joined:
+                condition = " AND ".join(
+                    f"{quote(edge['left_table'])}.{quote(left)} = {quote(edge['right_table'])}.{quote(right)}"
+                    for left, right in zip(edge["left_columns"], edge["right_columns"])
+                )
+                joins.append(f"LEFT JOIN {quote(other)} ON {condition}")
+                joined.add(other)
+            current = other
+
+    def column_ref(table: str, expression: str) -> str:
+        # 单个列名自动加表名限定，JOIN 后不会有歧义；复杂表达式按目录原样使用
+        return f"{quote(table)}.{quote(expression)}" if _IDENTIFIER.match(expression) else expression
+
+    def dimension_sql(spec: str) -> Tuple[str, str]:
+        name, _, grain = str(spec).partition(":")
+        dimension = catalog.resolve_dimension(name)
+        require_table(dimension["table"])
+        expression = column_ref(dimension["table"], dimension["expression"])
+        alias = dimension["name"]
+        if grain:
+            grains = TIME_GRAINS.get(engine.dialect.name, {})
+            if dimension["type"] != "time" or grain not in grains:
+                raise MetricQueryError(f"维度 {name} 不支持按 {grain} 分组")
+            expression = grains[grain].format(column=expression)
+            alias = f"{alias}_{grain}"
+        return expression, alias
+
+    def metric_sql(metric: Dict[str, Any]) -> str:
+        if metric["components"]:
+            return _METRIC_REFERENCE.sub(
+                lambda m: f"({metric_sql(catalog.metrics[m.group(1)])})", metric["expression"])
+        generated = f"{GENERATED_PREFIX}{metric['name']}"
+        if generated in base_columns:
+            inner = f"{quote(base)}.{quote(generated)}"
+        elif metric["expression"] == "*":
+            inner = "*"
+        else:
+            inner = column_ref(base, metric["expression"])
+        if metric["filter"]:
+            inner = f"CASE WHEN {metric['filter']} THEN {'1' if inner == '*' else inner} END"
+        return AGGREGATIONS[metric["aggregation"]].format(inner)
+
+    select, aliases = [], []
+    for spec in request.get("dimensions") or []:
+        expression, alias = dimension_sql(spec)
+        select.append(f"{expression} AS {quote(alias)}")
+        aliases.append(alias)
+    group_count = len(select)
+    for metric in metrics:
+        select.append(f"{metric_sql(metric)} AS {quote(metric['name'])}")
+        aliases.append(metric["name"])
+
+    conditions, params = [], {}
+    for i, item in enumerate(request.get("filters") or []):
+        op = str(item.get("op", "=")).lower()
+        if op not in FILTER_OPERATORS:
+            raise MetricQueryError(f"不支持的筛选操作 {op}（可用: {', '.join(sorted(FILTER_OPERATORS))}）")
+        expression, _ = dimension_sql(item.get("dimension", ""))
+        value = item.get("value")
+        if op in ("in", "not_in", "between"):
+            values = value if isinstance(value, (list, tuple)) else [value]
+            if op == "between" and len(values) != 2:
+                raise MetricQueryError("between 需要两个取值")
+            names = [f"f{i}_{j}" for j in range(len(values))]
+            params.update(zip(names, values))
+            if op == "between":
+                conditions.append(f"{expression} BETWEEN :{names[0]} AND :{names[1]}")
+            else:
+                keyword = "IN" if op == "in" else "NOT IN"
+                conditions.append(f"{expression} {keyword} ({', '.join(f':{n}' for n in names)})")
+        else:
+            params[f"f{i}"] = value
+            conditions.append(f"{expression} {op.upper()} :f{i}")
+
+    sql = f"SELECT {', '.join(select)} FROM {quote(base)}"
+    if joins:
+        sql += " " + " ".join(joins)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if group_count:
+        sql += " GROUP BY " + ", ".join(str(i) for i in range(1, group_count + 1))
+
+    order_by = request.get("order_by")
+    if order_by:
+        order_name = str(order_by).split(":")[0]
+        target = next((a for a in aliases if a == order_by or a == order_name), None)
+        if target is None:
+            try:
+                target = catalog.resolve_metric(order_name)["name"]
+            except MetricQueryError:
+                target = catalog.resolve_dimension(order_name)["name"]
+            if target not in aliases:
+                raise MetricQueryError(f"排序字段 {order_by} 不在查询结果中")
+        sql += f" ORDER BY {quote(target)} {'DESC' if request.get('descending', True) else 'ASC'}"
+    elif group_count:
+        sql += " ORDER BY " + ", ".join(str(i) for i in range(1, group_count + 1))
+
+    limit = request.get("limit") or settings.metric_default_limit
+    sql += f" LIMIT {max(1, min(int(limit), settings.metric_max_limit))}"
+    return sql, params
+
+
+def render_sql(engine: Engine, sql: str, params: Dict[str, Any]) -> str:
+    """把绑定参数按方言转义后内联到 SQL 中（用于展示、结果导出和记录查询形态）"""
+    if not params:
+        return sql
+    statement = text(sql).bindparams(**params)
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+class MetricCatalogStore:
+    """按数据集加载指标目录，文件修改后自动重新加载"""
+
+    def __init__(self, metrics_dir: Optional[str] = None):
+        self.metrics_dir = metrics_dir or settings.metrics_dir
+        # {数据集ID: (文件路径, 修改时间, 目录)}
+        self._catalogs: Dict[str, Tuple[str, float, MetricCatalog]] = {}
+        self._lock = threading.Lock()
+        self._queries = 0
+        self._errors = 0
+        self._compile_us = 0.0
+
+    def get(self, dataset_id: Optional[str]) -> Optional[MetricCatalog]:
+        """
+        获取数据集的指标目录
+
+        Args:
+            dataset_id: 数据集ID，None 表示配置的数据库
+
+        Returns:
+            指标目录；没有目录文件或文件无效时返回 None
+        """
+        dataset_id = dataset_id or DEFAULT_DATASET
+        if not _DATASET_ID.match(dataset_id):
+            return None
+        path = self._find_file(dataset_id)
+        if path is None:
+            self._catalogs.pop(dataset_id, None)
+            return None
+
+        mtime = os.path.getmtime(path)
+        cached = self._catalogs.get(dataset_id)
+        if cached and cached[0] == path and cached[1] == mtime:
+            return cached[2]
+
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    if path.endswith(".json"):
+                        data = json.load(f)
+                    elif yaml is not None:
+                        data = yaml.safe_load(f)
+                    else:
+                        logger.warning(f"PyYAML is not installed, cannot load metric catalog {path}")
+                        return None
+                catalog = MetricCatalog(dataset_id, data or {})
+            except Exception as e:
+                logger.warning(f"Failed to load metric catalog {path}: {e}")
+                return None
+            self._catalogs[dataset_id] = (path, mtime, catalog)
+            logger.info(f"Loaded metric catalog {path}: {len(catalog.metrics)} metrics, "
+                        f"{len(catalog.dimensions)} dimensions")
+            return catalog
+
+    def _find_file(self, dataset_id: str) -> Optional[str]:
+        for extension in CATALOG_EXTENSIONS:
+            path = os.path.join(self.metrics_dir, f"{dataset_id}{extension}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    def compile(self, dataset_id: Optional[str], request: Dict[str, Any], engine: Engine) -> Tuple[str, Dict[str, Any]]:
+        """编译指标请求（数据集没有指标目录时抛出 MetricQueryError）"""
+        catalog = self.get(dataset_id)
+        if catalog is None:
+            raise MetricQueryError(f"数据集 {dataset_id or DEFAULT_DATASET} 没有指标目录")
+        return compile_metric_query(catalog, request, engine)
+
+    def query(self, dataset_id: Optional[str], request: Dict[str, Any], engine: Engine) -> Dict[str, Any]:
+        """
+        编译并执行指标请求
+
+        Returns:
+            {"sql", "columns", "rows", "compile_us", "elapsed_ms"}
+        """
+        start = time.perf_counter()
+        try:
+            sql, params = self.compile(dataset_id, request, engine)
+        except MetricQueryError:
+            with self._lock:
+                self._errors += 1
+            raise
+        compiled = time.perf_counter()
+        with engine.connect() as conn:
+            result = conn.execute(text(sql), params)
+            columns = list(result.keys())
+            rows = [tuple(row) for row in result]
+        compile_us = (compiled - start) * 1_000_000
+        with self._lock:
+            self._queries += 1
+            self._compile_us += compile_us
+        return {
+            "sql": render_sql(engine, sql, params),
+            "columns": columns,
+            "rows": rows,
+            "compile_us": round(compile_us, 1),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    def materialize(self, dataset_id: Optional[str], engine: Engine) -> List[Dict[str, Any]]:
+        """
+        为声明了 materialize 的热门指标和维度建立物理结构（已存在的跳过）
+
+        - 维度 materialize: index：在维度表达式上建立（表达式）索引
+        - 指标 materialize: column：把行级表达式建为虚拟/生成列 gen_{指标名}，编译器随后直接使用该列
+
+        Args:
+            dataset_id: 数据集ID
+            engine: 可写的数据源引擎
+
+        Returns:
+            [{"kind", "name", "table", "status"}]
+        """
+        catalog = self.get(dataset_id)
+        if catalog is None:
+            raise MetricQueryError(f"数据集 {dataset_id or DEFAULT_DATASET} 没有指标目录")
+
+        quote = engine.dialect.identifier_preparer.quote
+        dialect = engine.dialect.name
+        actions = []
+        with engine.begin() as conn:
+            inspector = inspect(conn)
+            for dimension in catalog.dimensions.values():
+                if dimension["materialize"] != "index":
+                    continue
+                table = dimension["table"]
+                index_name = f"idx_metric_{table}_{dimension['name']}"
+                if not inspector.has_table(table):
+                    status = "missing_table"
+                elif index_name in {ix["name"] for ix in inspector.get_indexes(table)}:
+                    status = "exists"
+                else:
+                    expression = dimension["expression"]
+                    expression = quote(expression) if _IDENTIFIER.match(expression) else f"({expression})"
+                    conn.execute(text(f"CREATE INDEX {quote(index_name)} ON {quote(table)} ({expression})"))
+                    status = "created"
+                actions.append({"kind": "index", "name": index_name, "table": table, "status": status})
+
+            for metric in catalog.metrics.values():
+                if metric["materialize"] != "column":
+                    continue
+                table = metric["table"]
+                column = f"{GENERATED_PREFIX}{metric['name']}"
+                if not inspector.has_table(table):
+                    status = "missing_table"
+                elif column in {col["name"] for col in inspector.get_columns(table)}:
+                    status = "exists"
+                else:
+                    # SQLite/MySQL 的虚拟列不占存储；PostgreSQL 只支持 STORED 生成列
+                    storage = "STORED" if dialect == "postgresql" else "VIRTUAL"
+                    conn.execute(text(
+                        f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} DOUBLE PRECISION "
+                        f"GENERATED ALWAYS AS ({metric['expression']}) {storage}"
+                    ))
+                    status = "created"
+                actions.append({"kind": "column", "name": column, "table": table, "status": status})
+
+        if any(action["status"] == "created" for action in actions):
+            metadata_catalog.invalidate(engine)
+        logger.info(f"Materialized metric catalog {catalog.dataset_id}: {actions}")
+        return actions
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded_catalogs": len(self._catalogs),
+                "queries": self._queries,
+                "errors": self._errors,
+                "avg_compile_us": round(self._compile_us / self._queries, 1) if self._queries else None,
+            }
+
+
+class _MetricFilterInput(BaseModel):
+    dimension: str = Field(..., description="Dimension name, e.g. 'category' or 'order_date'")
+    op: str = Field("=", description="One of =, !=, >, >=, <, <=, in, not_in, between, like")
+    value: Any = Field(..., description="Value; a list for in / not_in / between")
+
+
+class _MetricQueryInput(BaseModel):
+    metrics: List[str] = Field(..., description="Metric names from the metric catalog, e.g. ['sales_amount']")
+    dimensions: List[str] = Field(default_factory=list,
+                                  description="Dimensions to group by; time dimensions accept ':day', ':week' or ':month'")
+    filters: List[_MetricFilterInput] = Field(default_factory=list, description="Filter conditions")
+    order_by: Optional[str] = Field(None, description="Metric or dimension to sort by")
+    descending: bool = Field(True, description="Sort descending")
+    limit: Optional[int] = Field(None, description="Maximum number of rows")
+
+
+class MetricQueryTool(BaseSQLDatabaseTool, BaseTool):
+    """按指标目录中统一定义的口径查询业务指标，由编译器生成 SQL"""
+
+    name: str = "metric_query"
+    description: str = (
+        "Query business metrics (e.g. sales amount, order count) by dimensions with filters. "
+        "Metric formulas and join paths are predefined in the metric catalog, so prefer this tool over "
+        "writing SQL whenever the question is about a listed metric. Returns the generated SQL and rows."
+    )
+    args_schema: Type[BaseModel] = _MetricQueryInput
+    dataset_id: Optional[str] = None
+
+    def _run(self, metrics: List[str], dimensions: Optional[List[str]] = None,
+             filters: Optional[List[Any]] = None, order_by: Optional[str] = None,
+             descending: bool = True, limit: Optional[int] = None, run_manager=None) -> str:
+        request = {
+            "metrics": metrics,
+            "dimensions": dimensions or [],
+            "filters": [f.model_dump() if hasattr(f, "model_dump") else dict(f) for f in filters or []],
+            "order_by": order_by,
+            "descending": descending,
+            "limit": limit,
+        }
+        try:
+            result = metric_catalogs.query(self.dataset_id, request, self.db._engine)
+        except MetricQueryError as e:
+            return f"Error: {e}"
+        except Exception as e:
+            return f"Error: metric query failed: {e}"
+
+        shown = result["rows"][:50]
+        lines = [f"SQL: {result['sql']}", " | ".join(result["columns"])]
+        lines += [" | ".join(str(value) for value in row) for row in shown]
+        if len(result["rows"]) > len(shown):
+            lines.append(f"……共 {len(result['rows'])} 行")
+        return "\n".join(lines)
+
+
+# 创建全局指标目录实例
+metric_catalogs = MetricCatalogStore()
@@ -0,0 +1,175 @@
+"""
+模型分级路由
+大部分问题是简单的列表或 Top-N 查询，小模型即可胜任且更快更便宜；按问题的复杂度（关键词规则 + 涉及的表结构范围）
+为每个请求选择模型档位，小模型执行 SQL 失败时升级到大模型重试，并按档位统计延迟、token 和费用
+"""
+
+import logging
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+from app.table_retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+FAST_TIER = "fast"
+LARGE_TIER = "large"
+
+# 需要多步推理或复杂 SQL（窗口函数、子查询、多表关联）的问题特征，每类命中加 2 分
+COMPLEX_PATTERNS = {
+    "时间对比": re.compile(r"同比|环比|增长|下降|变化|趋势|yoy|mom|growth|trend", re.I),
+    "占比": re.compile(r"占比|比例|比率|百分比|份额|ratio|percent|share", re.I),
+    "比较": re.compile(r"对比|比较|相比|差异|差距|compare|versus|\bvs\b", re.I),
+    "分组排名": re.compile(r"每[个位类家月年天周].{0,12}(最|前\s*\d+|排名)|分别.{0,8}(最|前\s*\d+)|"
+                       r"(each|every|per)\s+\w+.{0,20}(top|most|highest|lowest)", re.I),
+    "统计": re.compile(r"累计|移动平均|中位数|方差|标准差|分位|留存|复购|相关性|"
+                     r"cumulative|rolling|median|percentile|retention|correlat", re.I),
+    "子查询": re.compile(r"(高于|低于|超过|大于|小于)(平均|均值|整体)|从未|没有.{0,10}过|至少.{0,6}次|"
+                      r"同时|既.{0,10}又|above average|below average|never|at least", re.I),
+    "分析": re.compile(r"为什么|原因|分析|预测|建议|洞察|why|analy[sz]e|predict|forecast", re.I),
+}
+
+# 简单查询特征，命中时减 1 分
+SIMPLE_PATTERN = re.compile(
+    r"^\s*(列出|显示|查看|查询|给我|看看|有哪些|show|list|get)|前\s*\d+\s*[条个名行]|top\s*\d+|"
+    r"多少[条个行]|总数|总共|一共|有哪些|how many", re.I)
+
+# 并列分句较多时说明问题包含多个子问题
+CLAUSE_SEPARATORS = re.compile(r"[，,；;、]|并且|以及|而且|and also")
+
+
+def classify_question(question: str, scope_tables: int = 1,
+                      touched_tables: int = 0) -> Tuple[str, int, List[str]]:
+    """
+    判断问题复杂度并选择模型档位
+
+    Args:
+        question: 用户问题
+        scope_tables: 提示词中可用的表数量（表检索得到的候选表或全部表）
+        touched_tables: 问题中直接提到（表名或列名命中）的表数量
+
+    Returns:
+        (档位, 复杂度得分, 命中的原因)
+    """
+    score, reasons = 0, []
+    for label, pattern in COMPLEX_PATTERNS.items():
+        if pattern.search(question):
+            score += 2
+            reasons.append(label)
+    if SIMPLE_PATTERN.search(question):
+        score -= 1
+        reasons.append("简单查询")
+    if len(question) > settings.model_routing_long_question_chars:
+        score += 1
+        reasons.append("问题较长")
+    if len(CLAUSE_SEPARATORS.findall(question)) >= 3:
+        score += 1
+        reasons.append("多个子问题")
+    if touched_tables >= 2:
+        score += 2
+        reasons.append(f"涉及 {touched_tables} 张表")
+    if scope_tables >= settings.model_routing_wide_schema_tables:
+        score += 1
+        reasons.append(f"候选表 {scope_tables} 张")
+
+    tier = LARGE_TIER if score >= settings.model_routing_complex_threshold else FAST_TIER
+    return tier, score, reasons
+
+
+def count_touched_tables(question: str, tables: Iterable[Dict[str, Any]]) -> int:
+    """问题中的词项命中表名或列名的表数量（英文表结构 + 英文问题时才有效，中文问题通常为 0）"""
+    terms = set(tokenize(question))
+    if not terms:
+        return 0
+    touched = 0
+    for table in tables:
+        names = set(tokenize(table["name"]))
+        for col in table["columns"]:
+            names.update(tokenize(col["name"]))
+        if terms & names:
+            touched += 1
+    return touched
+
+
+class _TierStats:
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.escalations = 0
+        self.total_ms = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+
+class ModelRouter:
+    """模型档位选择与按档位的延迟、token、费用统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _TierStats] = {FAST_TIER: _TierStats(), LARGE_TIER: _TierStats()}
+
+    @staticmethod
+    def models() -> Dict[str, Optional[str]]:
+        """{档位: 模型名}，未启用路由或没有配置小模型时 fast 为 None"""
+        fast = settings.fast_model if settings.model_routing_enabled else None
+        if fast == settings.default_model:
+            fast = None
+        return {FAST_TIER: fast, LARGE_TIER: settings.default_model}
+
+    @staticmethod
+    def prices(tier: str) -> Tuple[float, float]:
+        """档位的 (输入, 输出) 单价（每千 token）"""
+        if tier == FAST_TIER:
+            return settings.fast_model_input_price, settings.fast_model_output_price
+        return settings.default_model_input_price, settings.default_model_output_price
+
+    def route(self, question: str, scope_tables: int = 1, touched_tables: int = 0,
+              available: Iterable[str] = (FAST_TIER, LARGE_TIER)) -> str:
+        """为问题选择档位；只有大模型可用时总是返回 large"""
+        if FAST_TIER not in available:
+            return LARGE_TIER
+        tier, score, reasons = classify_question(question, scope_tables, touched_tables)
+        logger.info(f"Routed question to {tier} tier (score {score}: {', '.join(reasons) or '无复杂特征'})")
+        return tier
+
+    def record(self, tier: str, elapsed_ms: float, input_tokens: int, output_tokens: int, success: bool):
+        """记录一次 Agent 运行"""
+        input_price, output_price = self.prices(tier)
+        with self._lock:
+            stats = self._stats[tier]
+            stats.requests += 1
+            stats.failures += 0 if success else 1
+            stats.total_ms += elapsed_ms
+            stats.input_tokens += input_tokens
+            stats.output_tokens += output_tokens
+            stats.cost += (input_tokens * input_price + output_tokens * output_price) / 1000
+
+    def record_escalation(self, tier: str):
+        """记录一次从该档位升级到大模型"""
+        with self._lock:
+            self._stats[tier].escalations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        models = self.models()
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._stats.items():
+                tiers[tier] = {
+                    "model": models[tier],
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "escalations": stats.escalations,
+                    "avg_latency_ms": round(stats.total_ms / stats.requests, 1) if stats.requests else None,
+                    "input_tokens": stats.input_tokens,
+                    "output_tokens": stats.output_tokens,
+                    "cost": round(stats.cost, 6),
+                    "avg_cost": round(stats.cost / stats.requests, 6) if stats.requests else None,
+                }
+            return {"enabled": models[FAST_TIER] is not None, "tiers": tiers}
+
+
+# 创建全局模型路由实例
+model_router = ModelRouter()
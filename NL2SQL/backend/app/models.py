@@ -20,12 +20,18 @@ class FileUploadResponse(BaseModel):
     estimated_rows: Optional[int] = None
 
 
+class ResponseFormat(str, Enum):
+    RECORDS = "records"
+    COLUMNAR = "columnar"
+
+
 class QueryRequest(BaseModel):
     query: str = Field(..., description="Natural language query")
     file_id: Optional[str] = Field(None, description="File ID if querying uploaded file")
     table_name: Optional[str] = Field(None, description="Table name if querying database table")
     columns: Optional[List[str]] = Field(None, description="Specific columns to query")
     limit: Optional[int] = Field(None, description="Maximum number of rows to return (deprecated, use natural language in query)")
+    format: ResponseFormat = Field(ResponseFormat.RECORDS, description="Response data format: 'records' (list of dicts) or 'columnar'")
 
 
 class QueryResponse(BaseModel):
@@ -39,6 +45,34 @@ class QueryResponse(BaseModel):
     columns: Optional[List[str]] = None
     error: Optional[str] = None
     visualization: Optional[str] = None
+    result_id: Optional[str] = None
+    prompt_tokens: Optional[Dict[str, int]] = None  # 宽表列裁剪前后的系统提示 token 数
+    model_tier: Optional[str] = None  # 回答该问题的模型档位（fast / large）
+    degraded: Optional[bool] = None  # 降级结果：模型服务不可用（缓存的回答或按指标目录直接查询）或预算用完
+    budget: Optional[Dict[str, Any]] = None  # 本次问题的步数、token 和耗时及用完的预算类型
+
+
+class MetricFilter(BaseModel):
+    dimension: str = Field(..., description="Dimension name, label or synonym")
+    op: str = Field("=", description="=, !=, >, >=, <, <=, in, not_in, between, like")
+    value: Any = Field(..., description="Filter value; a list for in / not_in / between")
+
+
+class MetricQueryRequest(BaseModel):
+    dataset_id: Optional[str] = Field(None, description="Uploaded file ID; omit for the configured database")
+    metrics: List[str] = Field(..., description="Metric names, labels or synonyms")
+    dimensions: List[str] = Field(default_factory=list, description="Group-by dimensions, time dimensions accept ':day' / ':week' / ':month'")
+    filters: List[MetricFilter] = Field(default_factory=list)
+    order_by: Optional[str] = Field(None, description="Metric or dimension to sort by")
+    descending: bool = True
+    limit: Optional[int] = Field(None, description="Maximum number of rows")
+    format: ResponseFormat = Field(ResponseFormat.RECORDS, description="Response data format: 'records' or 'columnar'")
+
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+    ARROW = "arrow"
 
 
 class ChartType(str, Enum):
@@ -0,0 +1,286 @@
+"""
+列取值概况
+按数据版本为每张表预先统计列的不同取值数、高频取值、最小/最大值、空值比例和日期范围，
+持久化到 profile_dir，通过自定义的 sql_db_schema 工具和提示词提供给 Agent，
+代替 LangChain 每次查看结构时抽取的 3 行示例数据
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_community.tools.sql_database.tool import InfoSQLDatabaseTool
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from app.catalog import metadata_catalog
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_TYPE_HINTS = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+DATE_TYPE_HINTS = ("DATE", "TIME")
+
+
+def _is_numeric(type_name: str) -> bool:
+    return any(hint in type_name.upper() for hint in NUMERIC_TYPE_HINTS)
+
+
+def _format_value(value: Any, max_length: int = 40) -> str:
+    text_value = str(value)
+    return text_value if len(text_value) <= max_length else text_value[:max_length] + "…"
+
+
+class ColumnProfileStore:
+    """列取值概况存储，按 (数据源, 表) 缓存并持久化"""
+
+    def __init__(self, profile_dir: Optional[str] = None):
+        self.profile_dir = profile_dir or settings.profile_dir
+        # {数据源标识: {表名: 概况}}
+        self._profiles: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # 上次检查数据版本的时间 {(数据源标识, 表名): 时间}
+        self._checked_at: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def get_profiles(self, engine: Engine, table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        获取表的列取值概况，数据版本变化或尚未统计时重新计算
+
+        Args:
+            engine: SQLAlchemy 引擎
+            table_names: 表名列表
+
+        Returns:
+            {表名: 概况}，统计失败的表不包含在内
+        """
+        key = metadata_catalog.source_key(engine)
+        snapshot = metadata_catalog.get_snapshot(engine)
+
+        with self._lock:
+            profiles = self._profiles.get(key)
+            if profiles is None:
+                profiles = self._profiles[key] = self._load(key)
+
+        result = {}
+        for name in table_names:
+            table = snapshot.tables.get(name)
+            if not table:
+                continue
+            profile = profiles.get(name)
+            now = time.time()
+            if profile and now - self._checked_at.get((key, name), 0) < settings.profile_check_seconds:
+                result[name] = profile
+                continue
+
+            try:
+                with engine.connect() as conn:
+                    version = self._data_version(conn, table)
+                    if not profile or profile["version"] != version:
+                        start = time.perf_counter()
+                        profile = self._profile_table(conn, table, version)
+                        logger.info(f"Profiled {name} ({profile['rows']} rows, {len(profile['columns'])} columns) "
+                                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+                        profiles[name] = profile
+                        self._save(key, profiles)
+                self._checked_at[(key, name)] = now
+                result[name] = profile
+            except Exception as e:
+                logger.warning(f"Failed to profile table {name}: {e}")
+                if profile:
+                    result[name] = profile
+        return result
+
+    def forget(self, engine: Engine):
+        """删除数据源的概况缓存和持久化文件（临时数据源清理时调用）"""
+        key = metadata_catalog.source_key(engine)
+        with self._lock:
+            self._profiles.pop(key, None)
+            for check_key in [k for k in self._checked_at if k[0] == key]:
+                self._checked_at.pop(check_key, None)
+        path = self._path(key)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    @staticmethod
+    def _data_version(conn: Connection, table: Dict[str, Any]) -> List[Any]:
+        """数据版本：列定义 + 行数（SQLite 另加最大 rowid），任一变化即重新统计"""
+        quote = conn.dialect.identifier_preparer.quote
+        if conn.dialect.name == "sqlite":
+            row = conn.execute(text(f"SELECT COUNT(*), MAX(rowid) FROM {quote(table['name'])}")).one()
+        else:
+            row = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table['name'])}")).one()
+        columns = [f"{col['name']}:{col['type']}" for col in table["columns"]]
+        return columns + list(row)
+
+    def _profile_table(self, conn: Connection, table: Dict[str, Any], version: List[Any]) -> Dict[str, Any]:
+        """统计一张表所有列的概况：一条聚合查询取计数和极值，低基数列再取高频取值"""
+        quote = conn.dialect.identifier_preparer.quote
+        name = quote(table["name"])
+        columns = table["columns"]
+
+        select = ["COUNT(*)"]
+        for col in columns:
+            c = quote(col["name"])
+            select += [f"COUNT({c})", f"COUNT(DISTINCT {c})", f"MIN({c})", f"MAX({c})"]
+        row = conn.execute(text(f"SELECT {', '.join(select)} FROM {name}")).one()
+        rows = row[0] or 0
+
+        profiled = {}
+        for i, col in enumerate(columns):
+            non_null, distinct, min_value, max_value = row[1 + i * 4: 5 + i * 4]
+            profile = {
+                "type": col["type"],
+                "distinct": distinct or 0,
+                "null_ratio": round(1 - non_null / rows, 4) if rows else 0.0,
+                "min": min_value,
+                "max": max_value,
+                "is_date": self._is_date_column(conn, table["name"], col),
+                "top_values": [],
+            }
+            # 数值列和日期列看范围即可，高频取值只对类别型文本列有意义（取值各不相同的列除外）
+            categorical = distinct and distinct <= settings.profile_top_values_max_distinct \
+                and (distinct <= settings.profile_top_k or distinct < non_null)
+            if categorical and not _is_numeric(col["type"]) and not profile["is_date"]:
+                c = quote(col["name"])
+                profile["top_values"] = [
+                    [value, count] for value, count in conn.execute(text(
+                        f"SELECT {c}, COUNT(*) AS n FROM {name} WHERE {c} IS NOT NULL "
+                        f"GROUP BY {c} ORDER BY n DESC LIMIT {int(settings.profile_top_k)}"
+                    ))
+                ]
+            profiled[col["name"]] = profile
+
+        return {"version": version, "rows": rows, "profiled_at": time.time(), "columns": profiled}
+
+    @staticmethod
+    def _is_date_column(conn: Connection, table_name: str, col: Dict[str, Any]) -> bool:
+        """日期列：声明为日期/时间类型，或 SQLite 文本列的抽样值能被 date() 解析"""
+        type_name = col["type"].upper()
+        if any(hint in type_name for hint in DATE_TYPE_HINTS):
+            return True
+        if conn.dialect.name != "sqlite" or _is_numeric(type_name):
+            return False
+        quote = conn.dialect.identifier_preparer.quote
+        non_null, parsed = conn.execute(text(
+            f"SELECT COUNT(v), COUNT(CASE WHEN typeof(v) = 'text' AND date(v) IS NOT NULL THEN 1 END) "
+            f"FROM (SELECT {quote(col['name'])} AS v FROM {quote(table_name)} LIMIT 200)"
+        )).one()
+        return bool(non_null) and parsed / non_null >= 0.9
+
+    def describe_table(self, table: Dict[str, Any], profile: Optional[Dict[str, Any]],
+                       max_values: int = 10, columns: Optional[List[str]] = None) -> str:
+        """
+        生成单表的结构和列概况文本
+
+        Args:
+            table: 元数据目录中的表信息
+            profile: 列概况，没有时只输出结构
+            max_values: 每列最多列出的高频取值数
+            columns: 只输出这些列，默认全部
+
+        Returns:
+            文本描述
+        """
+        header = f"表 {table['name']}"
+        if profile:
+            header += f"（{profile['rows']} 行）"
+        lines = [header]
+        if table["primary_key"]:
+            lines.append(f"  主键: {', '.join(table['primary_key'])}")
+        for fk in table["foreign_keys"]:
+            lines.append(f"  外键: {', '.join(fk['columns'])} -> "
+                         f"{fk['referred_table']}({', '.join(fk['referred_columns'])})")
+
+        column_stats = profile["columns"] if profile else {}
+        listed = [col for col in table["columns"] if columns is None or col["name"] in columns]
+        for col in listed:
+            line = f"  - {col['name']} {col['type']}"
+            stats = column_stats.get(col["name"])
+            if stats:
+                line += f"：{self._describe_column(stats, max_values)}"
+            lines.append(line)
+        if len(listed) < len(table["columns"]):
+            lines.append(f"  - ……另有 {len(table['columns']) - len(listed)} 列未列出")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _describe_column(stats: Dict[str, Any], max_values: int) -> str:
+        parts = [f"{stats['distinct']} 个不同值"]
+        if stats["null_ratio"]:
+            parts.append(f"空值 {stats['null_ratio']:.0%}")
+        # 文本列的最小/最大值只是字典序，不输出
+        if stats["min"] is not None and (stats["is_date"] or _is_numeric(stats["type"])):
+            label = "日期范围" if stats["is_date"] else "范围"
+            parts.append(f"{label} {_format_value(stats['min'])} ~ {_format_value(stats['max'])}")
+        if stats["top_values"] and max_values > 0:
+            values = ", ".join(f"{_format_value(v)}({n})" for v, n in stats["top_values"][:max_values])
+            more = "" if stats["distinct"] <= max_values else " ……"
+            parts.append(f"常见取值 {values}{more}")
+        return "；".join(parts)
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.md5(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.profile_dir, f"{digest}.json")
+
+    def _load(self, key: str) -> Dict[str, Dict[str, Any]]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("tables", {}) if data.get("source") == key else {}
+        except Exception as e:
+            logger.warning(f"Failed to load column profiles from {path}: {e}")
+            return {}
+
+    def _save(self, key: str, profiles: Dict[str, Dict[str, Any]]):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"source": key, "tables": profiles}, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to save column profiles: {e}")
+
+
+class ProfiledSchemaTool(InfoSQLDatabaseTool):
+    """
+    sql_db_schema 的替代实现：返回元数据目录中的结构和预先统计的列概况，
+    不再对每张表执行 SELECT ... LIMIT 3
+    """
+
+    description: str = (
+        "Get the schema and column profiles (distinct count, common values, min/max, "
+        "null ratio, date range) for the specified SQL tables. "
+        "Input is a comma-separated list of tables."
+    )
+
+    def _run(self, table_names: str, run_manager=None) -> str:
+        engine = self.db._engine
+        requested = [t.strip() for t in table_names.split(",") if t.strip()]
+        usable = set(self.db.get_usable_table_names())
+        missing = [t for t in requested if t not in usable]
+        if missing:
+            return f"Error: table_names {set(missing)} not found in database"
+
+        try:
+            snapshot = metadata_catalog.get_snapshot(engine)
+            profiles = column_profiles.get_profiles(engine, requested)
+            return "\n\n".join(
+                column_profiles.describe_table(snapshot.tables[t], profiles.get(t))
+                for t in requested if t in snapshot.tables
+            )
+        except Exception as e:
+            logger.warning(f"Profiled schema lookup failed, falling back to sample rows: {e}")
+            return self.db.get_table_info_no_throw(requested)
+
+
+# 创建全局列概况存储实例
+column_profiles = ColumnProfileStore()
@@ -0,0 +1,187 @@
+"""
+列式查询结果
+在执行层、可视化层和 API 层之间传递，避免逐行构造字典
+"""
+
+import math
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# pyarrow 为可选依赖，仅 to_arrow 需要
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    ARROW_AVAILABLE = False
+
+
+def _object_array(values: Sequence[Any]) -> np.ndarray:
+    """构建一维 object 数组（避免 NumPy 把序列类型的值展开成多维）"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+def _infer_column(values: Sequence[Any]) -> tuple:
+    """
+    推断一列的逻辑类型并转换为 NumPy 数组
+
+    Returns:
+        (数组, 逻辑类型) 逻辑类型为 integer/float/boolean/string/decimal/datetime/mixed/null 之一
+    """
+    non_null = [v for v in values if v is not None]
+    has_null = len(non_null) < len(values)
+
+    if not non_null:
+        return _object_array(values), "null"
+
+    kinds = {type(v) for v in non_null}
+
+    if kinds <= {bool, np.bool_}:
+        if has_null:
+            return _object_array(values), "boolean"
+        return np.array(values, dtype=bool), "boolean"
+
+    if kinds <= {int, np.int64, np.int32}:
+        if has_null:
+            # 保留整数语义（例如ID列），不转成带 NaN 的浮点数
+            return _object_array(values), "integer"
+        try:
+            return np.array(values, dtype=np.int64), "integer"
+        except OverflowError:
+            return _object_array(values), "integer"
+
+    if kinds <= {int, float, np.int64, np.int32, np.float64, np.float32}:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64), "float"
+
+    if kinds <= {str}:
+        return _object_array(values), "string"
+    if kinds <= {Decimal}:
+        return _object_array(values), "decimal"
+    if kinds <= {datetime, date, time, pd.Timestamp}:
+        return _object_array(values), "datetime"
+
+    return _object_array(values), "mixed"
+
+
+class ResultSet:
+    """列式结果集：列名 + 每列一个 NumPy 数组 + 列类型元数据"""
+
+    def __init__(self, columns: List[str], arrays: List[np.ndarray], dtypes: List[str]):
+        """
+        初始化结果集
+
+        Args:
+            columns: 列名列表
+            arrays: 与 columns 一一对应的列数组
+            dtypes: 与 columns 一一对应的逻辑类型
+        """
+        self.columns = list(columns)
+        self.arrays = arrays
+        self.dtypes = dtypes
+
+    @classmethod
+    def from_rows(cls, columns: List[str], rows: Iterable[Sequence[Any]]) -> "ResultSet":
+        """从行元组构建（例如 SQLAlchemy 的 fetchall 结果）"""
+        rows = list(rows)
+        if rows:
+            transposed = list(zip(*rows))
+        else:
+            transposed = [() for _ in columns]
+
+        arrays, dtypes = [], []
+        for values in transposed:
+            array, dtype = _infer_column(values)
+            arrays.append(array)
+            dtypes.append(dtype)
+        return cls(columns, arrays, dtypes)
+
+    @classmethod
+    def from_result(cls, result) -> "ResultSet":
+        """从 SQLAlchemy CursorResult 构建"""
+        columns = list(result.keys())
+        return cls.from_rows(columns, result.fetchall())
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "ResultSet":
+        """从 DataFrame 构建，数值列直接复用其底层数组"""
+        arrays, dtypes = [], []
+        for col in df.columns:
+            series = df[col]
+            if pd.api.types.is_bool_dtype(series):
+                arrays.append(series.to_numpy())
+                dtypes.append("boolean")
+            elif pd.api.types.is_integer_dtype(series):
+                arrays.append(series.to_numpy())
+                dtypes.append("integer")
+            elif pd.api.types.is_float_dtype(series):
+                arrays.append(series.to_numpy())
+                dtypes.append("float")
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                arrays.append(_object_array(series.astype(object).where(series.notna(), None).tolist()))
+                dtypes.append("datetime")
+            else:
+                array, dtype = _infer_column(series.astype(object).where(series.notna(), None).tolist())
+                arrays.append(array)
+                dtypes.append(dtype)
+        return cls([str(c) for c in df.columns], arrays, dtypes)
+
+    @classmethod
+    def empty(cls) -> "ResultSet":
+        """空结果集"""
+        return cls([], [], [])
+
+    @property
+    def row_count(self) -> int:
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def column(self, name: str) -> np.ndarray:
+        """按列名获取列数组"""
+        return self.arrays[self.columns.index(name)]
+
+    def schema(self) -> List[Dict[str, str]]:
+        """列名与逻辑类型"""
+        return [{"name": name, "dtype": dtype} for name, dtype in zip(self.columns, self.dtypes)]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """转换为 DataFrame（直接使用列数组，不经过逐行字典）"""
+        # 按位置构建再设置列名：SQL 结果允许重复列名（如 JOIN 后的两个 id），按列名组装字典会丢列
+        df = pd.DataFrame({i: array for i, array in enumerate(self.arrays)}, copy=False)
+        df.columns = self.columns
+        return df
+
+    def column_values(self) -> List[List[Any]]:
+        """每列转换为 Python 原生值列表，NaN 转为 None，供 JSON 序列化使用"""
+        values = []
+        for array, dtype in zip(self.arrays, self.dtypes):
+            items = array.tolist()
+            if dtype == "float":
+                items = [None if isinstance(v, float) and math.isnan(v) else v for v in items]
+            values.append(items)
+        return values
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """转换为字典行列表，仅在客户端需要 records 格式时于 API 边界调用"""
+        columns = self.column_values()
+        return [dict(zip(self.columns, row)) for row in zip(*columns)]
+
+    def to_arrow(self):
+        """转换为 pyarrow.Table"""
+        if not ARROW_AVAILABLE:
+            raise RuntimeError("pyarrow is not installed")
+        return pa.Table.from_arrays([pa.array(values) for values in self.column_values()], names=self.columns)
+
+    def head(self, n: int) -> "ResultSet":
+        """前 n 行"""
+        return ResultSet(self.columns, [array[:n] for array in self.arrays], self.dtypes)
@@ -0,0 +1,228 @@
+"""
+时间分桶汇总表
+入库时检测日期列，按 日/周/月 预先汇总数值度量（按低基数维度分组），
+趋势类问题可以直接查询汇总表而不必扫描整张原始表
+
+汇总表命名为 rollup_{表名}_by_{day|week|month}，第一列为分桶列 {日期列}_{粒度}，
+其余为维度列、row_count 和每个度量的 sum_{列名}；目前只支持 SQLite 的日期函数
+"""
+
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_PREFIX = "rollup_"
+ROW_COUNT_COLUMN = "row_count"
+MEASURE_PREFIX = "sum_"
+
+# 分桶表达式：周以周一为起点
+BUCKET_EXPRESSIONS = {
+    "day": "date({column})",
+    "week": "date({column}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', {column})",
+}
+BUCKET_FORMATS = {"day": "YYYY-MM-DD", "week": "该周周一 YYYY-MM-DD", "month": "YYYY-MM"}
+GRAIN_LABELS = {"day": "日", "week": "周", "month": "月"}
+
+DATE_NAME_HINTS = ("date", "time", "day", "日期", "时间")
+NUMERIC_TYPE_HINTS = ("INT", "REAL", "FLOA", "DOUB", "NUM", "DEC")
+TEXT_TYPE_HINTS = ("CHAR", "TEXT", "CLOB", "DATE", "TIME")
+
+
+def rollup_table_name(table: str, grain: str) -> str:
+    return f"{ROLLUP_PREFIX}{table}_by_{grain}"
+
+
+def _is_id_column(name: str) -> bool:
+    lower = name.lower()
+    return lower == "id" or lower.endswith("_id") or lower.endswith("编号")
+
+
+def detect_rollup_spec(conn: Connection, table: str, max_dimension_cardinality: int = 50,
+                       max_dimensions: int = 3, max_groups_per_bucket: int = 1000,
+                       sample_size: int = 1000) -> Optional[Dict[str, Any]]:
+    """
+    检测表的日期列、数值度量和低基数维度
+
+    Args:
+        conn: 数据库连接
+        table: 表名
+        max_dimension_cardinality: 维度列的最大不同取值数
+        max_dimensions: 最多使用的维度列数
+        max_groups_per_bucket: 每个时间桶内维度组合数的上限
+        sample_size: 检测日期列时抽样的行数
+
+    Returns:
+        {"date_column", "dimensions", "measures", "types"}；没有可解析的日期列时返回 None
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    inspector = inspect(conn)
+    columns = inspector.get_columns(table)
+    pk = set(inspector.get_pk_constraint(table).get("constrained_columns") or [])
+
+    text_columns, numeric_columns, types = [], [], {}
+    for col in columns:
+        type_name = str(col["type"]).upper()
+        types[col["name"]] = type_name
+        if any(hint in type_name for hint in TEXT_TYPE_HINTS):
+            text_columns.append(col["name"])
+        elif any(hint in type_name for hint in NUMERIC_TYPE_HINTS):
+            numeric_columns.append(col["name"])
+
+    # 日期列：抽样中 90% 以上的文本值能被 date() 解析，名称带日期含义的优先
+    date_candidates = []
+    for name in text_columns:
+        non_null, parsed = conn.execute(text(
+            f"SELECT COUNT(v), COUNT(CASE WHEN typeof(v) = 'text' AND date(v) IS NOT NULL THEN 1 END) "
+            f"FROM (SELECT {quote(name)} AS v FROM {quote(table)} LIMIT {int(sample_size)})"
+        )).one()
+        if non_null and parsed / non_null >= 0.9:
+            hinted = any(hint in name.lower() for hint in DATE_NAME_HINTS)
+            date_candidates.append((not hinted, name))
+    if not date_candidates:
+        return None
+    date_column = sorted(date_candidates)[0][1]
+
+    measures = [name for name in numeric_columns if name not in pk and not _is_id_column(name)]
+
+    # 维度：低基数文本列，按基数从小到大加入，直到组合数超过上限
+    cardinalities = []
+    for name in text_columns:
+        if name == date_column or name in [c for _, c in date_candidates]:
+            continue
+        distinct = conn.execute(text(f"SELECT COUNT(DISTINCT {quote(name)}) FROM {quote(table)}")).scalar()
+        if 2 <= distinct <= max_dimension_cardinality:
+            cardinalities.append((distinct, name))
+
+    dimensions, groups = [], 1
+    for distinct, name in sorted(cardinalities):
+        if len(dimensions) >= max_dimensions or groups * distinct > max_groups_per_bucket:
+            break
+        dimensions.append(name)
+        groups *= distinct
+
+    return {"date_column": date_column, "dimensions": dimensions, "measures": measures, "types": types}
+
+
+def build_rollups(conn: Connection, table: str, grains: tuple = ("day", "week", "month"),
+                  min_rows: int = 0, max_ratio: float = 0.5, **detect_options) -> List[Dict[str, Any]]:
+    """
+    为表建立时间分桶汇总表（已存在时重建）
+
+    Args:
+        conn: 数据库连接（需可写，调用方负责提交事务）
+        table: 原始表名
+        grains: 要建立的时间粒度
+        min_rows: 原始表少于该行数时不建立
+        max_ratio: 汇总表行数超过原始表该比例时放弃该粒度
+        **detect_options: 传给 detect_rollup_spec 的参数
+
+    Returns:
+        已建立的汇总表描述列表
+    """
+    if conn.dialect.name != "sqlite":
+        logger.info(f"Skipping rollups for {table}: only SQLite date functions are supported")
+        return []
+
+    quote = conn.dialect.identifier_preparer.quote
+    base_rows = conn.execute(text(f"SELECT COUNT(*) FROM {quote(table)}")).scalar()
+    if not base_rows or base_rows < min_rows:
+        return []
+
+    spec = detect_rollup_spec(conn, table, **detect_options)
+    if spec is None:
+        return []
+
+    date_column = spec["date_column"]
+    types = spec["types"]
+    created = []
+    for grain in grains:
+        name = rollup_table_name(table, grain)
+        bucket = BUCKET_EXPRESSIONS[grain].format(column=quote(date_column))
+        bucket_column = f"{date_column}_{grain}"
+        # 显式声明列类型（CREATE TABLE AS 对表达式列不保留类型，Agent 看到的结构会缺类型）
+        columns = [(bucket_column, "TEXT", bucket)]
+        columns += [(d, types[d], quote(d)) for d in spec["dimensions"]]
+        columns.append((ROW_COUNT_COLUMN, "INTEGER", "COUNT(*)"))
+        columns += [
+            (MEASURE_PREFIX + m, "INTEGER" if "INT" in types[m] else "REAL", f"SUM({quote(m)})")
+            for m in spec["measures"]
+        ]
+        group_by = ", ".join(str(i) for i in range(1, len(spec["dimensions"]) + 2))
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {quote(name)}"))
+        conn.execute(text(
+            f"CREATE TABLE {quote(name)} ({', '.join(f'{quote(c)} {t}' for c, t, _ in columns)})"
+        ))
+        conn.execute(text(
+            f"INSERT INTO {quote(name)} SELECT {', '.join(expr for _, _, expr in columns)} "
+            f"FROM {quote(table)} WHERE {bucket} IS NOT NULL GROUP BY {group_by}"
+        ))
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {quote(name)}")).scalar()
+
+        if rows > base_rows * max_ratio:
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(name)}"))
+            logger.info(f"Dropped rollup {name}: {rows} rows for {base_rows} base rows")
+            continue
+
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {quote(f'idx_{name}_{bucket_column}')} "
+            f"ON {quote(name)} ({quote(bucket_column)})"
+        ))
+        created.append({
+            "table": name,
+            "base_table": table,
+            "grain": grain,
+            "date_column": date_column,
+            "dimensions": spec["dimensions"],
+            "measures": spec["measures"],
+            "rows": rows,
+        })
+        logger.info(f"Created rollup {name}: {rows} rows (base {base_rows})")
+    return created
+
+
+def describe_rollups(tables: Dict[str, Dict[str, Any]], max_measures: int = 8) -> str:
+    """
+    根据元数据目录中的表结构生成汇总表说明，供 Agent 提示词使用
+
+    Args:
+        tables: {表名: 元数据目录中的表信息}
+        max_measures: 每个汇总表最多列出的度量数
+
+    Returns:
+        说明文本；没有汇总表时返回空字符串
+    """
+    pattern = re.compile(rf"^{ROLLUP_PREFIX}(?P<base>.+)_by_(?P<grain>day|week|month)$")
+    lines = []
+    for name in sorted(tables):
+        match = pattern.match(name)
+        columns = [col["name"] for col in tables[name]["columns"]]
+        if not match or not columns:
+            continue
+        grain = match.group("grain")
+        bucket_column = columns[0]
+        date_column = bucket_column[:-len(grain) - 1] if bucket_column.endswith(f"_{grain}") else bucket_column
+        measures = [c for c in columns if c.startswith(MEASURE_PREFIX)]
+        dimensions = [c for c in columns[1:] if c != ROW_COUNT_COLUMN and c not in measures]
+        measure_text = ", ".join([ROW_COUNT_COLUMN] + measures[:max_measures])
+        if len(measures) > max_measures:
+            measure_text += f" 等 {len(measures)} 个度量（sum_ 加原列名）"
+        lines.append(
+            f"- {name}：{match.group('base')} 按 {date_column} 的{GRAIN_LABELS[grain]}汇总，"
+            f"分桶列 {bucket_column}（{BUCKET_FORMATS[grain]}）；"
+            f"维度 {', '.join(dimensions) or '无'}；度量 {measure_text}"
+        )
+    if not lines:
+        return ""
+
+    return "\n".join(lines) + (
+        "\n按日/周/月统计趋势、\"最近N天\"等问题优先查询这些汇总表而不是原始表："
+        "汇总时对 sum_* 和 row_count 再求 SUM，平均值用 SUM(sum_x) / SUM(row_count)，"
+        "只在需要明细字段或汇总表没有的维度时才查询原始表。"
+    )
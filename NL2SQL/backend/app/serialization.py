@@ -0,0 +1,92 @@
+"""
+查询结果的快速序列化
+提供列式 JSON 载荷和基于 orjson 的响应类，跳过 pydantic 的逐单元格校验
+"""
+
+import json
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence
+
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# orjson 为可选依赖，不可用时回退到标准库 json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+
+def _default(value: Any) -> Any:
+    """处理编码器原生不支持的类型"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if hasattr(value, "item"):
+        # numpy / pandas 标量
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def fast_dumps(payload: Any) -> bytes:
+    """
+    将对象序列化为 UTF-8 JSON 字节串
+
+    Args:
+        payload: 待序列化对象
+
+    Returns:
+        JSON 字节串
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(
+            payload,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(payload, ensure_ascii=False, default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """使用 fast_dumps 编码的 JSON 响应"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return fast_dumps(content)
+
+
+def build_columnar_payload(columns: List[str], column_values: Sequence[Sequence[Any]],
+                           **fields: Any) -> Dict[str, Any]:
+    """
+    构建列式响应载荷
+
+    列名只出现一次，数据按列组织为值数组：
+    {"format": "columnar", "columns": [...], "data": [[列1的值...], [列2的值...]], ...}
+
+    Args:
+        columns: 列名列表
+        column_values: 与 columns 一一对应的列值数组
+        **fields: 其余响应字段（answer, sql, reasoning 等）
+
+    Returns:
+        响应字典
+    """
+    row_count = len(column_values[0]) if column_values else 0
+    payload = dict(fields)
+    payload.update({
+        "format": "columnar",
+        "columns": columns,
+        "data": column_values,
+        "returned_rows": row_count,
+        "total_rows": row_count,
+    })
+    return payload
+
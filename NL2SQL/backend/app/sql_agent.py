@@ -1,21 +1,70 @@
+import asyncio
+import contextvars
 import pandas as pd
 import tempfile
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain.agents import create_agent  # 新的 API！
 from sqlalchemy import create_engine, text
+from langchain_core.messages import ToolMessage
+import time
 import logging
+from app.config import settings
+from app.database import stream_rows
+from app.async_database import run_query, stream_query
+from app.engine_registry import async_driver_available, engine_registry
+from app.result_set import ResultSet
+from app.catalog import metadata_catalog
+from app.sqlite_profile import install_sqlite_profile, read_only_url
+from app.index_advisor import index_advisor
+from app.materialization import materialization_manager
+from app.rollups import MEASURE_PREFIX, ROLLUP_PREFIX, build_rollups, describe_rollups
+from app.profiles import ProfiledSchemaTool, column_profiles
+from app.value_index import ValueSearchTool, value_index
+from app.column_pruning import ColumnPruningMiddleware, count_tokens, pruning_stats, select_columns
+from app.table_retrieval import CandidateListTablesTool, TableSearchTool, table_retriever
+from app.join_graph import join_graphs
+from app.metrics import MetricQueryTool, metric_catalogs, render_sql
+from app.tool_compaction import CompactQueryTool, ScratchpadPruningMiddleware
+from app.model_router import FAST_TIER, LARGE_TIER, count_touched_tables, model_router
+from app.llm_resilience import ProviderUnavailableError, ResilientModelMiddleware, answer_cache, resilience_stats
+from app.agent_budget import REASON_LABELS, AgentBudget, BudgetMiddleware, budget_stats
 
 logger = logging.getLogger(__name__)
 
 
+class QuestionState:
+    """单个问题执行期间的状态（预算、候选表、已取回的结果等），每次 query_data 一份"""
+
+    def __init__(self):
+        self.budget = AgentBudget()  # 步数、token 和时间预算
+        self.candidate_tables: Optional[List[str]] = None  # 候选表（表检索），None 表示不限制
+        self.retrieval: Optional[Tuple[str, Optional[List[str]]]] = None  # (问题, 候选表)，同一问题只检索一次
+        self.prompt: Optional[Tuple[str, Optional[str]]] = None  # (问题, 按问题生成的系统提示)
+        self.prompt_tokens: Optional[Dict[str, int]] = None  # 提示词 token 数（表检索和宽表列裁剪前后）
+        self.model_tier: Optional[str] = None  # 最终使用的模型档位
+        self.results: Dict[str, ResultSet] = {}  # sql_db_query 已取回的完整结果 {SQL: 结果集}
+
+
+# 当前问题的状态：同一个 Agent 上可能同时运行多个问题（同一数据集的并发请求、关闭准入控制时），
+# 状态不能放在 SQLAgentManager 实例上，而是由 query_data 设置到上下文中，工具和中间件从上下文读取
+_question_state: contextvars.ContextVar[Optional[QuestionState]] = contextvars.ContextVar(
+    "question_state", default=None)
+
+
+def current_question() -> Optional[QuestionState]:
+    """当前上下文中正在回答的问题的状态，不在 query_data 中时返回 None"""
+    return _question_state.get()
+
+
 class SQLAgentManager:
     """管理LangChain SQL Agent的创建和执行"""
 
-    def __init__(self, openai_api_key: Optional[str] = None, openai_base_url: Optional[str] = None, model: str = "qwen-plus"):
+    def __init__(self, openai_api_key: Optional[str] = None, openai_base_url: Optional[str] = None,
+                 model: str = "qwen-plus", dataset_id: Optional[str] = None):
         """
         初始化SQL Agent管理器
 
@@ -23,39 +72,59 @@ class SQLAgentManager:
             openai_api_key: OpenAI API密钥
             openai_base_url: OpenAI Base URL
             model: 使用的模型名称
+            dataset_id: 数据集ID（上传文件为 file_id，配置的数据库为 None），用于查找指标目录
         """
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
         self.openai_base_url = openai_base_url or os.getenv("OPENAI_BASE_URL")
         self.model = model
         self.llm = None
+        self.fast_model = None
+        self.fast_llm = None  # 小模型档位（模型路由），None 表示所有问题都使用 model
         self.agent_executor = None
+        self.fast_agent_executor = None
         self.db_connection = None
         self.temp_db_path = None
+        self.schema_version = None
+        self.source_key = None  # 上传文件数据源标识（索引顾问、物化管理使用）
+        self._system_prompt = None
+        self._full_prompt_tokens: Optional[Tuple[int, int]] = None  # (结构版本, 完整系统提示 token 数)
+        self.dataset_id = dataset_id
 
         if self.openai_api_key:
             self._initialize_llm()
 
     def _initialize_llm(self):
-        """初始化LLM"""
+        """初始化LLM（配置了模型路由时同时初始化小模型档位）"""
         try:
-            # 构建ChatOpenAI参数
-            kwargs = {
-                "model": self.model,
-                "temperature": 0.0,
-                "api_key": self.openai_api_key
-            }
-
-            # 如果设置了自定义base_url，添加到参数中
-            if self.openai_base_url:
-                kwargs["base_url"] = self.openai_base_url
-
-            self.llm = ChatOpenAI(**kwargs)
+            self.llm = self._build_llm(self.model)
             logger.info(f"LLM initialized successfully with model: {self.model}")
             if self.openai_base_url:
                 logger.info(f"Using custom base URL: {self.openai_base_url}")
+
+            fast_model = model_router.models()[FAST_TIER]
+            if fast_model and fast_model != self.model:
+                self.fast_model = fast_model
+                self.fast_llm = self._build_llm(fast_model)
+                logger.info(f"Fast tier LLM initialized with model: {fast_model}")
         except Exception as e:
             logger.error(f"Error initializing LLM: {str(e)}")
 
+    def _build_llm(self, model: str) -> ChatOpenAI:
+        # 构建ChatOpenAI参数（重试由 ResilientModelMiddleware 负责，客户端不再自行重试）
+        kwargs = {
+            "model": model,
+            "temperature": 0.0,
+            "api_key": self.openai_api_key,
+            "timeout": settings.llm_request_timeout,
+            "max_retries": 0
+        }
+
+        # 如果设置了自定义base_url，添加到参数中
+        if self.openai_base_url:
+            kwargs["base_url"] = self.openai_base_url
+
+        return ChatOpenAI(**kwargs)
+
     def create_database_from_file(self, file_content: bytes, file_type: str,
                                  table_name: str = "data_table") -> Dict[str, Any]:
         """
@@ -94,8 +163,41 @@ class SQLAgentManager:
             # 将数据写入数据库
             df.to_sql(table_name, engine, if_exists='replace', index=False)
 
+            # 检测到日期列时预先建立 日/周/月 汇总表，趋势问题不必扫描全表
+            if settings.rollups_enabled:
+                try:
+                    with engine.begin() as conn:
+                        build_rollups(
+                            conn, table_name,
+                            min_rows=settings.rollup_min_rows,
+                            max_dimension_cardinality=settings.rollup_max_dimension_cardinality,
+                        )
+                except Exception as e:
+                    logger.warning(f"Failed to build rollups for {table_name}: {e}")
+            engine.dispose()
+
+            # 查询引擎以只读方式打开；索引顾问会在后台为该库建索引，因此不能声明 immutable
+            query_engine = create_engine(read_only_url(db_uri))
+            install_sqlite_profile(
+                query_engine,
+                cache_size_kb=settings.sqlite_cache_size_kb,
+                mmap_size=settings.sqlite_mmap_size,
+            )
+            self.db_connection = query_engine
+
             # 创建SQLDatabase对象
-            self.db = SQLDatabase.from_uri(db_uri)
+            self.db = SQLDatabase(query_engine)
+
+            # 上传的数据没有任何索引，由索引顾问根据查询记录自动建立
+            self.source_key = metadata_catalog.source_key(query_engine)
+            index_advisor.register_source(self.source_key, db_uri, query_engine)
+            materialization_manager.register_source(self.source_key, db_uri, query_engine)
+
+            # 入库时即建立文本列取值索引，首次提问和输入联想不必再扫描原始表
+            try:
+                value_index.build(query_engine, [table_name])
+            except Exception as e:
+                logger.warning(f"Failed to build value index for {table_name}: {e}")
 
             logger.info(f"Database created successfully with table '{table_name}'")
 
@@ -140,29 +242,106 @@ class SQLAgentManager:
             if not hasattr(self, 'db'):
                 return {"success": False, "error": "Database not created"}
 
-            # 默认系统提示
-            default_system_prompt = f"""你是一个专业的数据分析师，专门帮助用户查询和分析 {self.db.dialect} 数据库。
+            prompt = system_prompt or self._default_system_prompt()
+            self._system_prompt = system_prompt
+
+            tools = self._build_tools(self.llm)
+            logger.info(f"创建 SQL Agent，可用工具: {[tool.name for tool in tools]}")
+
+            # 预算检查放在最前，预算用完时不再调用模型；
+            # 使用默认提示时按问题检索候选表、裁剪宽表的列（自定义提示保持原样）
+            middleware = [BudgetMiddleware(lambda: current_question() and current_question().budget)]
+            if system_prompt is None and (settings.column_pruning_enabled or settings.table_retrieval_enabled):
+                middleware.append(ColumnPruningMiddleware(self._question_system_prompt))
+            if settings.scratchpad_pruning_enabled:
+                middleware.append(ScratchpadPruningMiddleware(
+                    settings.scratchpad_max_tokens, settings.scratchpad_keep_recent))
+
+            # 使用新的 create_agent API（不会触发 transformers 依赖）
+            # 对冲、重试和熔断放在最后，最靠近模型调用；单次请求超时和重试不超过问题剩余的时间预算
+            remaining = lambda: current_question().budget.remaining() if current_question() else None
+            self.agent_executor = create_agent(
+                model=self.llm,
+                tools=tools,
+                system_prompt=prompt,
+                middleware=middleware + [ResilientModelMiddleware(self.model, remaining)]
+            )
+            # 小模型档位使用相同的提示词、工具和中间件（sql_db_query_checker 也使用小模型）
+            self.fast_agent_executor = None
+            if self.fast_llm is not None:
+                self.fast_agent_executor = create_agent(
+                    model=self.fast_llm,
+                    tools=self._build_tools(self.fast_llm),
+                    system_prompt=prompt,
+                    middleware=middleware + [ResilientModelMiddleware(self.fast_model, remaining)]
+                )
+
+            return {"success": True, "message": "SQL Agent created successfully"}
+
+        except Exception as e:
+            logger.error(f"Error creating SQL agent: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "error": str(e)}
+
+    def _build_tools(self, llm) -> list:
+        """创建 Agent 使用的工具列表"""
+        # 创建 SQL 工具包
+        toolkit = SQLDatabaseToolkit(db=self.db, llm=llm)
+        # sql_db_schema 改为返回预先统计的列概况，不再每次抽取示例行；
+        # sql_db_list_tables 在表检索生效时只返回当前问题的候选表；
+        # sql_db_query 只把结果摘要交给模型，完整结果留给接口响应
+        replacements = {
+            "sql_db_schema": lambda: ProfiledSchemaTool(db=self.db),
+            "sql_db_list_tables": lambda: CandidateListTablesTool(
+                db=self.db, get_candidates=self._candidate_tables),
+            "sql_db_query": lambda: CompactQueryTool(
+                db=self.db, execute=self._run_sql, on_result=self._keep_result),
+        }
+        tools = [
+            replacements[tool.name]() if tool.name in replacements else tool
+            for tool in toolkit.get_tools()
+        ]
+        tools += [ValueSearchTool(db=self.db, get_candidates=self._candidate_tables),
+                  TableSearchTool(db=self.db)]
+        if self._metric_context():
+            tools.append(MetricQueryTool(db=self.db, dataset_id=self.dataset_id))
+        return tools
+
+    def _default_system_prompt(self, columns: Optional[Dict[str, List[str]]] = None,
+                               tables: Optional[List[str]] = None) -> str:
+        """
+        默认系统提示，附带来自元数据目录的表结构概要
+
+        Args:
+            columns: {表名: 列名}，宽表只写入这些列
+            tables: 只写入这些表（表检索得到的候选表），默认全部可用表
+        """
+        prompt = f"""你是一个专业的数据分析师，专门帮助用户查询和分析 {self.db.dialect} 数据库。
 
 你有以下工具可以使用：
 - sql_db_list_tables: 列出数据库中的所有表
-- sql_db_schema: 查看特定表的结构和示例数据
-- sql_db_query: 执行 SQL 查询并返回结果
+- sql_db_schema: 查看特定表的结构和列概况（不同值数量、常见取值、取值范围、空值比例）
+- sql_db_query: 执行 SQL 查询，返回结果摘要（行数、列统计、前几行），完整结果会直接展示给用户
 - sql_db_query_checker: 在执行前检查 SQL 查询的正确性
+- sql_value_search: 按关键词查找文本列中的真实取值（如品牌、类别、产品名）
+- sql_table_search: 按关键词在表名、列名和注释中查找表
 
 **执行步骤：**
-1. **重要**: 使用 sql_db_list_tables 查看数据库中实际的表名（绝对不要猜测表名或使用 "table" 作为表名）
-2. 使用 sql_db_schema 查看表的结构和列名
+1. **重要**: 如果下方提供了"数据库结构概要"，直接使用其中的真实表名；否则使用 sql_db_list_tables 查看数据库中实际的表名（绝对不要猜测表名或使用 "table" 作为表名）
+2. 结构概要已包含列名和类型；需要知道列的取值（如类别名称、日期范围）时查看下方"列概况"或使用 sql_db_schema，不要用 SELECT DISTINCT 探查
 3. 仔细理解用户问题，提取关键信息：
    - 如果用户要求"前N条"、"显示N条"、"N个"，SQL 必须使用 LIMIT N
    - 如果用户没有指定数量，默认使用 LIMIT 10
    - 如果用户要求"所有"、"全部"，可以不加 LIMIT 或使用较大值
-4. 根据步骤1和2查到的实际表名和列名，生成准确的 SQL 查询
-5. 使用 sql_db_query_checker 检查 SQL 正确性
-6. 使用 sql_db_query 执行查询
+4. 问题中提到具体的品牌、类别、产品、城市等名称时，先用 sql_value_search 找到列中的真实取值，用 = 或 IN 精确筛选，不要猜测 LIKE 模式
+5. 根据步骤1和2查到的实际表名和列名，生成准确的 SQL 查询
+6. 使用 sql_db_query_checker 检查 SQL 正确性
+7. 使用 sql_db_query 执行查询
 
 **重要约束：**
 - 只使用 SELECT 语句，禁止 INSERT/UPDATE/DELETE
-- **必须先调用 sql_db_list_tables 查看实际表名，绝对不要使用 "table" 或猜测的表名**
+- **必须使用结构概要或 sql_db_list_tables 中的实际表名，绝对不要使用 "table" 或猜测的表名**
 - **使用查询到的真实表名编写SQL（例如：file_xxx）**
 - 必须根据用户指定的数量生成 LIMIT 子句
 - 如果出错，分析错误并重新生成 SQL
@@ -203,28 +382,186 @@ class SQLAgentManager:
   步骤2: SQL: SELECT * FROM <实际表名> ORDER BY sales DESC LIMIT 5 
   步骤3: 报告：列出TOP5产品及其销售额，并分析"""
 
-            prompt = system_prompt or default_system_prompt
+        schema_context = self._schema_context(columns, tables)
+        if schema_context:
+            prompt += f"\n\n**数据库结构概要（已缓存，可直接使用）：**\n{schema_context}"
+        join_context = self._join_context(tables)
+        if join_context:
+            prompt += f"\n\n**表关联路径（多表查询直接使用这些 JOIN 条件，不必逐个查看表结构）：**\n{join_context}"
+        if tables is not None:
+            prompt += (f"\n\n注意：数据库共有 {len(self.db.get_usable_table_names())} 张表，"
+                       "上面只列出了与当前问题相关的候选表；如果候选表中没有需要的数据，"
+                       "先用 sql_table_search 按关键词查找其他表，不要猜测表名。")
+        if columns:
+            prompt += ("\n\n注意：列较多的表只列出了与当前问题最相关的列；"
+                       "如果需要未列出的列，先用 sql_db_schema 查看该表的完整列，不要猜测列名。")
+
+        metric_context = self._metric_context()
+        if metric_context:
+            prompt += ("\n\n**业务指标（统一口径，问题涉及这些指标时优先调用 metric_query，"
+                       f"不要自己推导计算公式）：**\n{metric_context}")
+
+        profile_context = self._profile_context(columns, tables)
+        if profile_context:
+            prompt += f"\n\n**列概况（预先统计，可直接用于筛选条件）：**\n{profile_context}"
+
+        rollup_context = self._rollup_context(tables)
+        if rollup_context:
+            prompt += f"\n\n**时间汇总表（趋势类问题优先使用）：**\n{rollup_context}"
+        return prompt
+
+    def _schema_context(self, columns: Optional[Dict[str, List[str]]] = None,
+                        tables: Optional[List[str]] = None) -> str:
+        """从元数据目录生成表结构概要，并记录对应的结构版本"""
+        try:
+            snapshot = metadata_catalog.get_snapshot(self.db._engine)
+            self.schema_version = snapshot.version
+            names = tables if tables is not None else list(self.db.get_usable_table_names())
+            return metadata_catalog.schema_digest(self.db._engine, names, columns=columns)
+        except Exception as e:
+            logger.warning(f"Failed to build schema digest: {e}")
+            return ""
 
-            # 创建 SQL 工具包
-            toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
-            tools = toolkit.get_tools()
+    def _join_context(self, tables: Optional[List[str]] = None) -> str:
+        """提示词中各表之间的最短关联路径（外键 + 列名推断）"""
+        try:
+            names = tables if tables is not None else self.db.get_usable_table_names()
+            names = [t for t in names if not t.startswith(ROLLUP_PREFIX)][:50]
+            if len(names) < 2:
+                return ""
+            return join_graphs.get_graph(self.db._engine).describe_paths(names)
+        except Exception as e:
+            logger.warning(f"Failed to describe join paths: {e}")
+            return ""
 
-            logger.info(f"创建 SQL Agent，可用工具: {[tool.name for tool in tools]}")
+    def _metric_context(self) -> str:
+        """数据集指标目录中可用的指标和维度"""
+        try:
+            catalog = metric_catalogs.get(self.dataset_id)
+            return catalog.describe(self.db.get_usable_table_names()) if catalog else ""
+        except Exception as e:
+            logger.warning(f"Failed to describe metric catalog: {e}")
+            return ""
 
-            # 使用新的 create_agent API（不会触发 transformers 依赖）
-            self.agent_executor = create_agent(
-                model=self.llm,
-                tools=tools,
-                system_prompt=prompt
+    def _profile_context(self, columns: Optional[Dict[str, List[str]]] = None,
+                         tables: Optional[List[str]] = None) -> str:
+        """表数量（或候选表数量）较少时直接在提示词中提供列概况"""
+        try:
+            names = tables if tables is not None else self.db.get_usable_table_names()
+            tables = [t for t in names if not t.startswith(ROLLUP_PREFIX)]
+            if not tables or len(tables) > settings.profile_prompt_max_tables:
+                return ""
+            snapshot = metadata_catalog.get_snapshot(self.db._engine)
+            profiles = column_profiles.get_profiles(self.db._engine, tables)
+            return "\n".join(
+                column_profiles.describe_table(snapshot.tables[t], profiles.get(t),
+                                               max_values=settings.profile_prompt_max_values,
+                                               columns=(columns or {}).get(t))
+                for t in tables if t in profiles
             )
+        except Exception as e:
+            logger.warning(f"Failed to build column profiles: {e}")
+            return ""
 
-            return {"success": True, "message": "SQL Agent created successfully"}
+    def _question_system_prompt(self, question: str) -> Optional[str]:
+        """
+        按问题检索候选表、裁剪宽表列后的系统提示，并记录前后的 token 数；
+        同一问题的多步模型调用（以及小模型失败后升级到大模型）复用同一个提示，前后步骤看到的列一致
+
+        Returns:
+            按问题生成的提示；表数量和列数都未超过阈值时返回 None（使用默认提示）
+        """
+        state = current_question() or QuestionState()
+        if state.prompt is None or state.prompt[0] != question:
+            state.prompt = (question, self._build_question_prompt(question, state))
+        return state.prompt[1]
 
+    def _build_question_prompt(self, question: str, state: QuestionState) -> Optional[str]:
+        try:
+            engine = self.db._engine
+            usable = list(self.db.get_usable_table_names())
+            state.candidate_tables = self._retrieve_tables(question, usable)
+            snapshot = metadata_catalog.get_snapshot(engine)
+            names = state.candidate_tables if state.candidate_tables is not None else usable
+            tables = {t: snapshot.tables[t] for t in names if t in snapshot.tables}
+            wide = [t for t, table in tables.items()
+                    if len(table["columns"]) > settings.column_pruning_min_columns] \
+                if settings.column_pruning_enabled else []
+            if not wide and state.candidate_tables is None:
+                state.prompt_tokens = None
+                return None
+
+            base_tables = [t for t in wide if not t.startswith(ROLLUP_PREFIX)]
+            # 汇总表的分桶列和维度列是查询它的前提，总是保留
+            pinned = {
+                t: [col["name"] for col in tables[t]["columns"] if not col["name"].startswith(MEASURE_PREFIX)]
+                for t in wide if t.startswith(ROLLUP_PREFIX)
+            }
+            columns = None
+            if wide:
+                profiles = column_profiles.get_profiles(engine, base_tables)
+                indexes = value_index.build(engine, base_tables)
+                columns = select_columns(question, {t: tables[t] for t in wide}, profiles, indexes,
+                                         settings.column_pruning_top_k, settings.column_pruning_min_columns,
+                                         settings.column_pruning_min_keep, pinned)
+
+            full_tokens = self._full_prompt_token_count(snapshot.version)
+            prompt = self._default_system_prompt(columns, state.candidate_tables)
+            pruned_tokens = count_tokens(prompt)
+            pruning_stats.record(full_tokens, pruned_tokens)
+            state.prompt_tokens = {"full": full_tokens, "pruned": pruned_tokens}
+            kept = ", ".join(f"{t}: {len(c)}/{len(tables[t]['columns'])}" for t, c in (columns or {}).items())
+            logger.info(f"Question schema prompt {full_tokens} -> {pruned_tokens} tokens, "
+                        f"tables {len(tables)}/{len(usable)}, kept columns {kept or '-'}")
+            return prompt
         except Exception as e:
-            logger.error(f"Error creating SQL agent: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return {"success": False, "error": str(e)}
+            logger.warning(f"Table retrieval / column pruning failed, using full schema: {e}")
+            state.candidate_tables = None
+            return None
+
+    def _retrieve_tables(self, question: str, usable: List[str]) -> Optional[List[str]]:
+        """当前问题的候选表：模型路由和按问题生成提示都需要，同一问题只检索一次"""
+        state = current_question()
+        if state is None:
+            return table_retriever.retrieve(self.db._engine, question, usable)
+        if state.retrieval is None or state.retrieval[0] != question:
+            state.retrieval = (question, table_retriever.retrieve(self.db._engine, question, usable))
+        return state.retrieval[1]
+
+    @staticmethod
+    def _candidate_tables() -> Optional[List[str]]:
+        """当前问题的候选表（供工具使用），不在问题中或未检索时返回 None"""
+        state = current_question()
+        return state.candidate_tables if state else None
+
+    def _full_prompt_token_count(self, version: int) -> int:
+        """未经表检索和列裁剪的完整系统提示的 token 数（用于统计节省比例），按结构版本缓存"""
+        if self._full_prompt_tokens is None or self._full_prompt_tokens[0] != version:
+            self._full_prompt_tokens = (version, count_tokens(self._default_system_prompt()))
+        return self._full_prompt_tokens[1]
+
+    def _rollup_context(self, tables: Optional[List[str]] = None) -> str:
+        """可用的（或候选表中的）时间分桶汇总表说明"""
+        try:
+            snapshot = metadata_catalog.get_snapshot(self.db._engine)
+            usable = set(tables if tables is not None else self.db.get_usable_table_names())
+            return describe_rollups({name: t for name, t in snapshot.tables.items() if name in usable})
+        except Exception as e:
+            logger.warning(f"Failed to describe rollup tables: {e}")
+            return ""
+
+    def _refresh_agent_if_schema_changed(self):
+        """数据库结构变化后重建 Agent，使提示词中的结构概要保持最新"""
+        if self.schema_version is None or not hasattr(self, 'db'):
+            return
+        try:
+            snapshot = metadata_catalog.get_snapshot(self.db._engine)
+        except Exception as e:
+            logger.warning(f"Failed to check schema version: {e}")
+            return
+        if snapshot.version != self.schema_version:
+            logger.info(f"Schema changed (version {self.schema_version} -> {snapshot.version}), rebuilding SQL Agent")
+            self.create_sql_agent(self._system_prompt)
 
     def query_data(self, question: str) -> Dict[str, Any]:
         """
@@ -236,14 +573,24 @@ class SQLAgentManager:
         Returns:
             查询结果
         """
+        # 每个问题使用独立的状态，同一 Agent 上并发的问题互不影响
+        token = _question_state.set(QuestionState())
+        try:
+            return self._answer_question(question, _question_state.get())
+        finally:
+            _question_state.reset(token)
+
+    def _answer_question(self, question: str, state: QuestionState) -> Dict[str, Any]:
         try:
             if not self.agent_executor:
                 return {"success": False, "error": "SQL Agent not created"}
 
-            # 使用新的 invoke 格式
-            result = self.agent_executor.invoke({
-                "messages": [{"role": "user", "content": question}]
-            })
+            self._refresh_agent_if_schema_changed()
+            budget = state.budget
+
+            # 按问题复杂度选择模型档位，小模型失败时升级到大模型
+            result = self._invoke_agent(question)
+            budget_stats.record(budget)
 
             # 从返回的 messages 中提取最后一条（agent 的回复）
             messages = result.get("messages", [])
@@ -332,13 +679,28 @@ class SQLAgentManager:
                             else:
                                 tables = getattr(tool_args, 'table_names', '')
                             reasoning_steps.append(f"查看表结构: {tables}")
+                        elif tool_name == 'metric_query':
+                            # 指标查询由编译器生成 SQL，按同样的参数重新编译得到展示和取数用的 SQL
+                            try:
+                                compiled, params = metric_catalogs.compile(
+                                    self.dataset_id, dict(tool_args), self.db._engine)
+                                sql_queries.append(render_sql(self.db._engine, compiled, params))
+                                reasoning_steps.append(f"按指标目录生成 SQL: {', '.join(tool_args.get('metrics', []))}")
+                            except Exception as e:
+                                logger.warning(f"Failed to compile metric query {tool_args}: {e}")
                         elif tool_name == 'sql_db_list_tables':
                             reasoning_steps.append("列出所有数据库表")
                         elif tool_name == 'sql_db_query_checker':
                             reasoning_steps.append("检查 SQL 语法正确性")
 
-            # 获取最后一个SQL查询
+            # 获取最后一个SQL查询（预算用完时优先使用最后一个成功执行的查询）
             sql = sql_queries[-1] if sql_queries else None
+            if budget.exhausted:
+                sql = next((q for q in reversed(sql_queries) if q in state.results), sql)
+
+            if self.source_key and sql_queries:
+                index_advisor.record(self.source_key, sql_queries)
+                materialization_manager.record(self.source_key, sql_queries)
             
             # 如果没有提取到推理步骤，添加默认步骤
             if not reasoning_steps:
@@ -348,35 +710,119 @@ class SQLAgentManager:
                 ]
 
             # 提取实际的查询数据
-            data = []
-            columns = []
-            if sql:
+            result_set = ResultSet.empty()
+            if sql and sql in state.results:
+                # Agent 执行该 SQL 时已取回完整结果，不再重复查询
+                result_set = state.results[sql]
+                logger.info(f"复用 Agent 查询结果，共 {result_set.row_count} 行数据")
+            elif sql:
                 try:
                     # 执行 SQL 获取实际数据
                     sql_result = self.execute_custom_sql(sql)
                     if sql_result["success"]:
-                        data = sql_result["data"]
-                        columns = sql_result["columns"]
-                        logger.info(f"成功执行 SQL，返回 {len(data)} 行数据")
+                        result_set = sql_result["result_set"]
+                        logger.info(f"成功执行 SQL，返回 {result_set.row_count} 行数据")
                 except Exception as e:
                     logger.warning(f"执行 SQL 获取数据失败: {e}")
 
+            if budget.exhausted:
+                # 预算用完：用模板回答代替分析报告
+                answer = self._budget_answer(budget, sql, result_set)
+                reasoning_steps.append(f"已达到{REASON_LABELS[budget.exhausted]}预算，返回目前的查询结果")
+            elif sql:
+                # 记住成功的回答，模型服务不可用时回退使用
+                answer_cache.put(metadata_catalog.source_key(self.db._engine), question,
+                                 {"answer": answer, "sql": sql, "reasoning": reasoning_steps})
+
             return {
                 "success": True,
                 "answer": answer or "查询完成",
                 "sql": sql,
                 "reasoning": reasoning_steps,
-                "data": data,
-                "columns": columns,
-                "returned_rows": len(data)
+                "result_set": result_set,
+                "columns": result_set.columns,
+                "returned_rows": result_set.row_count,
+                "prompt_tokens": state.prompt_tokens,
+                "model_tier": state.model_tier,
+                "degraded": True if budget.exhausted else None,
+                "budget": budget.to_dict()
             }
 
+        except ProviderUnavailableError as e:
+            logger.warning(f"LLM provider unavailable, falling back: {e}")
+            return self._fallback_answer(question, e)
         except Exception as e:
             logger.error(f"Error querying data: {str(e)}")
             import traceback
             traceback.print_exc()
             return {"success": False, "error": str(e)}
 
+    def _fallback_answer(self, question: str, error: ProviderUnavailableError) -> Dict[str, Any]:
+        """
+        模型服务不可用时的回退：先用此前相同问题的回答（重新执行其 SQL 取最新数据），
+        再尝试按指标目录直接生成 SQL；都不可用时返回失败和建议的重试等待秒数
+        """
+        cached = answer_cache.get(metadata_catalog.source_key(self.db._engine), question)
+        if cached:
+            sql_result = self.execute_custom_sql(cached["sql"])
+            if sql_result["success"]:
+                resilience_stats.incr("fallback_cached")
+                return self._fallback_result(
+                    f"（模型服务暂时不可用，以下为此前相同问题的分析，数据已重新查询）\n\n{cached['answer']}",
+                    cached["sql"], ["模型服务不可用，使用此前相同问题的回答"] + cached["reasoning"],
+                    sql_result["result_set"])
+
+        catalog = metric_catalogs.get(self.dataset_id)
+        metric = catalog.find_metric(question) if catalog else None
+        if metric is not None:
+            usable = set(self.db.get_usable_table_names())
+            dimensions = [d["name"] for d in catalog.find_dimensions(question) if d["table"] in usable]
+            # 维度无法与指标关联时只查询指标总计
+            for request in ({"metrics": [metric["name"]], "dimensions": dimensions},
+                            {"metrics": [metric["name"]]}):
+                try:
+                    metric_result = metric_catalogs.query(self.dataset_id, request, self.db._engine)
+                except Exception as e:
+                    logger.warning(f"Metric fallback failed for {request}: {e}")
+                    continue
+                resilience_stats.incr("fallback_rule")
+                by = "、".join(catalog.resolve_dimension(d)["label"] for d in request.get("dimensions", []))
+                answer = (f"模型服务暂时不可用，已按指标目录中「{metric['label']}」的统一口径直接查询"
+                          f"{f'（按{by}分组）' if by else ''}，结果见下方数据表格。")
+                return self._fallback_result(
+                    answer, metric_result["sql"], ["模型服务不可用", f"按指标目录生成 SQL: {metric['name']}"],
+                    ResultSet.from_rows(metric_result["columns"], metric_result["rows"]))
+
+        resilience_stats.incr("fallback_none")
+        return {"success": False, "error": f"模型服务暂时不可用，请稍后重试: {error}",
+                "retry_after": error.retry_after}
+
+    @staticmethod
+    def _budget_answer(budget: AgentBudget, sql: Optional[str], result_set: ResultSet) -> str:
+        """预算用完时的简短模板回答"""
+        usage = (f"已达到本次查询的{REASON_LABELS[budget.exhausted]}预算"
+                 f"（{budget.steps} 步，{budget.tokens} token，{budget.elapsed:.1f} 秒），未生成完整分析报告。")
+        if not sql:
+            return usage + "目前还没有得到可用的查询结果，请尝试简化问题后重试。"
+        if not result_set.row_count:
+            return usage + "目前得到的查询结果为空，请查看下方 SQL 或简化问题后重试。"
+        return (usage + f"以下为目前得到的查询结果：共 {result_set.row_count} 行，"
+                f"列：{'、'.join(result_set.columns)}。")
+
+    def _fallback_result(self, answer: str, sql: str, reasoning: List[str], result_set: ResultSet) -> Dict[str, Any]:
+        return {
+            "success": True,
+            "answer": answer,
+            "sql": sql,
+            "reasoning": reasoning,
+            "result_set": result_set,
+            "columns": result_set.columns,
+            "returned_rows": result_set.row_count,
+            "prompt_tokens": None,
+            "model_tier": None,
+            "degraded": True
+        }
+
     def get_table_schema(self) -> Dict[str, Any]:
         """
         获取数据库表结构信息
@@ -407,6 +853,77 @@ class SQLAgentManager:
             logger.error(f"Error getting table schema: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    def _route_question(self, question: str) -> str:
+        """选择模型档位：复杂度规则 + 问题涉及的表结构范围（候选表数量、问题直接提到的表数量）"""
+        if self.fast_agent_executor is None:
+            return LARGE_TIER
+        try:
+            engine = self.db._engine
+            table_names = list(self.db.get_usable_table_names())
+            scope = self._retrieve_tables(question, table_names) or table_names
+            tables = metadata_catalog.get_snapshot(engine).tables
+            touched = count_touched_tables(question, [tables[t] for t in scope if t in tables])
+        except Exception as e:
+            logger.warning(f"Failed to measure schema breadth for routing: {e}")
+            scope, touched = [], 0
+        return model_router.route(question, len(scope), touched)
+
+    def _invoke_agent(self, question: str) -> Dict[str, Any]:
+        """
+        按选择的档位运行 Agent；小模型抛出异常、SQL 执行失败或没有生成 SQL 时用大模型重新运行
+
+        Returns:
+            Agent 运行结果（包含 messages）
+        """
+        tier = self._route_question(question)
+        executors = {FAST_TIER: self.fast_agent_executor, LARGE_TIER: self.agent_executor}
+        while True:
+            start = time.perf_counter()
+            try:
+                # recursion_limit 是步数预算之外的兜底（每步包含模型和工具两个节点）
+                result = executors[tier].invoke(
+                    {"messages": [{"role": "user", "content": question}]},
+                    config={"recursion_limit": settings.agent_max_steps * 2 + 10}
+                )
+                error = None
+            except Exception as e:
+                if tier == LARGE_TIER:
+                    model_router.record(tier, (time.perf_counter() - start) * 1000, 0, 0, False)
+                    raise
+                result, error = {"messages": []}, e
+
+            messages = result.get("messages", [])
+            input_tokens = output_tokens = 0
+            for msg in messages:
+                usage = getattr(msg, "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+            failed = error is not None or self._agent_failed(messages)
+            model_router.record(tier, (time.perf_counter() - start) * 1000, input_tokens, output_tokens, not failed)
+
+            if tier == FAST_TIER and failed and settings.model_routing_escalate and not self._budget_exhausted():
+                logger.info(f"Fast tier failed ({error or 'no successful SQL'}), escalating to {self.model}")
+                model_router.record_escalation(tier)
+                tier = LARGE_TIER
+                continue
+            if error is not None:
+                raise error
+            if current_question():
+                current_question().model_tier = tier
+            return result
+
+    def _budget_exhausted(self) -> bool:
+        """当前问题的预算已经用完（此时不再升级到大模型重新运行）"""
+        state = current_question()
+        return state is not None and state.budget.check() is not None
+
+    @staticmethod
+    def _agent_failed(messages: List[Any]) -> bool:
+        """Agent 没有执行任何查询，或最后一次查询返回错误"""
+        outputs = [msg for msg in messages
+                   if isinstance(msg, ToolMessage) and msg.name in ("sql_db_query", "metric_query")]
+        return not outputs or str(outputs[-1].content).startswith("Error")
+
     def execute_custom_sql(self, sql_query: str) -> Dict[str, Any]:
         """
         执行自定义SQL查询
@@ -418,34 +935,16 @@ class SQLAgentManager:
             查询结果
         """
         try:
-            # 优先使用 db（LangChain SQLDatabase），否则使用 db_connection（直接的 Engine）
-            engine = None
-            if hasattr(self, 'db') and self.db:
-                engine = self.db._engine
-            elif hasattr(self, 'db_connection') and self.db_connection:
-                engine = self.db_connection
-
-            if not engine:
+            if not self._get_query_engine():
                 return {"success": False, "error": "Database connection not established"}
 
-            # 使用SQLAlchemy执行查询
-            with engine.connect() as conn:
-                result = conn.execute(text(sql_query))
-
-                # 获取列名
-                columns = list(result.keys())
-
-                # 获取数据
-                rows = result.fetchall()
-
-                # 转换为字典列表
-                data = [dict(zip(columns, row)) for row in rows]
+            result_set = self._run_sql(sql_query)
 
             return {
                 "success": True,
-                "data": data,
-                "columns": columns,
-                "row_count": len(data)
+                "result_set": result_set,
+                "columns": result_set.columns,
+                "row_count": result_set.row_count
             }
 
         except Exception as e:
@@ -454,10 +953,107 @@ class SQLAgentManager:
             traceback.print_exc()
             return {"success": False, "error": str(e)}
 
+    def _run_sql(self, sql_query: str) -> ResultSet:
+        """执行SQL并返回列式结果集（失败时抛出异常），能由汇总表回答的聚合查询改写为读取汇总表"""
+        engine = self._get_query_engine()
+        sql_query = materialization_manager.rewrite(self.source_key, sql_query)
+        with engine.connect() as conn:
+            return ResultSet.from_result(conn.execute(text(sql_query)))
+
+    def _keep_result(self, sql_query: str, result_set: ResultSet):
+        """保存 sql_db_query 取回的完整结果，供 query_data 直接返回"""
+        state = current_question()
+        if state is not None:
+            state.results[sql_query.strip()] = result_set
+
+    def stream_custom_sql(self, sql_query: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        以服务端游标流式执行自定义SQL查询（用于大结果集导出）
+
+        Args:
+            sql_query: SQL查询语句
+            batch_size: 每批行数，默认使用配置中的 export_batch_size
+
+        Returns:
+            查询结果，其中 batches 为逐批产出行元组列表的迭代器
+        """
+        engine = self._get_query_engine()
+        if not engine:
+            return {"success": False, "error": "Database connection not established"}
+
+        sql_query = materialization_manager.rewrite(self.source_key, sql_query)
+        return stream_rows(engine, sql_query, batch_size or settings.export_batch_size)
+
+    async def execute_custom_sql_async(self, sql_query: str) -> Dict[str, Any]:
+        """
+        execute_custom_sql 的异步版本：查询引擎由注册表共享且安装了异步驱动时在异步引擎上执行，
+        否则（上传文件的临时库等）在线程池中执行同步版本
+
+        Args:
+            sql_query: SQL查询语句
+
+        Returns:
+            查询结果
+        """
+        db_url = self._async_db_url()
+        if db_url is None:
+            return await asyncio.to_thread(self.execute_custom_sql, sql_query)
+
+        try:
+            result_set = await run_query(db_url, await self._rewrite_async(sql_query))
+            return {
+                "success": True,
+                "result_set": result_set,
+                "columns": result_set.columns,
+                "row_count": result_set.row_count
+            }
+        except Exception as e:
+            logger.error(f"Error executing SQL: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def stream_custom_sql_async(self, sql_query: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        stream_custom_sql 的异步版本（选择引擎的规则与 execute_custom_sql_async 相同），
+        使用异步引擎时返回的 batches 为异步迭代器
+        """
+        db_url = self._async_db_url()
+        if db_url is None:
+            return await asyncio.to_thread(self.stream_custom_sql, sql_query, batch_size)
+        return await stream_query(db_url, await self._rewrite_async(sql_query), batch_size)
+
+    def _async_db_url(self) -> Optional[str]:
+        """可以使用共享异步引擎时返回查询引擎的URL，否则返回 None"""
+        engine = self._get_query_engine()
+        if engine is None or not engine_registry.is_shared(engine):
+            return None
+        db_url = engine.url.render_as_string(hide_password=False)
+        return db_url if async_driver_available(db_url) else None
+
+    async def _rewrite_async(self, sql_query: str) -> str:
+        """汇总表改写（检查基表是否变化时会访问数据库，放到线程池中执行）"""
+        if self.source_key is None:
+            return sql_query
+        return await asyncio.to_thread(materialization_manager.rewrite, self.source_key, sql_query)
+
+    def _get_query_engine(self):
+        """获取执行查询用的引擎：优先使用 db（LangChain SQLDatabase），否则使用 db_connection（直接的 Engine）"""
+        if hasattr(self, 'db') and self.db:
+            return self.db._engine
+        if hasattr(self, 'db_connection') and self.db_connection:
+            return self.db_connection
+        return None
+
     def cleanup(self):
         """清理临时文件"""
         try:
+            if self.source_key:
+                index_advisor.forget_source(self.source_key)
+                materialization_manager.forget_source(self.source_key)
             if self.db_connection:
+                column_profiles.forget(self.db_connection)
+                value_index.forget(self.db_connection)
+                table_retriever.forget(self.db_connection)
+                join_graphs.forget(self.db_connection)
                 self.db_connection.dispose()
             if self.temp_db_path and os.path.exists(self.temp_db_path):
                 os.unlink(self.temp_db_path)
@@ -0,0 +1,130 @@
+"""
+SQLite 连接性能配置
+在每个新建的 DBAPI 连接上设置 PRAGMA：读写连接使用 WAL、较大的页缓存和内存映射读；
+查询连接以只读方式打开（mode=ro，只生成一次的临时库可用 immutable=1）并开启 query_only
+"""
+
+import logging
+from typing import Optional
+from urllib.parse import quote
+
+from sqlalchemy import event, make_url
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE_KB = 64 * 1024  # 每个连接 64MB 页缓存
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024  # 256MB 内存映射读
+
+
+def is_file_sqlite_url(db_url: str) -> bool:
+    """是否为文件型 SQLite URL（内存库不适用只读/WAL）"""
+    url = make_url(db_url)
+    return url.get_backend_name() == "sqlite" and bool(url.database) and url.database != ":memory:"
+
+
+def read_only_url(db_url: str, immutable: bool = False) -> str:
+    """
+    将文件型 SQLite URL 转换为只读 URI 形式
+
+    例如 sqlite:///./data/a.db -> sqlite:///file:./data/a.db?mode=ro&uri=true
+
+    Args:
+        db_url: SQLite 连接URL
+        immutable: 是否声明文件不会再被修改（SQLite 将跳过所有锁和变更检测，只适用于生成后不再写入的库）
+
+    Returns:
+        只读连接URL；非文件型 SQLite URL 原样返回
+    """
+    if not is_file_sqlite_url(db_url):
+        return db_url
+
+    url = make_url(db_url)
+    if url.query.get("mode") == "ro":
+        return db_url
+
+    database = url.database
+    if not database.startswith("file:"):
+        database = "file:" + quote(database)
+
+    query = dict(url.query, mode="ro", uri="true")
+    if immutable:
+        query["immutable"] = "1"
+    return url.set(database=database, query=query).render_as_string(hide_password=False)
+
+
+def is_read_only_url(db_url: str) -> bool:
+    """URL 是否以只读方式打开 SQLite"""
+    url = make_url(db_url)
+    return url.get_backend_name() == "sqlite" and url.query.get("mode") == "ro"
+
+
+def apply_pragmas(dbapi_connection, read_only: bool = False,
+                  cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                  mmap_size: int = DEFAULT_MMAP_SIZE,
+                  wal: bool = True):
+    """
+    在单个 DBAPI 连接上设置性能相关的 PRAGMA
+
+    Args:
+        dbapi_connection: sqlite3（或 aiosqlite 适配后的）连接
+        read_only: 是否为只读查询连接（不切换日志模式，开启 query_only）
+        cache_size_kb: 页缓存大小（KB）
+        mmap_size: 内存映射读取的最大字节数，0 表示关闭
+        wal: 读写连接是否切换到 WAL 日志模式（持久化到数据库文件）
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if wal and not read_only:
+            # WAL 下读不阻塞写；synchronous=NORMAL 在 WAL 模式下仍保证数据库一致性
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_profile(engine: Engine, read_only: Optional[bool] = None,
+                           cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                           mmap_size: int = DEFAULT_MMAP_SIZE,
+                           wal: bool = True) -> bool:
+    """
+    为 SQLite 引擎注册 connect 事件，每个新连接建立时应用 PRAGMA 配置
+
+    Args:
+        engine: SQLAlchemy 引擎（异步引擎传入其 sync_engine）
+        read_only: 是否为只读查询引擎，默认根据URL中的 mode=ro 判断
+        cache_size_kb: 页缓存大小（KB）
+        mmap_size: 内存映射读取的最大字节数
+        wal: 读写连接是否切换到 WAL 日志模式
+
+    Returns:
+        是否已安装（非 SQLite 引擎返回 False）
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+
+    db_url = engine.url.render_as_string(hide_password=False)
+    if read_only is None:
+        read_only = is_read_only_url(db_url)
+    # 内存库没有日志文件和可映射的文件
+    in_memory = not is_file_sqlite_url(db_url)
+
+    def _on_connect(dbapi_connection, connection_record):
+        try:
+            apply_pragmas(
+                dbapi_connection,
+                read_only=read_only,
+                cache_size_kb=cache_size_kb,
+                mmap_size=0 if in_memory else mmap_size,
+                wal=wal and not in_memory,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to apply SQLite pragmas: {e}")
+
+    event.listen(engine, "connect", _on_connect)
+    return True
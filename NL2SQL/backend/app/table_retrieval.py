@@ -0,0 +1,272 @@
+"""
+表检索索引
+外部数据库常有上百张表，提示词放不下全部结构；用元数据目录中的表名、列名和注释建立本地 BM25 索引（纯 CPU，
+不依赖向量模型），每个问题只挑出少数候选表写入提示词，sql_db_list_tables 也只返回候选表，
+模型需要其他表时可调用 sql_table_search 按关键词查找。元数据目录的结构版本变化时自动重建索引
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool, ListSQLDatabaseTool
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+from sqlalchemy.engine import Engine
+
+from app.catalog import SchemaSnapshot, metadata_catalog
+from app.config import settings
+from app.join_graph import join_graphs
+from app.rollups import ROLLUP_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 各字段的词项权重（以重复次数计入词频）：表名最能说明表的用途
+FIELD_WEIGHTS = {"table": 3, "table_comment": 2, "column": 1, "column_comment": 1}
+
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+
+
+def _stem(word: str) -> str:
+    """简单的英文复数还原，使 orders 与 order 可以匹配"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """
+    词项列表（保留重复）：驼峰和下划线拆分后的英文/数字单词 + 中文 bigram（单字词保留原字）
+
+    Args:
+        value: 表名、列名、注释或问题文本
+
+    Returns:
+        词项列表
+    """
+    if not value:
+        return []
+    lowered = _CAMEL.sub(r"\1 \2", str(value)).lower()
+    tokens = [_stem(word) for word in _WORD.findall(lowered)]
+    for run in _CJK_RUN.findall(lowered):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def table_document(table: Dict[str, Any]) -> List[str]:
+    """表的检索文档：表名、表注释、列名和列注释的词项，按字段权重重复"""
+    tokens = tokenize(table["name"]) * FIELD_WEIGHTS["table"]
+    tokens += tokenize(table.get("comment")) * FIELD_WEIGHTS["table_comment"]
+    for col in table["columns"]:
+        tokens += tokenize(col["name"]) * FIELD_WEIGHTS["column"]
+        tokens += tokenize(col.get("comment")) * FIELD_WEIGHTS["column_comment"]
+    return tokens
+
+
+class TableIndex:
+    """一个数据源的 BM25 表索引（倒排表：词项 -> [(表序号, 词频)]）"""
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], version: Any = None):
+        self.version = version
+        self.names = [name for name in tables if not name.startswith(ROLLUP_PREFIX)]
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._lengths: List[int] = []
+        for doc_id, name in enumerate(self.names):
+            counts = Counter(table_document(tables[name]))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings[term].append((doc_id, tf))
+        total = len(self.names)
+        self._avg_length = sum(self._lengths) / total if total else 0.0
+        self._idf = {
+            term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        按 BM25 得分检索与查询相关的表
+
+        Args:
+            query: 问题或关键词
+            limit: 最多返回数量
+
+        Returns:
+            [(表名, 得分)]，按得分从高到低，只包含得分大于 0 的表
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self._postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.names[item[0]]))
+        return [(self.names[doc_id], score) for doc_id, score in ranked[:limit]]
+
+
+class TableRetriever:
+    """按数据源维护表检索索引，并为问题挑选候选表"""
+
+    def __init__(self):
+        # {数据源标识: 索引}
+        self._indexes: Dict[str, TableIndex] = {}
+        self._lock = threading.Lock()
+        self._retrievals = 0
+        self._total_ms = 0.0
+
+    def on_schema_change(self, key: str, snapshot: SchemaSnapshot):
+        """元数据目录回调：表数量达到阈值的数据源在结构变化后立即重建索引"""
+        if not settings.table_retrieval_enabled or len(snapshot.tables) < settings.table_retrieval_min_tables:
+            self._indexes.pop(key, None)
+            return
+        self._build(key, snapshot)
+
+    def _build(self, key: str, snapshot: SchemaSnapshot) -> TableIndex:
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None and index.version == snapshot.version:
+                return index
+            start = time.perf_counter()
+            index = TableIndex(snapshot.tables, snapshot.version)
+            self._indexes[key] = index
+            logger.info(f"Built table retrieval index for {key}: {len(index)} tables "
+                        f"in {(time.perf_counter() - start) * 1000:.1f} ms (version {snapshot.version})")
+            return index
+
+    def get_index(self, engine: Engine) -> TableIndex:
+        """获取数据源的表索引，结构版本变化时重建"""
+        snapshot = metadata_catalog.get_snapshot(engine)
+        key = metadata_catalog.source_key(engine)
+        index = self._indexes.get(key)
+        if index is None or index.version != snapshot.version:
+            index = self._build(key, snapshot)
+        return index
+
+    def search(self, engine: Engine, query: str, table_names: List[str],
+               limit: int = 10) -> List[Tuple[str, float]]:
+        """在可用表中检索与查询相关的表"""
+        usable = set(table_names)
+        index = self.get_index(engine)
+        return [(name, score) for name, score in index.search(query, limit + len(index))
+                if name in usable][:limit]
+
+    def retrieve(self, engine: Engine, question: str, table_names: List[str]) -> Optional[List[str]]:
+        """
+        为问题挑选候选表：BM25 得分靠前的表，加上它们引用的表（关联图中的外键和推断关联）和对应的时间汇总表
+
+        Args:
+            engine: SQLAlchemy 引擎
+            question: 用户问题
+            table_names: 可用表名
+
+        Returns:
+            候选表名（保持 table_names 中的顺序）；表数量未达到阈值或没有命中任何表时返回 None（不限制）
+        """
+        if not settings.table_retrieval_enabled:
+            return None
+        base_tables = [t for t in table_names if not t.startswith(ROLLUP_PREFIX)]
+        if len(base_tables) < settings.table_retrieval_min_tables:
+            return None
+
+        start = time.perf_counter()
+        hits = self.search(engine, question, base_tables, settings.table_retrieval_top_k)
+        if not hits:
+            return None
+        threshold = hits[0][1] * settings.table_retrieval_min_score_ratio
+        selected = {name for name, score in hits if score >= threshold}
+
+        graph = join_graphs.get_graph(engine)
+        usable = set(table_names)
+        for name in list(selected):
+            selected.update(t for t in graph.referenced(name) if t in usable)
+        for name in table_names:
+            if name.startswith(ROLLUP_PREFIX) and any(
+                    name.startswith(f"{ROLLUP_PREFIX}{base}_by_") for base in selected):
+                selected.add(name)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._retrievals += 1
+            self._total_ms += elapsed_ms
+        logger.info(f"Retrieved {len(selected)}/{len(table_names)} tables in {elapsed_ms:.1f} ms: "
+                    f"{', '.join(f'{name}({score:.2f})' for name, score in hits)}")
+        return [t for t in table_names if t in selected]
+
+    def forget(self, engine: Engine):
+        """删除数据源的表索引"""
+        self._indexes.pop(metadata_catalog.source_key(engine), None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "indexed_sources": len(self._indexes),
+                "indexed_tables": sum(len(index) for index in self._indexes.values()),
+                "retrievals": self._retrievals,
+                "avg_retrieval_ms": round(self._total_ms / self._retrievals, 3) if self._retrievals else None,
+            }
+
+
+class CandidateListTablesTool(ListSQLDatabaseTool):
+    """sql_db_list_tables 的替代实现：当前问题有候选表时只返回候选表"""
+
+    get_candidates: Callable[[], Optional[List[str]]]
+
+    def _run(self, tool_input: str = "", run_manager=None) -> str:
+        candidates = self.get_candidates()
+        if not candidates:
+            return super()._run(tool_input, run_manager)
+        total = len(self.db.get_usable_table_names())
+        return (f"{', '.join(candidates)}\n"
+                f"（数据库共 {total} 张表，以上为与当前问题相关的候选表；需要其他表时用 sql_table_search 按关键词查找）")
+
+
+class _TableSearchInput(BaseModel):
+    keywords: str = Field(
+        ...,
+        description="Keywords describing the tables you need, e.g. 'refund order, 退款'",
+    )
+
+
+class TableSearchTool(BaseSQLDatabaseTool, BaseTool):
+    """按关键词在表名、列名和注释中检索表"""
+
+    name: str = "sql_table_search"
+    description: str = (
+        "Search the database for tables whose name, columns or comments match the keywords. "
+        "Use it when the candidate tables you were given do not contain the data you need. "
+        "Input is a comma-separated list of keywords."
+    )
+    args_schema: Type[BaseModel] = _TableSearchInput
+
+    def _run(self, keywords: str, run_manager=None) -> str:
+        tables = list(self.db.get_usable_table_names())
+        hits = table_retriever.search(self.db._engine, keywords.replace(",", " "), tables,
+                                      settings.table_retrieval_top_k)
+        if not hits:
+            return f"没有找到与 {keywords} 相关的表"
+        return metadata_catalog.schema_digest(self.db._engine, [name for name, _ in hits])
+
+
+# 创建全局表检索实例，并在元数据目录结构变化时刷新索引
+table_retriever = TableRetriever()
+metadata_catalog.add_listener(table_retriever.on_schema_change)
@@ -0,0 +1,241 @@
+"""
+Agent 工具输出压缩
+LangChain 的 sql_db_query 把完整查询结果转成字符串交给模型，几百行的结果会占用数千 token，
+且之后每一步都要重新发送。这里的 sql_db_query 替代实现把完整结果集留给接口响应，
+返回给模型的是受 token 预算约束的摘要（行数、列统计、排名靠前的分组、前 N 行）；
+运行步骤较多时，ScratchpadPruningMiddleware 再把较早的工具输出缩短为摘要行
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from langchain.agents.middleware import AgentMiddleware
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_core.messages import ToolMessage
+
+from app.column_pruning import count_tokens
+from app.config import settings
+from app.result_set import ResultSet
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_DTYPES = ("integer", "float", "decimal")
+# 单元格最多显示的字符数
+MAX_CELL_CHARS = 50
+# 估算原始输出 token 数时抽样的行数（LangChain 原实现输出 str(行元组列表)）
+RAW_TOKEN_SAMPLE_ROWS = 200
+
+
+def _cell(value: Any) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "NULL"
+    text_value = str(value)
+    return text_value if len(text_value) <= MAX_CELL_CHARS else text_value[:MAX_CELL_CHARS] + "…"
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.0f}" if float(value).is_integer() else f"{value:.4g}"
+
+
+def _rows_text(result_set: ResultSet, indices) -> List[str]:
+    return [" | ".join(_cell(array[i]) for array in result_set.arrays) for i in indices]
+
+
+def _column_stats(name: str, array: np.ndarray, dtype: str) -> str:
+    """单列统计：数值列给出最小/最大/平均/合计，其他列给出不同值数和最常见的取值"""
+    series = pd.Series(array, copy=False)
+    nulls = int(series.isna().sum())
+    null_text = f"，空值 {nulls}" if nulls else ""
+    if dtype in NUMERIC_DTYPES:
+        numbers = pd.to_numeric(series, errors="coerce").dropna()
+        if numbers.empty:
+            return f"- {name}: 全部为空"
+        return (f"- {name}: 最小 {_format_number(numbers.min())}，最大 {_format_number(numbers.max())}，"
+                f"平均 {_format_number(numbers.mean())}，合计 {_format_number(numbers.sum())}{null_text}")
+    counts = series.dropna().astype(str).value_counts()
+    top = "，".join(f"{_cell(value)}({count})" for value, count in counts.head(3).items())
+    return f"- {name}: {len(counts)} 个不同值{null_text}；最常见 {top}"
+
+
+def summarize_result(result_set: ResultSet, preview_rows: int, max_tokens: int) -> str:
+    """
+    生成给模型看的查询结果摘要
+
+    结果不超过 preview_rows 行时原样列出；否则给出列统计、按第一个数值列排名靠前的行和前几行，
+    并在超过 max_tokens 时逐步减少示例行
+
+    Args:
+        result_set: 完整查询结果
+        preview_rows: 最多列出的示例行数
+        max_tokens: 摘要的 token 上限
+
+    Returns:
+        摘要文本
+    """
+    rows = result_set.row_count
+    if rows == 0:
+        return "查询成功，结果为空（0 行）"
+
+    header = " | ".join(result_set.columns)
+    if rows <= preview_rows:
+        lines = [f"共 {rows} 行：", header] + _rows_text(result_set, range(rows))
+        text_value = "\n".join(lines)
+        if count_tokens(text_value) <= max_tokens:
+            return text_value
+
+    stats = [_column_stats(name, array, dtype)
+             for name, array, dtype in zip(result_set.columns, result_set.arrays, result_set.dtypes)]
+
+    # 分组类结果（既有文本列又有数值列）：按第一个数值列（跳过 ID 列）给出排名靠前的行
+    ranking = []
+    numeric = [i for i, dtype in enumerate(result_set.dtypes)
+               if dtype in NUMERIC_DTYPES and not result_set.columns[i].lower().endswith("id")]
+    if numeric and len(numeric) < len(result_set.columns):
+        column = numeric[0]
+        values = pd.to_numeric(pd.Series(result_set.arrays[column], copy=False), errors="coerce")
+        top = values.sort_values(ascending=False, na_position="last").index[:5]
+        ranking = [f"按 {result_set.columns[column]} 从高到低的前 {len(top)} 行：", header] \
+            + _rows_text(result_set, top)
+
+    shown = min(preview_rows, rows)
+    while True:
+        lines = [f"共 {rows} 行，{len(result_set.columns)} 列（完整结果已直接展示给用户，无需再查询全部明细）。",
+                 "列统计："] + stats
+        lines += ranking
+        lines += [f"前 {shown} 行：", header] + _rows_text(result_set, range(shown))
+        text_value = "\n".join(lines)
+        if count_tokens(text_value) <= max_tokens or shown <= 3:
+            return text_value
+        shown = max(3, shown // 2)
+
+
+def estimate_raw_tokens(result_set: ResultSet) -> int:
+    """估算 LangChain 原实现（str(行元组列表)）输出的 token 数：按抽样行等比例推算"""
+    rows = result_set.row_count
+    if rows == 0:
+        return 0
+    sample = min(rows, RAW_TOKEN_SAMPLE_ROWS)
+    columns = [array[:sample].tolist() for array in result_set.arrays]
+    return int(count_tokens(str(list(zip(*columns)))) * rows / sample)
+
+
+class CompactionStats:
+    """工具输出压缩统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._results = 0
+            self._raw_tokens = 0
+            self._summary_tokens = 0
+            self._pruned_messages = 0
+            self._pruned_tokens = 0
+
+    def record_result(self, raw_tokens: int, summary_tokens: int):
+        with self._lock:
+            self._results += 1
+            self._raw_tokens += raw_tokens
+            self._summary_tokens += summary_tokens
+
+    def record_prune(self, saved_tokens: int):
+        with self._lock:
+            self._pruned_messages += 1
+            self._pruned_tokens += saved_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = 1 - self._summary_tokens / self._raw_tokens if self._raw_tokens else None
+            return {
+                "query_results": self._results,
+                "raw_tokens": self._raw_tokens,
+                "summary_tokens": self._summary_tokens,
+                "saved_ratio": round(saved, 4) if saved is not None else None,
+                "pruned_messages": self._pruned_messages,
+                "pruned_tokens": self._pruned_tokens,
+            }
+
+
+compaction_stats = CompactionStats()
+
+
+class CompactQueryTool(QuerySQLDatabaseTool):
+    """
+    sql_db_query 的替代实现：完整结果集交给 on_result（由接口响应使用），
+    返回给模型的是压缩后的摘要
+    """
+
+    description: str = (
+        "Execute a SQL query against the database and get back a summary of the result: "
+        "row count, per-column statistics, top rows and the first rows. The full result is "
+        "shown to the user directly, so do not page through rows. "
+        "If the query is not correct, an error message will be returned. "
+        "If an error is returned, rewrite the query, check the query, and try again."
+    )
+    execute: Callable[[str], ResultSet]
+    on_result: Optional[Callable[[str, ResultSet], None]] = None
+
+    def _run(self, query: str, run_manager=None) -> str:
+        try:
+            result_set = self.execute(query)
+        except Exception as e:
+            return f"Error: {e}"
+        if self.on_result is not None:
+            self.on_result(query, result_set)
+
+        summary = summarize_result(result_set, settings.tool_result_preview_rows, settings.tool_result_max_tokens)
+        raw_tokens = estimate_raw_tokens(result_set)
+        summary_tokens = count_tokens(summary)
+        compaction_stats.record_result(raw_tokens, summary_tokens)
+        logger.info(f"Compacted query result of {result_set.row_count} rows: "
+                    f"~{raw_tokens} -> {summary_tokens} tokens")
+        return summary
+
+
+class ScratchpadPruningMiddleware(AgentMiddleware):
+    """
+    运行步骤较多、消息总 token 数超过预算时，把较早的工具输出缩短为摘要行再发给模型
+    （只影响本次模型调用的输入，Agent 状态中的消息保持完整）
+    """
+
+    def __init__(self, max_tokens: int, keep_recent: int = 2, stub_chars: int = 150):
+        """
+        Args:
+            max_tokens: 消息总 token 数超过该值时开始缩短
+            keep_recent: 最近的几条工具输出保持原样
+            stub_chars: 缩短后保留的开头字符数
+        """
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.stub_chars = stub_chars
+
+    def wrap_model_call(self, request, handler):
+        messages = request.messages
+        tool_positions = [i for i, m in enumerate(messages) if isinstance(m, ToolMessage)]
+        if len(tool_positions) <= self.keep_recent:
+            return handler(request)
+
+        tokens = [count_tokens(m.text) for m in messages]
+        total = sum(tokens)
+        if total <= self.max_tokens:
+            return handler(request)
+
+        pruned = list(messages)
+        for i in tool_positions[:-self.keep_recent] if self.keep_recent else tool_positions:
+            if total <= self.max_tokens:
+                break
+            content = messages[i].text
+            if len(content) <= self.stub_chars * 2:
+                continue
+            stub = f"[较早的工具输出已省略，原长 {len(content)} 字符] {content[:self.stub_chars]}…"
+            saved = tokens[i] - count_tokens(stub)
+            pruned[i] = messages[i].model_copy(update={"content": stub})
+            total -= saved
+            compaction_stats.record_prune(saved)
+        return handler(request.override(messages=pruned))
@@ -0,0 +1,329 @@
+"""
+列取值索引
+为中低基数文本列（品牌、类别、产品名等）的不同取值建立前缀 + n-gram 内存索引，
+用于 Agent 把"苹果手机"、"华为"这类说法解析为列中的真实取值，以及前端输入联想；
+查询只访问内存索引，不访问原始表
+"""
+
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from langchain_community.tools.sql_database.tool import BaseSQLDatabaseTool
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.catalog import metadata_catalog
+from app.config import settings
+from app.profiles import column_profiles
+from app.rollups import ROLLUP_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 前缀匹配最多检查的取值数（短前缀可能命中大量取值）
+MAX_PREFIX_SCAN = 2000
+
+# 输入联想的索引状态：已建立、正在后台建立、该列不可索引
+INDEX_READY, INDEX_BUILDING, INDEX_UNAVAILABLE = "ready", "building", "unavailable"
+
+
+def normalize_text(value: str) -> str:
+    """全角转半角、转小写、去除空白，使"ＩＰｈｏｎｅ 15"与"iphone15"可以匹配"""
+    return "".join(unicodedata.normalize("NFKC", str(value)).lower().split())
+
+
+def _bigrams(value: str) -> set:
+    if len(value) < 2:
+        return {value} if value else set()
+    return {value[i:i + 2] for i in range(len(value) - 1)}
+
+
+class ColumnValueIndex:
+    """单列的取值索引：排序后的规范化取值（前缀查找）+ bigram / 单字倒排表（模糊查找）"""
+
+    def __init__(self, values: List[Tuple[Any, int]], version: Any = None):
+        self.version = version
+        self.values = [str(v) for v, _ in values]
+        self.counts = [int(n) for _, n in values]
+        normalized = [normalize_text(v) for v in self.values]
+
+        order = sorted(range(len(normalized)), key=normalized.__getitem__)
+        self._sorted_keys = [normalized[i] for i in order]
+        self._sorted_ids = order
+
+        self._gram_sizes: List[int] = []
+        self._grams: Dict[str, List[int]] = defaultdict(list)
+        self._chars: Dict[str, List[int]] = defaultdict(list)
+        for i, norm in enumerate(normalized):
+            grams = _bigrams(norm)
+            self._gram_sizes.append(len(grams))
+            for gram in grams:
+                self._grams[gram].append(i)
+            for char in set(norm):
+                self._chars[char].append(i)
+        self._normalized = normalized
+        self._by_count = sorted(range(len(self.values)), key=lambda i: -self.counts[i])
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def suggest(self, query: str, limit: int = 10, min_similarity: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        按相似度返回候选取值
+
+        完全匹配 > 前缀匹配 > n-gram 相似度（Dice 系数），同分按出现次数排序；
+        查询词包含取值（如"苹果手机"包含"苹果"）时 Dice 系数同样较高
+
+        Args:
+            query: 查询词，为空时返回最常见的取值
+            limit: 最多返回数量
+            min_similarity: 模糊匹配的最低相似度
+
+        Returns:
+            [{"value", "count", "score", "match"}]
+        """
+        needle = normalize_text(query)
+        if not needle:
+            return [self._entry(i, 0.0, "top") for i in self._by_count[:limit]]
+
+        scores: Dict[int, Tuple[float, str]] = {}
+
+        start = bisect_left(self._sorted_keys, needle)
+        for pos in range(start, min(start + MAX_PREFIX_SCAN, len(self._sorted_keys))):
+            key = self._sorted_keys[pos]
+            if not key.startswith(needle):
+                break
+            value_id = self._sorted_ids[pos]
+            scores[value_id] = (3.0, "exact") if key == needle else (2.0, "prefix")
+
+        if len(needle) == 1:
+            # 单字查询：包含该字即视为匹配
+            for value_id in self._chars.get(needle, []):
+                if value_id not in scores:
+                    scores[value_id] = (1.0 / len(self._normalized[value_id]), "contains")
+        else:
+            query_grams = _bigrams(needle)
+            common: Dict[int, int] = defaultdict(int)
+            for gram in query_grams:
+                for value_id in self._grams.get(gram, []):
+                    common[value_id] += 1
+            for value_id, shared in common.items():
+                if value_id in scores:
+                    continue
+                similarity = 2 * shared / (len(query_grams) + self._gram_sizes[value_id])
+                if similarity < min_similarity:
+                    continue
+                normalized = self._normalized[value_id]
+                if needle in normalized:
+                    scores[value_id] = (similarity + 1.0, "contains")
+                elif normalized in needle:
+                    # 取值是查询词的一部分，如"苹果手机"中的"苹果"
+                    scores[value_id] = (similarity + 0.5, "within")
+                else:
+                    scores[value_id] = (similarity, "fuzzy")
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1][0], -self.counts[item[0]]))
+        return [self._entry(i, score, match) for i, (score, match) in ranked[:limit]]
+
+    def find_in_text(self, text_value: str, limit: int = 5) -> List[str]:
+        """
+        找出在一段文本（如用户问题）中出现的取值，按出现次数排序
+
+        Args:
+            text_value: 文本
+            limit: 最多返回数量
+
+        Returns:
+            取值列表（只考虑规范化后至少两个字符的取值）
+        """
+        haystack = normalize_text(text_value)
+        candidates = set()
+        for gram in _bigrams(haystack):
+            candidates.update(self._grams.get(gram, ()))
+        hits = [i for i in candidates
+                if len(self._normalized[i]) >= 2 and self._normalized[i] in haystack]
+        hits.sort(key=lambda i: -self.counts[i])
+        return [self.values[i] for i in hits[:limit]]
+
+    def _entry(self, value_id: int, score: float, match: str) -> Dict[str, Any]:
+        return {
+            "value": self.values[value_id],
+            "count": self.counts[value_id],
+            "score": round(score, 3),
+            "match": match,
+        }
+
+
+class ValueIndexManager:
+    """按数据源管理列取值索引；可索引的列由列概况（不同值数量）决定，数据版本变化后重建"""
+
+    def __init__(self):
+        # {数据源标识: {(表名, 列名): 索引}}
+        self._indexes: Dict[str, Dict[Tuple[str, str], ColumnValueIndex]] = {}
+        self._lock = threading.Lock()
+        # 输入联想未命中索引时在后台建立：正在建立的 (数据源, 表名) 和已尝试建立过的表 {数据源: {表名}}
+        self._pending: set = set()
+        self._attempted: Dict[str, set] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="value-index")
+
+    def build(self, engine: Engine, table_names: List[str]) -> Dict[Tuple[str, str], ColumnValueIndex]:
+        """
+        为表中符合条件的文本列建立（或按需重建）取值索引
+
+        Args:
+            engine: SQLAlchemy 引擎
+            table_names: 表名列表
+
+        Returns:
+            该数据源当前的全部索引
+        """
+        key = metadata_catalog.source_key(engine)
+        indexes = self._indexes.setdefault(key, {})
+        if not settings.value_index_enabled:
+            return indexes
+
+        tables = [t for t in table_names if not t.startswith(ROLLUP_PREFIX)]
+        profiles = column_profiles.get_profiles(engine, tables)
+        quote = engine.dialect.identifier_preparer.quote
+
+        for table_name, profile in profiles.items():
+            for column, stats in profile["columns"].items():
+                if not self._indexable(stats):
+                    continue
+                current = indexes.get((table_name, column))
+                if current is not None and current.version == profile["version"]:
+                    continue
+                with self._lock:
+                    current = indexes.get((table_name, column))
+                    if current is not None and current.version == profile["version"]:
+                        continue
+                    try:
+                        start = time.perf_counter()
+                        with engine.connect() as conn:
+                            values = conn.execute(text(
+                                f"SELECT {quote(column)}, COUNT(*) FROM {quote(table_name)} "
+                                f"WHERE {quote(column)} IS NOT NULL GROUP BY {quote(column)}"
+                            )).all()
+                        indexes[(table_name, column)] = ColumnValueIndex(values, profile["version"])
+                        logger.info(f"Indexed {len(values)} values of {table_name}.{column} "
+                                    f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+                    except Exception as e:
+                        logger.warning(f"Failed to index values of {table_name}.{column}: {e}")
+        return indexes
+
+    @staticmethod
+    def _indexable(stats: Dict[str, Any]) -> bool:
+        """文本列、非日期、至少两个取值且不超过上限"""
+        type_name = stats["type"].upper()
+        is_text = any(hint in type_name for hint in ("CHAR", "TEXT", "CLOB", "STRING")) or type_name == "NULL"
+        return is_text and not stats["is_date"] and 2 <= stats["distinct"] <= settings.value_index_max_distinct
+
+    def suggest(self, engine: Engine, table_name: str, column: str, query: str,
+                limit: int = 10) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        单列输入联想，只查询内存中的索引，不访问数据库
+
+        索引未建立时在后台线程中统计列概况并建立该表的索引（数据版本由 Agent 查询路径上的 build 负责检查）
+
+        Returns:
+            (状态, 候选取值)：INDEX_READY 为已有索引；INDEX_BUILDING 为索引正在后台建立，本次返回空列表；
+            INDEX_UNAVAILABLE 为该列不可索引（非文本列或取值过多）
+        """
+        key = metadata_catalog.source_key(engine)
+        index = self._indexes.get(key, {}).get((table_name, column))
+        if index is not None:
+            return INDEX_READY, index.suggest(query, limit)
+        with self._lock:
+            if (key, table_name) not in self._pending and table_name in self._attempted.get(key, set()):
+                return INDEX_UNAVAILABLE, []
+            if (key, table_name) not in self._pending:
+                self._pending.add((key, table_name))
+                self._executor.submit(self._build_in_background, engine, key, table_name)
+        return INDEX_BUILDING, []
+
+    def _build_in_background(self, engine: Engine, key: str, table_name: str):
+        try:
+            self.build(engine, [table_name])
+        except Exception as e:
+            logger.warning(f"Failed to build value index for {table_name}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((key, table_name))
+                self._attempted.setdefault(key, set()).add(table_name)
+
+    def search(self, engine: Engine, table_names: List[str], query: str,
+               limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        在给定表已建立的索引中查找与查询词相近的取值（实体解析）
+
+        只读取已有索引，不建立索引也不检查数据版本：该方法在 Agent 调用工具时执行，
+        按需建立索引会对所有表统计列概况。索引在入库和按问题裁剪列时建立，未建立索引的列不参与查找
+
+        Returns:
+            [{"table", "column", "value", "count", "score", "match"}]，按相似度排序
+        """
+        tables = set(table_names)
+        indexes = self._indexes.get(metadata_catalog.source_key(engine), {})
+        matches = []
+        for (table_name, column), index in list(indexes.items()):
+            if table_name not in tables:
+                continue
+            for entry in index.suggest(query, limit, settings.value_index_min_similarity):
+                matches.append({"table": table_name, "column": column, **entry})
+        matches.sort(key=lambda m: (-m["score"], -m["count"]))
+        return matches[:limit]
+
+    def forget(self, engine: Engine):
+        """删除数据源的全部取值索引"""
+        key = metadata_catalog.source_key(engine)
+        self._indexes.pop(key, None)
+        with self._lock:
+            self._attempted.pop(key, None)
+
+
+class _ValueSearchInput(BaseModel):
+    keywords: str = Field(
+        ...,
+        description="Comma-separated keywords from the question, e.g. '苹果手机, 华为'",
+    )
+
+
+class ValueSearchTool(BaseSQLDatabaseTool, BaseTool):
+    """在列取值索引中查找关键词对应的真实取值，避免猜测 LIKE 模式或探查查询"""
+
+    name: str = "sql_value_search"
+    description: str = (
+        "Find the actual values stored in text columns (brand, category, product name, city ...) "
+        "that match keywords from the question. Use the returned values in WHERE conditions "
+        "instead of guessing LIKE patterns. Input is a comma-separated list of keywords."
+    )
+    args_schema: Type[BaseModel] = _ValueSearchInput
+    # 当前问题的候选表（表检索），None 时在所有表中查找
+    get_candidates: Callable[[], Optional[List[str]]] = lambda: None
+
+    def _run(self, keywords: str, run_manager=None) -> str:
+        engine = self.db._engine
+        tables = self.get_candidates() or list(self.db.get_usable_table_names())
+        lines = []
+        for keyword in [k.strip() for k in keywords.split(",") if k.strip()]:
+            matches = value_index.search(engine, tables, keyword)
+            if not matches:
+                lines.append(f"{keyword}: 没有找到相近的取值")
+                continue
+            found = "; ".join(
+                f"{m['table']}.{m['column']} = '{m['value']}'（{m['count']} 行，{m['match']}）"
+                for m in matches
+            )
+            lines.append(f"{keyword}: {found}")
+        return "\n".join(lines) or "Error: no keywords given"
+
+
+# 创建全局列取值索引实例
+value_index = ValueIndexManager()
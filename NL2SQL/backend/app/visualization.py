@@ -7,8 +7,9 @@ from plotly.utils import PlotlyJSONEncoder
 import json
 import io
 import base64
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 import logging
+from app.result_set import ResultSet
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +22,7 @@ class DataVisualizer:
     """数据可视化工具类"""
 
     @staticmethod
-    def create_chart(data: List[Dict[str, Any]], chart_type: str,
+    def create_chart(data: Union[ResultSet, List[Dict[str, Any]]], chart_type: str,
                     x_column: Optional[str] = None,
                     y_column: Optional[str] = None,
                     group_by: Optional[str] = None,
@@ -30,7 +31,7 @@ class DataVisualizer:
         创建图表
 
         Args:
-            data: 数据列表
+            data: 列式结果集或数据列表
             chart_type: 图表类型
             x_column: X轴列名
             y_column: Y轴列名
@@ -42,7 +43,7 @@ class DataVisualizer:
         """
         try:
             # 转换为DataFrame
-            df = pd.DataFrame(data)
+            df = DataVisualizer._to_dataframe(data)
 
             if df.empty:
                 return {"success": False, "error": "No data to visualize"}
@@ -71,6 +72,13 @@ class DataVisualizer:
             logger.error(f"Error creating chart: {str(e)}")
             return {"success": False, "error": str(e)}
 
+    @staticmethod
+    def _to_dataframe(data: Union[ResultSet, List[Dict[str, Any]]]) -> pd.DataFrame:
+        """结果集直接使用列数组构建DataFrame，字典列表保持原有转换方式"""
+        if isinstance(data, ResultSet):
+            return data.to_dataframe()
+        return pd.DataFrame(data)
+
     @staticmethod
     def _create_bar_chart(df: pd.DataFrame, x_column: Optional[str],
                          y_column: Optional[str], group_by: Optional[str],
@@ -263,18 +271,18 @@ class DataVisualizer:
             return {"success": False, "error": str(e)}
 
     @staticmethod
-    def create_summary_stats(data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def create_summary_stats(data: Union[ResultSet, List[Dict[str, Any]]]) -> Dict[str, Any]:
         """
         创建数据摘要统计可视化
 
         Args:
-            data: 数据列表
+            data: 列式结果集或数据列表
 
         Returns:
             摘要统计HTML
         """
         try:
-            df = pd.DataFrame(data)
+            df = DataVisualizer._to_dataframe(data)
 
             if df.empty:
                 return {"success": False, "error": "No data to analyze"}
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+SQLite 连接配置基准测试脚本
+在 sales 示例库的副本上比较默认 PRAGMA 与 app.sqlite_profile 配置下的查询耗时
+
+用法:
+    python benchmark_sqlite_profile.py [--scale 50] [--repeat 20]
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.sqlite_profile import apply_pragmas
+
+SOURCE_DB = os.path.join(os.path.dirname(__file__), "data", "sales_data.db")
+
+# 与 SQL Agent 生成的查询形态相近的分析查询
+QUERIES = {
+    "按类别汇总销售额": """
+        SELECT category, SUM(total_amount) AS revenue, COUNT(*) AS orders
+        FROM erp_orders GROUP BY category ORDER BY revenue DESC
+    """,
+    "按月统计已完成订单": """
+        SELECT substr(order_date, 1, 7) AS month, COUNT(*) AS orders, AVG(total_amount) AS avg_amount
+        FROM erp_orders WHERE status = '已完成' GROUP BY month ORDER BY month
+    """,
+    "订单关联产品库存": """
+        SELECT p.category, SUM(o.quantity) AS sold, MAX(p.stock) AS stock
+        FROM erp_orders o JOIN erp_products p ON o.product_id = p.product_id
+        GROUP BY p.category
+    """,
+    "客户消费排名": """
+        SELECT customer_name, SUM(total_amount) AS spent
+        FROM erp_orders GROUP BY customer_name ORDER BY spent DESC LIMIT 10
+    """,
+}
+
+
+def prepare_database(path: str, scale: int):
+    """复制示例库，并将订单表放大 scale 倍以便观察差异"""
+    shutil.copyfile(SOURCE_DB, path)
+    if scale <= 1:
+        return
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE _orders_seed AS SELECT * FROM erp_orders")
+    for _ in range(scale - 1):
+        conn.execute("INSERT INTO erp_orders SELECT * FROM _orders_seed")
+    conn.execute("DROP TABLE _orders_seed")
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def open_connection(path: str, profile: str) -> sqlite3.Connection:
+    """按配置打开连接：default / read_write / read_only"""
+    if profile == "read_only":
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        apply_pragmas(conn, read_only=True)
+    else:
+        conn = sqlite3.connect(path)
+        if profile == "read_write":
+            apply_pragmas(conn)
+    return conn
+
+
+def run_benchmark(path: str, profile: str, repeat: int) -> dict:
+    """每个查询执行 repeat 次（新连接 + 复用连接），返回中位耗时（毫秒）"""
+    results = {}
+    for name, sql in QUERIES.items():
+        cold, warm = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn = open_connection(path, profile)
+            conn.execute(sql).fetchall()
+            cold.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            warm.append((time.perf_counter() - start) * 1000)
+            conn.close()
+        results[name] = (statistics.median(cold), statistics.median(warm))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite PRAGMA 配置基准测试")
+    parser.add_argument("--scale", type=int, default=1, help="订单表放大倍数（默认 1，即原始数据）")
+    parser.add_argument("--repeat", type=int, default=20, help="每个查询的重复次数")
+    args = parser.parse_args()
+
+    if not os.path.exists(SOURCE_DB):
+        print(f"❌ 示例数据库不存在: {SOURCE_DB}，请先运行 init_database.py")
+        sys.exit(1)
+
+    workdir = tempfile.mkdtemp(prefix="sqlite_bench_")
+    try:
+        print("=" * 72)
+        print(f"SQLite PRAGMA 基准测试 (scale={args.scale}, repeat={args.repeat})")
+        print("=" * 72)
+
+        baseline_path = os.path.join(workdir, "baseline.db")
+        profiled_path = os.path.join(workdir, "profiled.db")
+        prepare_database(baseline_path, args.scale)
+        shutil.copyfile(baseline_path, profiled_path)
+
+        rows = sqlite3.connect(baseline_path).execute("SELECT COUNT(*) FROM erp_orders").fetchone()[0]
+        print(f"erp_orders 行数: {rows}\n")
+
+        # 先用读写配置打开一次，把副本切换到 WAL
+        open_connection(profiled_path, "read_write").close()
+
+        runs = {
+            "默认": run_benchmark(baseline_path, "default", args.repeat),
+            "读写配置": run_benchmark(profiled_path, "read_write", args.repeat),
+            "只读配置": run_benchmark(profiled_path, "read_only", args.repeat),
+        }
+
+        header = f"{'查询':<16}" + "".join(f"{label + ' 新连接/复用':>24}" for label in runs)
+        print(header)
+        print("-" * len(header))
+        for name in QUERIES:
+            line = f"{name:<16}"
+            for results in runs.values():
+                cold, warm = results[name]
+                line += f"{cold:>14.3f} /{warm:>7.3f}"
+            print(line)
+        print("\n单位：毫秒（中位数）")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
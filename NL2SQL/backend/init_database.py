@@ -4,10 +4,13 @@
 """
 
 import sqlite3
+import sys
 import pandas as pd
 import os
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(__file__))
+
 # 数据库路径
 DB_PATH = "data/sales_data.db"
 CSV_PATH = "data/电子产品销售数据.csv"
@@ -194,6 +197,27 @@ def create_database():
 
     print("✅ 索引创建完成")
 
+    create_rollups()
+
+
+def create_rollups():
+    """为带日期列的表建立 日/周/月 汇总表，供趋势类查询使用"""
+    from sqlalchemy import create_engine, inspect
+    from app.rollups import ROLLUP_PREFIX, build_rollups
+
+    engine = create_engine(f"sqlite:///{DB_PATH}")
+    try:
+        with engine.begin() as conn:
+            tables = [t for t in inspect(conn).get_table_names() if not t.startswith(ROLLUP_PREFIX)]
+            for table in tables:
+                for rollup in build_rollups(conn, table):
+                    print(f"   {rollup['table']}: {rollup['rows']} 行 "
+                          f"(按 {rollup['date_column']}，维度 {rollup['dimensions']})")
+    finally:
+        engine.dispose()
+
+    print("✅ 时间汇总表创建完成")
+
 def test_database():
     """测试数据库连接和查询"""
     print("\n测试数据库连接...")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+测试准入控制：直接执行、排队、按客户端轮转出队、429/503 拒绝、等待超时和客户端断开
+
+运行: python -m pytest -q test_admission.py
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.admission import AdmissionController, AdmissionRejected
+from app.config import settings
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(settings, "admission_enabled", True)
+
+
+def _controller(**overrides) -> AdmissionController:
+    options = dict(max_concurrent=2, per_client=1, max_queue=4, per_client_queue=2, max_wait_seconds=5)
+    options.update(overrides)
+    return AdmissionController(**options)
+
+
+async def _hold(controller, client, dataset, release: asyncio.Event, order: list):
+    """占用一个执行位直到 release 被设置，记录获得执行位的顺序"""
+    async with controller.slot(client, dataset):
+        order.append(client)
+        await release.wait()
+
+
+async def _settle():
+    # 让已创建的任务运行到各自的等待点
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_immediately_when_idle():
+    async def scenario():
+        controller = _controller()
+        async with controller.slot("a", "d1"):
+            assert controller.snapshot()["in_flight"] == 1
+        snapshot = controller.snapshot()
+        assert snapshot["in_flight"] == 0
+        assert snapshot["admitted"] == 1
+        assert snapshot["waited"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_queues_and_admits_in_round_robin_order():
+    async def scenario():
+        controller = _controller(max_concurrent=1, per_client=1, per_client_queue=3, max_queue=10)
+        release = {name: asyncio.Event() for name in ["a1", "a2", "a3", "b1"]}
+        order = []
+        holder = asyncio.Event()
+        first = asyncio.create_task(_hold(controller, "a", "d1", holder, order))
+        await _settle()
+
+        # 客户端 a 先排了三个请求，b 后到一个：出队顺序应为 a、b、a、a 而不是 a、a、a、b
+        tasks = []
+        for name, client, dataset in [("a1", "a", "d2"), ("a2", "a", "d3"), ("a3", "a", "d4"), ("b1", "b", "d5")]:
+            tasks.append(asyncio.create_task(_hold(controller, client, dataset, release[name], order)))
+            await _settle()
+        assert controller.snapshot()["queued"] == 4
+        assert controller.snapshot()["queued_by_client"] == {"a": 3, "b": 1}
+
+        holder.set()
+        await first
+        for name in ["a1", "b1", "a2", "a3"]:
+            await _settle()
+            release[name].set()
+        await asyncio.gather(*tasks)
+
+        assert order == ["a", "a", "b", "a", "a"]
+        snapshot = controller.snapshot()
+        assert snapshot["in_flight"] == 0 and snapshot["queued"] == 0
+        assert snapshot["admitted"] == 5 and snapshot["waited"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_same_dataset_runs_one_question_at_a_time():
+    async def scenario():
+        controller = _controller(max_concurrent=4, per_client=4)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(_hold(controller, client, "shared", release, order)) for client in ["a", "b"]]
+        other = asyncio.create_task(_hold(controller, "c", "other", release, order))
+        await _settle()
+
+        assert sorted(order) == ["a", "c"]
+        assert controller.snapshot()["queued"] == 1
+        release.set()
+        await asyncio.gather(*tasks, other)
+        assert sorted(order) == ["a", "b", "c"]
+
+    asyncio.run(scenario())
+
+
+def test_rejects_with_429_when_client_queue_is_full():
+    async def scenario():
+        controller = _controller(max_concurrent=1, per_client_queue=1)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(_hold(controller, "a", f"d{i}", release, order)) for i in range(2)]
+        await _settle()
+
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("a", "d9"):
+                pass
+        assert info.value.status_code == 429
+        assert int(info.value.headers["Retry-After"]) >= 1
+
+        # 其他客户端不受影响，仍可排队
+        tasks.append(asyncio.create_task(_hold(controller, "b", "d8", release, order)))
+        await _settle()
+        assert controller.snapshot()["queued"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.snapshot()["rejected_client"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_rejects_with_503_when_queue_is_full():
+    async def scenario():
+        controller = _controller(max_concurrent=1, per_client=1, max_queue=2, per_client_queue=2)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(_hold(controller, client, f"d{i}", release, order))
+                 for i, client in enumerate(["a", "b", "c"])]
+        await _settle()
+        assert controller.snapshot()["queued"] == 2
+
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("d", "d9"):
+                pass
+        assert info.value.status_code == 503
+        assert "Retry-After" in info.value.headers
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.snapshot()["rejected_full"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_wait_timeout_returns_503_and_leaves_queue():
+    async def scenario():
+        controller = _controller(max_concurrent=1, max_wait_seconds=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(_hold(controller, "a", "d1", release, []))
+        await _settle()
+
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.slot("b", "d2"):
+                pass
+        assert info.value.status_code == 503
+        snapshot = controller.snapshot()
+        assert snapshot["timeouts"] == 1
+        assert snapshot["queued"] == 0
+
+        release.set()
+        await holder
+        assert controller.snapshot()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_is_removed_from_queue():
+    async def scenario():
+        controller = _controller(max_concurrent=1)
+        release = asyncio.Event()
+        order = []
+        holder = asyncio.create_task(_hold(controller, "a", "d1", release, order))
+        await _settle()
+        waiter = asyncio.create_task(_hold(controller, "b", "d2", asyncio.Event(), order))
+        await _settle()
+        assert controller.snapshot()["queued"] == 1
+
+        # 客户端断开：排队中的请求被取消后移出队列，不会再占用执行位
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.snapshot()["queued"] == 0
+
+        release.set()
+        await holder
+        assert order == ["a"]
+        assert controller.snapshot()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_while_running_releases_slot():
+    async def scenario():
+        controller = _controller(max_concurrent=1)
+        order = []
+        running = asyncio.create_task(_hold(controller, "a", "d1", asyncio.Event(), order))
+        await _settle()
+        waiting = asyncio.create_task(_hold(controller, "b", "d2", asyncio.Event(), order))
+        await _settle()
+
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+        await _settle()
+
+        # 执行位被归还并分配给排队的请求
+        assert order == ["a", "b"]
+        assert controller.snapshot()["in_flight"] == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.snapshot()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_disabled_controller_does_not_limit(monkeypatch):
+    monkeypatch.setattr(settings, "admission_enabled", False)
+
+    async def scenario():
+        controller = _controller(max_concurrent=1, per_client=1)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(_hold(controller, "a", "d1", release, order)) for _ in range(3)]
+        await _settle()
+        assert order == ["a", "a", "a"]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.snapshot()["admitted"] == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试同一个 SQL Agent 上并发回答多个问题时，各问题的预算、候选表、提示词和查询结果互不影响
+
+运行: python -m pytest -q test_agent_state.py
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app.config import settings
+from app.sql_agent import SQLAgentManager, current_question
+
+# 问题 -> 模型应生成的 SQL（两个问题命中不同的表）
+QUESTIONS = {
+    "orders 中各 region 的 amount 合计": "SELECT region, SUM(amount) AS total FROM orders GROUP BY region ORDER BY region",
+    "customers 中各 city 的客户数": "SELECT city, COUNT(*) AS n FROM customers GROUP BY city ORDER BY city",
+}
+
+# 问题 -> 各步模型调用看到的系统提示
+seen_prompts = {}
+
+
+class QuestionModel(GenericFakeChatModel):
+    """按问题生成 SQL 的假模型：第一步调用 sql_db_query，拿到结果后给出回答；每步都记录看到的系统提示"""
+
+    def bind_tools(self, *args, **kwargs):
+        return self
+
+    def _generate(self, messages, *args, **kwargs):
+        question = next(m.content for m in messages if isinstance(m, HumanMessage))
+        seen_prompts.setdefault(question, []).append(messages[0].content)
+        # 让两个问题的步骤交错执行
+        time.sleep(0.05)
+        usage = {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110}
+        if any(isinstance(m, ToolMessage) for m in messages):
+            message = AIMessage(content=f"## 数据分析报告：{question}已完成，详见下方数据表格。", usage_metadata=usage)
+        else:
+            message = AIMessage(content="", usage_metadata=usage, tool_calls=[
+                {"name": "sql_db_query", "args": {"query": QUESTIONS[question]}, "id": f"call-{question}"}])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "model_routing_enabled", False)
+    monkeypatch.setattr(settings, "table_retrieval_enabled", True)
+    monkeypatch.setattr(settings, "table_retrieval_min_tables", 1)
+    engine = create_engine(f"sqlite:///{tmp_path / 'agent.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, region TEXT, amount REAL)"))
+        conn.execute(text("CREATE TABLE customers (id INTEGER PRIMARY KEY, city TEXT, name TEXT)"))
+        conn.execute(text("INSERT INTO orders (region, amount) VALUES ('华东', 10), ('华北', 20), ('华东', 5)"))
+        conn.execute(text("INSERT INTO customers (city, name) VALUES ('上海', 'a'), ('北京', 'b')"))
+
+    agent = SQLAgentManager()
+    agent.db = SQLDatabase(engine)
+    agent.llm = QuestionModel(messages=iter([]))
+    seen_prompts.clear()
+    assert agent.create_sql_agent()["success"]
+    yield agent
+    engine.dispose()
+
+
+def test_concurrent_questions_keep_their_own_state(manager):
+    barrier = threading.Barrier(len(QUESTIONS))
+
+    def ask(question):
+        barrier.wait()
+        return manager.query_data(question)
+
+    with ThreadPoolExecutor(max_workers=len(QUESTIONS)) as pool:
+        results = dict(zip(QUESTIONS, pool.map(ask, QUESTIONS)))
+
+    orders, customers = results["orders 中各 region 的 amount 合计"], results["customers 中各 city 的客户数"]
+    assert orders["sql"] == QUESTIONS["orders 中各 region 的 amount 合计"]
+    assert orders["result_set"].to_records() == [{"region": "华东", "total": 15.0}, {"region": "华北", "total": 20.0}]
+    assert customers["sql"] == QUESTIONS["customers 中各 city 的客户数"]
+    assert customers["result_set"].to_records() == [{"city": "上海", "n": 1}, {"city": "北京", "n": 1}]
+
+    # 每个问题只计入自己的模型调用
+    assert orders["budget"]["steps"] == 2 and customers["budget"]["steps"] == 2
+    assert orders["budget"]["tokens"] == 220 and customers["budget"]["tokens"] == 220
+
+    # 每个问题的每一步看到的都是按自己的问题生成的提示
+    for question, prompts in seen_prompts.items():
+        assert len(set(prompts)) == 1
+    assert seen_prompts["orders 中各 region 的 amount 合计"][0] != seen_prompts["customers 中各 city 的客户数"][0]
+
+    # 问题结束后状态不会留在调用方的上下文中
+    assert current_question() is None
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
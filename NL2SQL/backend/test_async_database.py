@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试异步数据库访问：查询和流式导出经 aiosqlite 异步引擎执行，没有异步驱动时回退到同步引擎
+
+运行: python -m pytest -q test_async_database.py
+"""
+
+import asyncio
+import io
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import app.async_database as async_database
+from app.async_database import AsyncDatabaseManager, run_query
+from app.engine_registry import async_driver_available, engine_registry
+from app.export import ARROW_AVAILABLE, ResultExporter
+
+pytestmark = pytest.mark.skipif(not async_driver_available("sqlite://"), reason="aiosqlite is not installed")
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, region TEXT, amount REAL)"))
+        conn.execute(text("INSERT INTO orders (region, amount) VALUES ('华东', 10.5), ('华北', 20), ('华东', 5)"))
+    engine.dispose()
+    yield url
+    asyncio.run(engine_registry.dispose_async_engine(url))
+    engine_registry.dispose(url)
+
+
+async def _collect(batches):
+    return [row for batch in [b async for b in batches] for row in batch]
+
+
+def test_execute_query_runs_on_aiosqlite(db_url):
+    async def scenario():
+        manager = AsyncDatabaseManager(db_url)
+        assert await manager.connect()
+        result = await manager.execute_query("SELECT region, SUM(amount) AS total FROM orders "
+                                             "GROUP BY region ORDER BY region")
+        assert result["success"]
+        assert result["columns"] == ["region", "total"]
+        assert result["result_set"].to_records() == [{"region": "华东", "total": 15.5},
+                                                     {"region": "华北", "total": 20.0}]
+        # 查询在异步引擎上执行（驱动为 aiosqlite）
+        assert engine_registry.get_async_engine(db_url).dialect.driver == "aiosqlite"
+
+        result_set = await run_query(db_url, "SELECT COUNT(*) AS n FROM orders")
+        assert result_set.to_records() == [{"n": 3}]
+
+        error = await manager.execute_query("SELECT * FROM missing_table")
+        assert not error["success"] and "missing_table" in error["error"]
+        manager.close()
+
+    asyncio.run(scenario())
+
+
+def test_stream_query_yields_async_batches(db_url):
+    async def scenario():
+        manager = AsyncDatabaseManager(db_url)
+        assert await manager.connect()
+        stream = await manager.stream_query("SELECT id, amount FROM orders ORDER BY id", batch_size=2)
+        assert stream["success"]
+        assert stream["columns"] == ["id", "amount"]
+        assert hasattr(stream["batches"], "__aiter__")
+        assert await _collect(stream["batches"]) == [(1, 10.5), (2, 20.0), (3, 5.0)]
+
+        failed = await manager.stream_query("SELECT * FROM missing_table")
+        assert not failed["success"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not ARROW_AVAILABLE, reason="pyarrow is not installed")
+def test_async_arrow_export_reads_all_batches(db_url):
+    import pyarrow as pa
+
+    async def scenario():
+        stream = await async_database.stream_query(db_url, "SELECT * FROM orders ORDER BY id", batch_size=2)
+        chunks = [chunk async for chunk in ResultExporter.aiter_encoded(
+            "arrow", stream["columns"], stream["batches"], stream["typed_columns"])]
+        return pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+
+    table = asyncio.run(scenario())
+    assert table.column("region").to_pylist() == ["华东", "华北", "华东"]
+    assert table.column("amount").to_pylist() == [10.5, 20.0, 5.0]
+
+
+def test_falls_back_to_sync_engine_without_driver(db_url, monkeypatch):
+    monkeypatch.setattr(async_database, "async_driver_available", lambda url: False)
+
+    async def scenario():
+        manager = AsyncDatabaseManager(db_url)
+        assert await manager.connect()
+        result = await manager.execute_query("SELECT COUNT(*) AS n FROM orders")
+        assert result["result_set"].to_records() == [{"n": 3}]
+        stream = await manager.stream_query("SELECT id FROM orders ORDER BY id")
+        assert list(stream["batches"]) == [[(1,), (2,), (3,)]]
+
+    asyncio.run(scenario())
+    assert db_url not in engine_registry._async_engines
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试 ASGI 响应压缩中间件：编码协商、小响应和不可压缩内容跳过、流式响应逐块压缩、大块在线程池中压缩
+
+运行: python -m pytest -q test_compression.py
+"""
+
+import asyncio
+import gzip
+import os
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.compression import BROTLI_AVAILABLE, ZSTD_AVAILABLE, CompressionMiddleware, compression_stats
+
+BODY = b'{"rows": [' + b", ".join(b'{"id": %d, "name": "item"}' % i for i in range(200)) + b"]}"
+
+
+def make_app(chunks, content_type=b"application/json", extra_headers=()):
+    """按 chunks 逐块发送响应体的 ASGI 应用"""
+    async def app(scope, receive, send):
+        headers = [(b"content-type", content_type), *extra_headers]
+        if len(chunks) == 1:
+            headers.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return app
+
+
+def call(app, accept_encoding="gzip", **options):
+    """经过压缩中间件调用应用，返回 (响应头, 各块响应体)"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/",
+             "headers": [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []}
+    asyncio.run(CompressionMiddleware(app, **options)(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    return headers, [m["body"] for m in messages[1:]]
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    compression_stats.reset()
+    yield
+    compression_stats.reset()
+
+
+def test_gzip_single_body():
+    headers, bodies = call(make_app([BODY]))
+    assert headers["content-encoding"] == "gzip"
+    assert headers["vary"] == "Accept-Encoding"
+    assert int(headers["content-length"]) == len(bodies[0]) < len(BODY)
+    assert gzip.decompress(bodies[0]) == BODY
+    stats = compression_stats.snapshot()["encodings"]["gzip"]
+    assert stats["responses"] == 1 and stats["bytes_in"] == len(BODY) and stats["streamed"] == 0
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br, zstd", "zstd" if ZSTD_AVAILABLE else "br" if BROTLI_AVAILABLE else "gzip"),
+    ("gzip, br", "br" if BROTLI_AVAILABLE else "gzip"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("*", "gzip"),
+])
+def test_encoding_negotiation(accept_encoding, expected):
+    headers, _ = call(make_app([BODY]), accept_encoding)
+    assert headers["content-encoding"] == expected
+
+
+@pytest.mark.parametrize("body, options, accept_encoding, reason", [
+    (b'{"ok": true}', {}, "gzip", "too_small"),
+    (BODY, {"content_type": b"image/png"}, "gzip", "not_compressible"),
+    (BODY, {"extra_headers": [(b"content-encoding", b"br")]}, "gzip", "already_encoded"),
+    (BODY, {}, "identity", "not_accepted"),
+    (BODY, {}, "", "not_accepted"),
+])
+def test_skipped_responses_pass_through(body, options, accept_encoding, reason):
+    headers, bodies = call(make_app([body], **options), accept_encoding)
+    assert headers.get("content-encoding") == ("br" if reason == "already_encoded" else None)
+    assert bodies == [body]
+    assert compression_stats.snapshot()["skipped"][reason] == 1
+
+
+def test_streamed_response_is_compressed_chunk_by_chunk():
+    chunks = [BODY[i:i + 500] for i in range(0, len(BODY), 500)]
+    headers, bodies = call(make_app(chunks, content_type=b"application/x-ndjson"))
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert len(bodies) == len(chunks)
+
+    # SYNC_FLUSH：每块到达后都能立即解压出已发送的数据
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    received = b""
+    for chunk, body in zip(chunks, bodies):
+        received += decompressor.decompress(body)
+        assert received.endswith(chunk)
+    assert received == BODY and decompressor.eof
+    assert compression_stats.snapshot()["encodings"]["gzip"]["streamed"] == 1
+
+
+def test_large_chunks_are_offloaded():
+    headers, bodies = call(make_app([BODY]), offload_size=1024)
+    assert gzip.decompress(bodies[0]) == BODY
+    assert compression_stats.snapshot()["encodings"]["gzip"]["offloaded"] == 1
+
+
+def test_non_http_scope_passes_through():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(scope["type"])
+
+    asyncio.run(CompressionMiddleware(app)({"type": "lifespan"}, None, None))
+    assert seen == ["lifespan"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+测试查询结果流式导出：CSV/NDJSON 编码，Arrow 只执行一次查询且不截断跨批次类型变化的数据
+
+运行: python -m pytest -q test_export.py
+"""
+
+import io
+import json
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.database import stream_rows
+from app.export import ARROW_AVAILABLE, ResultExporter
+
+if ARROW_AVAILABLE:
+    import pyarrow as pa
+
+needs_arrow = pytest.mark.skipif(not ARROW_AVAILABLE, reason="pyarrow is not installed")
+
+
+def _read_arrow(chunks):
+    return pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    with engine.begin() as conn:
+        # SQLite 按值存储类型：前两行 price 为整数、note 为空，之后出现小数和文本
+        conn.execute(text("CREATE TABLE items (id INTEGER, price NUMERIC, note TEXT)"))
+        conn.execute(text("INSERT INTO items VALUES (1, 10, NULL), (2, 20, NULL), "
+                          "(3, 30.5, 'x'), (4, 40.25, 'y'), (5, 50, 'z')"))
+    yield engine
+    engine.dispose()
+
+
+def test_csv_has_bom_header_and_rows():
+    chunks = list(ResultExporter.iter_csv(["名称", "n"], iter([[("a", 1)], [("b", None)]])))
+    content = b"".join(chunks).decode("utf-8")
+    assert content.startswith("\ufeff名称,n")
+    assert content.splitlines()[1:] == ["a,1", "b,"]
+
+
+def test_ndjson_one_object_per_line():
+    chunks = list(ResultExporter.iter_ndjson(["a", "b"], iter([[(1, "x")], [], [(2, Decimal("1.5"))]])))
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [{"a": 1, "b": "x"}, {"a": 2, "b": "1.5"}]
+
+
+@needs_arrow
+def test_arrow_runs_query_once_and_keeps_later_values(engine):
+    executions = []
+    event.listen(engine, "before_cursor_execute", lambda *args: executions.append(args[2]))
+
+    stream = stream_rows(engine, "SELECT id, price, note FROM items ORDER BY id", batch_size=2)
+    assert stream["typed_columns"] == [False, False, False]
+    table = _read_arrow(ResultExporter.iter_encoded("arrow", stream["columns"], stream["batches"],
+                                                    stream["typed_columns"]))
+
+    assert len(executions) == 1
+    assert table.schema.field("price").type == pa.float64()
+    assert table.column("price").to_pylist() == [10, 20, 30.5, 40.25, 50]
+    assert table.schema.field("note").type == pa.large_string()
+    assert table.column("note").to_pylist() == [None, None, "x", "y", "z"]
+
+
+@needs_arrow
+def test_arrow_typed_columns_keep_inferred_types():
+    batches = iter([[(1, "a", Decimal("1.50"))], [(2, "b", Decimal("2.25"))]])
+    table = _read_arrow(ResultExporter.iter_arrow(["id", "name", "amount"], batches, [True, True, True]))
+    assert table.schema.types == [pa.int64(), pa.large_string(), pa.decimal128(38, 2)]
+    assert table.column("amount").to_pylist() == [Decimal("1.50"), Decimal("2.25")]
+
+
+@needs_arrow
+def test_arrow_big_integers_are_exported_as_strings():
+    big = 2 ** 60
+    table = _read_arrow(ResultExporter.iter_arrow(["v"], iter([[(big,), (1,)], [(2.5,)]])))
+    assert table.schema.field("v").type == pa.large_string()
+    assert table.column("v").to_pylist() == [str(big), "1", "2.5"]
+
+
+@needs_arrow
+def test_arrow_raises_instead_of_truncating():
+    # 第一批按 float64 导出，后续批次出现超出 float64 精度的整数时不能静默丢失精度
+    chunks = ResultExporter.iter_arrow(["v"], iter([[(1,)], [(2 ** 60 + 1,)]]))
+    next(chunks)
+    with pytest.raises(ValueError):
+        list(chunks)
+
+
+@needs_arrow
+def test_arrow_empty_result_writes_schema():
+    table = _read_arrow(ResultExporter.iter_arrow(["a", "b"], iter([[]])))
+    assert table.num_rows == 0
+    assert table.schema.names == ["a", "b"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+测试汇总表改写：改写后的 SQL 与原 SQL 在基表上的结果必须一致，基表变化后不再使用过期的汇总表
+
+运行: python -m pytest -q test_materialization.py
+"""
+
+import os
+import random
+import sys
+
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.config import settings
+from app.materialization import SUMMARY_PREFIX, MaterializationManager
+
+REGIONS = ["华东", "华北", "华南", "西部"]
+PRODUCTS = ["A", "B", "C", "D", "E"]
+
+QUERIES = [
+    # SUM / COUNT(*) / COUNT(列) / AVG，amount 含 NULL，COUNT(列) 与 COUNT(*) 结果不同
+    "SELECT region, SUM(amount) AS total, COUNT(*) AS n, COUNT(amount) AS c, AVG(amount) AS avg_amount "
+    "FROM sales GROUP BY region ORDER BY region",
+    # WHERE 过滤的列不在分组列中，汇总表需要保留该列
+    "SELECT region, SUM(qty) AS qty, AVG(amount) FROM sales WHERE product IN ('A', 'C') "
+    "GROUP BY region ORDER BY region",
+    # HAVING 和 ORDER BY 中的聚合同样需要上卷
+    "SELECT product, COUNT(amount) AS c FROM sales GROUP BY product "
+    "HAVING SUM(amount) > 1000 AND AVG(qty) >= 2 ORDER BY SUM(amount) DESC",
+    # 分组列为两个维度，LIMIT 截断
+    "SELECT region, product, MIN(amount) AS lo, MAX(amount) AS hi, SUM(amount) AS total "
+    "FROM sales GROUP BY region, product ORDER BY total DESC LIMIT 5",
+]
+
+
+def _insert_rows(engine, count, seed):
+    rng = random.Random(seed)
+    rows = [
+        {
+            "region": rng.choice(REGIONS),
+            "product": rng.choice(PRODUCTS),
+            "amount": None if rng.random() < 0.1 else round(rng.uniform(1, 500), 2),
+            "qty": rng.randint(1, 5),
+        }
+        for _ in range(count)
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO sales (region, product, amount, qty) "
+                          "VALUES (:region, :product, :amount, :qty)"), rows)
+
+
+def _run(engine, sql):
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(sql))]
+
+
+def _assert_same_rows(expected, actual):
+    assert len(expected) == len(actual)
+    for expected_row, actual_row in zip(expected, actual):
+        assert len(expected_row) == len(actual_row)
+        for e, a in zip(expected_row, actual_row):
+            if isinstance(e, float) or isinstance(a, float):
+                assert a == pytest.approx(e)
+            else:
+                assert a == e
+
+
+def _wait_for_builds(manager):
+    # 汇总表在单线程池中建立，提交一个空任务并等待即可确认之前的任务都已完成
+    manager._executor.submit(lambda: None).result()
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "materialize_enabled", True)
+    monkeypatch.setattr(settings, "materialize_min_occurrences", 2)
+    monkeypatch.setattr(settings, "materialize_min_rows", 100)
+    monkeypatch.setattr(settings, "materialize_check_seconds", 3600)
+
+    url = f"sqlite:///{tmp_path / 'sales.db'}"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE sales (id INTEGER PRIMARY KEY, region TEXT, product TEXT, "
+                          "amount REAL, qty INTEGER)"))
+    _insert_rows(engine, 3000, seed=1)
+
+    manager = MaterializationManager()
+    manager.register_source(url, url, engine)
+    yield manager, url, engine
+    engine.dispose()
+
+
+def _materialize(manager, key, sql):
+    manager.record(key, [sql] * settings.materialize_min_occurrences)
+    _wait_for_builds(manager)
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_rewrite_matches_original(source, sql):
+    manager, key, engine = source
+    _materialize(manager, key, sql)
+
+    rewritten = manager.rewrite(key, sql)
+    assert SUMMARY_PREFIX in rewritten
+    _assert_same_rows(_run(engine, sql), _run(engine, rewritten))
+
+
+def test_covering_summary_answers_coarser_query(source):
+    manager, key, engine = source
+    _materialize(manager, key, QUERIES[3])
+
+    # 按 (region, product) 建立的汇总表可以回答只按 region 分组、按 product 过滤的查询
+    sql = ("SELECT region, SUM(amount) AS total, COUNT(*) AS n FROM sales "
+           "WHERE product = 'B' GROUP BY region ORDER BY region")
+    rewritten = manager.rewrite(key, sql)
+    assert SUMMARY_PREFIX in rewritten
+    _assert_same_rows(_run(engine, sql), _run(engine, rewritten))
+
+
+def test_unsupported_queries_are_not_rewritten(source):
+    manager, key, _ = source
+    _materialize(manager, key, QUERIES[0])
+
+    for sql in [
+        "SELECT region, COUNT(DISTINCT product) FROM sales GROUP BY region",
+        "SELECT region, SUM(amount) FROM sales WHERE qty > 2 GROUP BY region",  # qty 不在汇总表中
+        "SELECT region, SUM(amount * qty) FROM sales GROUP BY region",
+        "SELECT * FROM sales",
+    ]:
+        assert manager.rewrite(key, sql) == sql
+
+
+def test_stale_summary_is_not_used_until_rebuilt(source, monkeypatch):
+    manager, key, engine = source
+    sql = QUERIES[0]
+    _materialize(manager, key, sql)
+    assert SUMMARY_PREFIX in manager.rewrite(key, sql)
+
+    _insert_rows(engine, 200, seed=2)
+    monkeypatch.setattr(settings, "materialize_check_seconds", 0)
+
+    # 基表签名变化：本次返回原 SQL，汇总表在后台重建
+    assert manager.rewrite(key, sql) == sql
+    _wait_for_builds(manager)
+
+    rewritten = manager.rewrite(key, sql)
+    assert SUMMARY_PREFIX in rewritten
+    _assert_same_rows(_run(engine, sql), _run(engine, rewritten))
+
+
+def test_small_base_table_is_rejected(source, monkeypatch):
+    manager, key, _ = source
+    monkeypatch.setattr(settings, "materialize_min_rows", 10 ** 6)
+    _materialize(manager, key, QUERIES[0])
+
+    assert manager.rewrite(key, QUERIES[0]) == QUERIES[0]
+    statuses = [summary["status"] for summary in manager.report(key)[0]["summaries"]]
+    assert statuses == ["rejected"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试指标查询编译：指标 × 维度 + 筛选编译为 SQL，跨表维度按外键自动 JOIN，复合指标展开，非法请求报错
+
+运行: python -m pytest -q test_metrics.py
+"""
+
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.catalog import metadata_catalog
+from app.config import settings
+from app.metrics import MetricCatalog, MetricQueryError, compile_metric_query
+
+CATALOG = {
+    "table": "orders",
+    "metrics": {
+        "sales": {"label": "销售额", "aggregation": "sum", "expression": "amount",
+                  "filter": "status <> 'cancelled'"},
+        "order_count": {"label": "订单数", "aggregation": "count", "expression": "*"},
+        "avg_order": {"label": "客单价", "expression": "{sales} / NULLIF({order_count}, 0)"},
+        "customer_total": {"aggregation": "count", "table": "customers", "expression": "*"},
+    },
+    "dimensions": {
+        "status": {"label": "订单状态", "expression": "status"},
+        "order_date": {"label": "下单日期", "expression": "order_date", "type": "time"},
+        "city": {"label": "客户城市", "table": "customers", "expression": "city"},
+    },
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'metrics.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE customers (id INTEGER PRIMARY KEY, city TEXT)"))
+        conn.execute(text("CREATE TABLE orders (id INTEGER PRIMARY KEY, "
+                          "customer_id INTEGER REFERENCES customers(id), amount REAL, status TEXT, order_date TEXT)"))
+        conn.execute(text("INSERT INTO customers VALUES (1, '上海'), (2, '北京')"))
+        conn.execute(text("INSERT INTO orders VALUES (1, 1, 100, 'paid', '2024-01-05'), "
+                          "(2, 1, 50, 'cancelled', '2024-01-20'), (3, 2, 80, 'paid', '2024-02-03')"))
+    metadata_catalog.invalidate(engine)
+    yield engine
+    metadata_catalog.invalidate(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def catalog():
+    return MetricCatalog("test", CATALOG)
+
+
+def _run(engine, sql, params):
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(sql), params)]
+
+
+def test_metric_with_filter_and_dimension(engine, catalog):
+    sql, params = compile_metric_query(catalog, {"metrics": ["sales", "order_count"],
+                                                 "dimensions": ["status"]}, engine)
+    assert "CASE WHEN status <> 'cancelled' THEN" in sql
+    assert "GROUP BY 1" in sql and "LIMIT" in sql
+    assert _run(engine, sql, params) == [("cancelled", None, 1), ("paid", 180.0, 2)]
+
+
+def test_cross_table_dimension_joins_by_foreign_key(engine, catalog):
+    sql, params = compile_metric_query(catalog, {"metrics": "sales", "dimensions": ["city"],
+                                                 "order_by": "sales"}, engine)
+    assert 'LEFT JOIN customers ON' in sql
+    assert _run(engine, sql, params) == [("上海", 100.0), ("北京", 80.0)]
+
+
+def test_composite_metric_time_grain_and_filters(engine, catalog):
+    sql, params = compile_metric_query(catalog, {
+        "metrics": ["avg_order"],
+        "dimensions": ["order_date:month"],
+        "filters": [{"dimension": "status", "op": "in", "value": ["paid", "cancelled"]},
+                    {"dimension": "order_date", "op": "between", "value": ["2024-01-01", "2024-12-31"]}],
+    }, engine)
+    assert params == {"f0_0": "paid", "f0_1": "cancelled", "f1_0": "2024-01-01", "f1_1": "2024-12-31"}
+    assert _run(engine, sql, params) == [("2024-01", 50.0), ("2024-02", 80.0)]
+
+
+def test_limit_is_capped(engine, catalog, monkeypatch):
+    monkeypatch.setattr(settings, "metric_max_limit", 5)
+    sql, _ = compile_metric_query(catalog, {"metrics": ["order_count"], "limit": 1000}, engine)
+    assert sql.endswith("LIMIT 5")
+
+
+@pytest.mark.parametrize("request_body, message", [
+    ({"metrics": []}, "至少需要一个指标"),
+    ({"metrics": ["sales", "customer_total"]}, "指标来自不同的表"),
+    ({"metrics": ["sales"], "dimensions": ["status:month"]}, "不支持按 month 分组"),
+    ({"metrics": ["sales"], "filters": [{"dimension": "status", "op": "regexp", "value": "x"}]}, "不支持的筛选操作"),
+    ({"metrics": ["sales"], "filters": [{"dimension": "status", "op": "between", "value": ["a"]}]}, "两个取值"),
+    ({"metrics": ["sales"], "order_by": "city"}, "不在查询结果中"),
+])
+def test_invalid_requests_raise(engine, catalog, request_body, message):
+    with pytest.raises(MetricQueryError, match=message):
+        compile_metric_query(catalog, request_body, engine)
+
+
+def test_catalog_rejects_unknown_component():
+    with pytest.raises(MetricQueryError, match="未定义的指标"):
+        MetricCatalog("bad", {"table": "orders", "metrics": {"ratio": {"expression": "{missing} / 2"}}})
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+测试模型调用的熔断、重试和时间预算：熔断器状态转换，试探请求以任何方式结束后都不会卡在 HALF_OPEN
+
+运行: python -m pytest -q test_resilience.py
+"""
+
+import itertools
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.config import settings
+from app.llm_resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DeadlineExceededError,
+                                ProviderUnavailableError, ResilientModelMiddleware, resilience_stats)
+
+_names = itertools.count()
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_after_seconds", 0)
+    monkeypatch.setattr(settings, "llm_max_retries", 2)
+    monkeypatch.setattr(settings, "llm_retry_base_delay", 0.001)
+    monkeypatch.setattr(settings, "llm_retry_max_delay", 0.001)
+    monkeypatch.setattr(settings, "llm_request_timeout", 60.0)
+    monkeypatch.setattr(settings, "llm_breaker_failure_threshold", 2)
+    monkeypatch.setattr(settings, "llm_breaker_reset_seconds", 0.05)
+
+
+class FakeRequest:
+    def __init__(self, model_settings=None):
+        self.model_settings = model_settings or {}
+
+    def override(self, model_settings):
+        return FakeRequest(model_settings)
+
+
+def _handler(*outcomes):
+    """按顺序返回或抛出 outcomes 中的值，记录每次请求的 model_settings"""
+    queue = list(outcomes)
+    calls = []
+
+    def handler(request):
+        calls.append(request.model_settings)
+        outcome = queue.pop(0) if queue else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    handler.calls = calls
+    return handler
+
+
+def _middleware(get_remaining=None):
+    name = f"test-model-{next(_names)}"
+    return ResilientModelMiddleware(name, get_remaining), resilience_stats.breaker(name)
+
+
+def _open_breaker(breaker):
+    for _ in range(settings.llm_breaker_failure_threshold):
+        breaker.record_failure()
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def _wait_cooldown(breaker):
+    time.sleep(breaker.reset_seconds + 0.01)
+
+
+def test_breaker_opens_after_threshold_and_allows_one_trial():
+    breaker = CircuitBreaker("m", failure_threshold=3, reset_seconds=0.05)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.acquire() == CLOSED
+    breaker.record_failure()
+    assert breaker.snapshot()["state"] == OPEN
+    assert breaker.acquire() is None
+    assert breaker.retry_after() > 0
+
+    _wait_cooldown(breaker)
+    assert breaker.acquire() == HALF_OPEN
+    assert breaker.acquire() is None  # 同一时间只放行一个试探请求
+    assert breaker.retry_after() == 0.0
+
+
+def test_trial_success_closes_and_failure_reopens():
+    breaker = CircuitBreaker("m", failure_threshold=3, reset_seconds=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    _wait_cooldown(breaker)
+    assert breaker.acquire() == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.snapshot() == {"state": OPEN, "consecutive_failures": 4, "opened": 2}
+
+    _wait_cooldown(breaker)
+    assert breaker.acquire() == HALF_OPEN
+    breaker.record_success()
+    assert breaker.snapshot()["state"] == CLOSED
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_release_trial_allows_next_trial():
+    breaker = CircuitBreaker("m", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    _wait_cooldown(breaker)
+    assert breaker.acquire() == HALF_OPEN
+    breaker.release_trial()
+    assert breaker.snapshot()["state"] == HALF_OPEN
+    assert breaker.acquire() == HALF_OPEN
+
+
+def test_non_retryable_error_during_trial_does_not_stick_half_open():
+    middleware, breaker = _middleware()
+    _open_breaker(breaker)
+    _wait_cooldown(breaker)
+
+    with pytest.raises(ValueError):
+        middleware.wrap_model_call(FakeRequest(), _handler(ValueError("bad request")))
+    assert breaker.snapshot()["state"] == HALF_OPEN
+
+    # 下一个请求仍可作为试探请求放行，成功后熔断器关闭
+    assert middleware.wrap_model_call(FakeRequest(), _handler("ok")) == "ok"
+    assert breaker.snapshot()["state"] == CLOSED
+
+
+def test_deadline_during_trial_releases_trial():
+    middleware, breaker = _middleware(get_remaining=lambda: 0.5)
+    _open_breaker(breaker)
+    _wait_cooldown(breaker)
+
+    # 剩余时间缩短了单次超时，超时不计入熔断；剩余时间不足以重试时抛出 DeadlineExceededError
+    handler = _handler(TimeoutError("timed out"))
+    with pytest.raises(DeadlineExceededError):
+        middleware.wrap_model_call(FakeRequest(), handler)
+    assert handler.calls[0]["timeout"] <= 0.5
+    assert breaker.snapshot()["state"] == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_retryable_failure_during_trial_reopens():
+    middleware, breaker = _middleware()
+    _open_breaker(breaker)
+    _wait_cooldown(breaker)
+
+    handler = _handler(ConnectionError("reset"), "ok")
+    with pytest.raises(ProviderUnavailableError):
+        middleware.wrap_model_call(FakeRequest(), handler)
+    assert len(handler.calls) == 1  # 试探失败后熔断器重新打开，不再重试
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def test_retries_then_succeeds_when_closed():
+    middleware, breaker = _middleware()
+    handler = _handler(ConnectionError("reset"), "ok")
+    assert middleware.wrap_model_call(FakeRequest(), handler) == "ok"
+    assert len(handler.calls) == 2
+    assert breaker.snapshot()["state"] == CLOSED
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_open_breaker_rejects_without_calling_model():
+    middleware, breaker = _middleware()
+    _open_breaker(breaker)
+    handler = _handler("ok")
+    with pytest.raises(ProviderUnavailableError) as info:
+        middleware.wrap_model_call(FakeRequest(), handler)
+    assert not isinstance(info.value, DeadlineExceededError)
+    assert info.value.retry_after > 0
+    assert handler.calls == []
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试表元数据收集的截止时间：截止前完成的表返回详细信息，其余表标记为 pending，结构反射不阻塞表名列表
+
+运行: python -m pytest -q test_table_metadata.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.catalog import metadata_catalog
+from app.database import DatabaseManager
+
+TABLES = ["customers", "orders", "products"]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    db = DatabaseManager(f"sqlite:///{tmp_path / 'meta.db'}")
+    assert db.connect()
+    with db.engine.begin() as conn:
+        for name in TABLES:
+            conn.execute(text(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, label TEXT)"))
+            conn.execute(text(f"INSERT INTO {name} (label) VALUES ('a'), ('b')"))
+    metadata_catalog.invalidate(db.engine)
+    yield db
+    metadata_catalog.invalidate(db.engine)
+
+
+def test_collects_all_tables_within_deadline(manager):
+    infos = manager.collect_table_infos(timeout=10)
+    assert [info["name"] for info in infos] == TABLES
+    assert all(not info.get("pending") for info in infos)
+    assert [col["name"] for col in infos[0]["columns"]] == ["id", "label"]
+    assert infos[0]["row_count"] == 2
+
+
+def test_slow_tables_are_marked_pending(manager, monkeypatch):
+    manager.collect_table_infos(timeout=10)  # 预先反射，只让 orders 变慢
+    release = threading.Event()
+    original = DatabaseManager.get_table_info
+
+    def slow_get_table_info(self, table_name):
+        if table_name == "orders":
+            release.wait(5)
+        return original(self, table_name)
+
+    monkeypatch.setattr(DatabaseManager, "get_table_info", slow_get_table_info)
+    try:
+        start = time.perf_counter()
+        infos = manager.collect_table_infos(timeout=0.2)
+        assert time.perf_counter() - start < 1
+    finally:
+        release.set()
+
+    by_name = {info["name"]: info for info in infos}
+    assert list(by_name) == TABLES
+    assert by_name["orders"] == {"name": "orders", "pending": True}
+    assert by_name["customers"]["row_count"] == 2
+    assert by_name["products"]["columns"]
+
+
+def test_slow_reflection_lists_tables_as_pending(manager, monkeypatch):
+    release = threading.Event()
+    original = metadata_catalog.get_snapshot
+
+    def slow_snapshot(engine):
+        release.wait(5)
+        return original(engine)
+
+    monkeypatch.setattr(metadata_catalog, "get_snapshot", slow_snapshot)
+    try:
+        infos = manager.collect_table_infos(timeout=0.2)
+    finally:
+        release.set()
+
+    # 结构反射超时，表名仍然来自一次轻量的表名查询
+    assert infos == [{"name": name, "pending": True} for name in TABLES]
+
+
+def test_explicit_table_names_keep_order(manager):
+    infos = manager.collect_table_infos(["products", "missing", "customers"], timeout=10)
+    assert [info["name"] for info in infos] == ["products", "customers"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
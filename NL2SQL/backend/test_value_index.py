@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试列取值索引：完全匹配、前缀、n-gram 相似度的排序，输入联想只查询内存索引，未命中时在后台建立索引
+
+运行: python -m pytest -q test_value_index.py
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.catalog import metadata_catalog
+from app.value_index import INDEX_BUILDING, INDEX_READY, INDEX_UNAVAILABLE, ColumnValueIndex, ValueIndexManager
+
+VALUES = [("华为", 30), ("华为Mate", 5), ("小米", 20), ("苹果", 40), ("iPhone 15", 8), ("三星", 2)]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'values.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, brand TEXT, price REAL)"))
+        conn.execute(text("INSERT INTO products (brand, price) VALUES "
+                          "('华为', 1), ('小米', 2), ('华为', 3), ('苹果', 4)"))
+    metadata_catalog.invalidate(engine)
+    yield engine
+    metadata_catalog.invalidate(engine)
+    engine.dispose()
+
+
+def _values(suggestions):
+    return [(item["value"], item["match"]) for item in suggestions]
+
+
+def test_empty_query_returns_most_common_values():
+    index = ColumnValueIndex(VALUES)
+    assert [item["value"] for item in index.suggest("", limit=3)] == ["苹果", "华为", "小米"]
+    assert index.suggest("", limit=1)[0] == {"value": "苹果", "count": 40, "score": 0.0, "match": "top"}
+
+
+def test_exact_match_ranks_before_prefix():
+    index = ColumnValueIndex(VALUES)
+    assert _values(index.suggest("华为"))[:2] == [("华为", "exact"), ("华为Mate", "prefix")]
+
+
+def test_query_is_normalized():
+    # 全角、大小写和空白不影响匹配
+    index = ColumnValueIndex(VALUES)
+    assert _values(index.suggest("ＩＰＨＯＮＥ15")) == [("iPhone 15", "exact")]
+
+
+def test_query_containing_value_matches_by_ngram():
+    index = ColumnValueIndex(VALUES)
+    assert _values(index.suggest("苹果手机")) == [("苹果", "within")]
+    # 词序不同时按 bigram 的 Dice 系数模糊匹配，低于 min_similarity 的取值被过滤
+    assert _values(index.suggest("mate华为")) == [("华为", "within"), ("华为Mate", "fuzzy")]
+    assert _values(index.suggest("mate华为", min_similarity=0.5)) == [("华为Mate", "fuzzy")]
+
+
+def test_single_character_matches_contained_values():
+    index = ColumnValueIndex(VALUES)
+    result = index.suggest("米")
+    assert _values(result) == [("小米", "contains")]
+
+
+def test_limit_and_no_match():
+    index = ColumnValueIndex(VALUES)
+    assert len(index.suggest("华", limit=1)) == 1
+    assert index.suggest("诺基亚") == []
+
+
+def _wait_for_build(manager):
+    manager._executor.submit(lambda: None).result(timeout=10)
+
+
+def test_suggest_miss_builds_in_background(engine):
+    manager = ValueIndexManager()
+    release = threading.Event()
+    original = manager.build
+
+    def slow_build(engine, table_names):
+        release.wait(5)
+        return original(engine, table_names)
+
+    manager.build = slow_build
+    executions = []
+    event.listen(engine, "before_cursor_execute", lambda *args: executions.append(args[2]))
+
+    # 未命中时立即返回，不在调用方线程访问数据库，重复请求不会重复调度
+    assert manager.suggest(engine, "products", "brand", "华") == (INDEX_BUILDING, [])
+    assert manager.suggest(engine, "products", "brand", "华") == (INDEX_BUILDING, [])
+    assert executions == []
+    release.set()
+    _wait_for_build(manager)
+
+    status, suggestions = manager.suggest(engine, "products", "brand", "华")
+    assert status == INDEX_READY
+    assert suggestions[0]["value"] == "华为" and suggestions[0]["count"] == 2
+
+
+def test_suggest_non_indexable_column_is_unavailable(engine):
+    manager = ValueIndexManager()
+    assert manager.suggest(engine, "products", "price", "1") == (INDEX_BUILDING, [])
+    _wait_for_build(manager)
+    assert manager.suggest(engine, "products", "price", "1") == (INDEX_UNAVAILABLE, [])
+
+    # forget 后重新建立
+    manager.forget(engine)
+    assert manager.suggest(engine, "products", "brand", "")[0] == INDEX_BUILDING
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main(["-q", __file__]))
@@ -4,6 +4,7 @@ import json
 from typing import Dict, List, Optional, Any
 from pathlib import Path
 import logging
+from app.result_set import ResultSet
 
 logger = logging.getLogger(__name__)
 
@@ -129,14 +130,14 @@ class FileProcessor:
             # 应用限制
             result_df = df.head(limit)
 
-            # 转换为字典列表
-            data = result_df.to_dict('records')
+            # 转换为列式结果集（不构造逐行字典）
+            result_set = ResultSet.from_dataframe(result_df)
 
             return {
                 "success": True,
-                "data": data,
+                "result_set": result_set,
                 "total_rows": len(df),
-                "returned_rows": len(data),
+                "returned_rows": result_set.row_count,
                 "columns": df.columns.tolist()
             }
 